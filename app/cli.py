@@ -0,0 +1,324 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from loguru import logger
+
+
+def _bulk_validate(args: argparse.Namespace) -> int:
+    from app.services.export.outputs import resolve_targets
+    from app.services.export.zugferd.zugferd_writer import resolve_profile
+    from app.services.ingest.bulk import bulk_validate
+
+    try:
+        if args.ausgabe:
+            resolve_targets(args.ausgabe)
+        resolve_profile(args.profil)
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+
+    start = time.perf_counter()
+    total = invalid = failed = 0
+    reports = bulk_validate(
+        args.pfade,
+        export_root=args.export,
+        regelsaetze=args.regelsatz,
+        workers=args.workers,
+        targets=args.ausgabe,
+        profil=args.profil,
+    )
+    for report in reports:
+        total += 1
+        if report["fehler"]:
+            failed += 1
+        elif any(v["schwere"] == "fehler" for v in report["verstoesse"]):
+            invalid += 1
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed * 60 if elapsed else 0.0
+    logger.info(f"{total} Dateien in {elapsed:.1f}s ({rate:.0f}/min): {invalid} mit Regelverstößen, {failed} nicht lesbar")
+    return 1 if invalid or failed else 0
+
+
+def _validate_xml(args: argparse.Namespace) -> int:
+    from app.services.validation.bulk import bulk_validate_xml
+
+    start = time.perf_counter()
+    total = invalid = ungeprueft = 0
+    for report in bulk_validate_xml(args.pfade, schematron=not args.nur_xsd, workers=args.workers):
+        total += 1
+        if report["gueltig"] is False:
+            invalid += 1
+        elif report["gueltig"] is None:
+            ungeprueft += 1
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+    elapsed = time.perf_counter() - start
+    logger.info(f"{total} XML-Dateien in {elapsed:.1f}s geprüft: {invalid} ungültig, {ungeprueft} nicht vollständig geprüft")
+    if ungeprueft:
+        logger.warning("Validierungsartefakte fehlen, laden mit: python -m app.cli artefakte-laden")
+    return 1 if invalid or ungeprueft else 0
+
+
+def _artefakte_laden(args: argparse.Namespace) -> int:
+    from app.services.validation.artefakte import artefakte_laden
+
+    try:
+        dateien = artefakte_laden(args.ziel, nur_xsd=args.nur_xsd)
+    except (OSError, ValueError) as e:
+        logger.error(f"Laden der Artefakte fehlgeschlagen: {e}")
+        return 1
+    logger.info(f"{len(dateien)} Dateien geschrieben")
+    return 0
+
+
+def _reindex(args: argparse.Namespace) -> int:
+    from app.infrastructure.rechnungsindex import reindex
+
+    start = time.perf_counter()
+    count = reindex(args.ausgabe_verzeichnis)
+    logger.info(f"{count} Rechnungen in {time.perf_counter() - start:.1f}s indiziert")
+    return 0
+
+
+def _reexport(args: argparse.Namespace) -> int:
+    from app.infrastructure.storage import load_settings
+    from app.services.export.outputs import resolve_targets
+    from app.services.export.reexport import reexport_all
+    from app.services.export.zugferd.zugferd_writer import resolve_profile
+
+    try:
+        if args.ausgabe:
+            resolve_targets(args.ausgabe)
+        if args.profil:
+            resolve_profile(args.profil)
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+
+    start = time.perf_counter()
+    total = rebuilt = failed = 0
+    reports = reexport_all(
+        args.pfade,
+        load_settings(),
+        targets=args.ausgabe,
+        profil=args.profil,
+        erzwingen=args.erzwingen,
+        workers=args.workers,
+    )
+    for report in reports:
+        total += 1
+        if report["fehler"]:
+            failed += 1
+        elif report["neu"]:
+            rebuilt += 1
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+    logger.info(f"{total} Rechnungen in {time.perf_counter() - start:.1f}s: {rebuilt} neu exportiert, {failed} fehlgeschlagen")
+    return 1 if failed else 0
+
+
+def _fortsetzen(args: argparse.Namespace) -> int:
+    from app.infrastructure.checkpoints import offene_laeufe
+    from app.infrastructure.pipeline import process_input_file
+    from app.infrastructure.storage import load_settings
+
+    settings = load_settings()
+    total = failed = 0
+    for lauf, quelle in list(offene_laeufe(args.ausgabe_verzeichnis / "_working")):
+        total += 1
+        name = lauf.manifest["quelle"]["name"]
+        logger.info(f"Setze fort: {name} ({', '.join(lauf.stufen) or 'keine Stufe fertig'})")
+        try:
+            result = process_input_file(quelle, args.ausgabe_verzeichnis, settings)
+        except Exception as e:
+            failed += 1
+            logger.error(f"{name}: {e}")
+            result = {"status": "error", "detail": str(e)}
+        print(json.dumps({"quelle": name, **result}, ensure_ascii=False, default=str), flush=True)
+    logger.info(f"{total} offene Läufe fortgesetzt, {failed} fehlgeschlagen")
+    return 1 if failed else 0
+
+
+def _hotfolder(args: argparse.Namespace) -> int:
+    from app.infrastructure import ressourcen
+    from app.infrastructure.hotfolder import HotfolderWatcher
+    from app.infrastructure.storage import load_settings
+
+    settings = load_settings()
+    ressourcen.configure(settings)
+    watcher = HotfolderWatcher(settings, args.ausgabe_verzeichnis, ordner=args.ordner, maildirs=args.maildir)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logger.info("Beende Überwachung")
+    finally:
+        watcher.stop()
+    return 0
+
+
+def _worker(args: argparse.Namespace) -> int:
+    from app.infrastructure import engines, ressourcen
+    from app.infrastructure.storage import load_settings
+    from app.infrastructure.worker import run_worker
+
+    settings = load_settings()
+    if args.queue:
+        settings["queue_url"] = args.queue
+    ressourcen.configure(settings)
+    engines.warm_up(settings.get("vorwaermen") or [], settings, background=False)
+    try:
+        count = run_worker(settings, worker=args.id, einmal=args.einmal)
+    except KeyboardInterrupt:
+        logger.info("Beende Worker")
+        return 0
+    logger.info(f"{count} Jobs bearbeitet")
+    return 0
+
+
+def _evaluate(args: argparse.Namespace) -> int:
+    from app.infrastructure import ressourcen
+    from app.infrastructure.storage import DATA_DIR, load_settings
+    from app.services.llm.evaluation import Konfiguration, evaluiere, konfigurationen_laden, korpus
+
+    settings = load_settings()
+    ressourcen.configure(settings)
+    try:
+        if args.konfig:
+            konfigurationen = konfigurationen_laden(args.konfig)
+        else:
+            konfigurationen = [
+                Konfiguration(
+                    name=args.endpoint or Path(args.modell or settings["llm_model_path"]).name,
+                    modell=None if args.endpoint else (args.modell or settings["llm_model_path"]),
+                    endpoint=args.endpoint,
+                    modellname=args.modellname,
+                    threads=args.threads,
+                    kontext=args.kontext,
+                    prompt=str(args.prompt) if args.prompt else None,
+                )
+            ]
+    except (OSError, TypeError, ValueError) as e:
+        logger.error(f"Ungültige Konfiguration: {e}")
+        return 2
+    paare = korpus(args.korpus)
+    if not paare:
+        logger.error(f"Keine Rechnungen mit Soll-Daten in {args.korpus}")
+        return 2
+
+    berichte = []
+    for konfig in konfigurationen:
+        try:
+            bericht = evaluiere(konfig, paare, args.arbeitsordner or DATA_DIR / "evaluation", regelsaetze=args.regelsatz)
+        except Exception as e:
+            logger.error(f"Konfiguration {konfig.name} fehlgeschlagen: {e}")
+            continue
+        berichte.append(bericht)
+        logger.info(
+            f"{konfig.name}: Präzision {bericht['praezision']}, Recall {bericht['recall']}, "
+            f"Summen korrekt {bericht['summen_korrekt']}, JSON-Fehler {bericht['json_fehlerquote']}, "
+            f"p50 {bericht['latenz_s']['p50']}s, p95 {bericht['latenz_s']['p95']}s, {bericht['tokens_pro_s']} Tokens/s"
+        )
+    args.bericht.write_text(json.dumps(berichte, ensure_ascii=False, indent=2), encoding="utf-8")
+    logger.info(f"Bericht: {args.bericht}")
+    return 0 if len(berichte) == len(konfigurationen) else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Rechnung Konverter (Offline) – Kommandozeile")
+    sub = parser.add_subparsers(dest="befehl", required=True)
+
+    p = sub.add_parser("bulk-validate", help="XRechnung/ZUGFeRD-Dateien ohne LLM einlesen, prüfen und optional neu exportieren")
+    p.add_argument("pfade", nargs="+", help="Dateien oder Verzeichnisse (.xml, .pdf mit eingebettetem XML)")
+    p.add_argument("--export", type=Path, default=None, help="Zielverzeichnis für canonical.json, xrechnung.xml und zugferd.xml")
+    p.add_argument("--regelsatz", action="append", default=[], help="Zusätzlicher Regelsatz, z. B. miete (mehrfach möglich)")
+    p.add_argument("--workers", type=int, default=None, help="Anzahl Prozesse (Standard: CPU-Kerne)")
+    p.add_argument(
+        "--ausgabe",
+        action="append",
+        default=None,
+        help="Nur diese Ausgabe exportieren: canonical_json, xrechnung_xml, zugferd_xml, zugferd_pdf "
+        "(mehrfach möglich; Standard: JSON + beide XML)",
+    )
+    p.add_argument(
+        "--profil",
+        default=None,
+        help="ZUGFeRD-Profil: MINIMUM, BASIC WL, BASIC, EN16931 (Standard), EXTENDED, XRECHNUNG",
+    )
+    p.set_defaults(func=_bulk_validate)
+
+    p = sub.add_parser("validate-xml", help="Erzeugte XML-Dateien gegen XSD und Schematron (EN 16931 / XRechnung) prüfen")
+    p.add_argument("pfade", nargs="+", help="XML-Dateien oder Verzeichnisse, z. B. das Ausgabeverzeichnis")
+    p.add_argument("--nur-xsd", action="store_true", help="Nur Schemaprüfung, ohne Schematron")
+    p.add_argument("--workers", type=int, default=None, help="Anzahl Prozesse (Standard: CPU-Kerne)")
+    p.set_defaults(func=_validate_xml)
+
+    p = sub.add_parser("artefakte-laden", help="Offizielle XSD- und Schematron-Artefakte (UBL 2.1, CII D16B, EN 16931, XRechnung) herunterladen")
+    p.add_argument("--ziel", type=Path, default=None, help="Zielverzeichnis (Standard: resources/validation bzw. VALIDATION_ARTEFACTS_PATH)")
+    p.add_argument("--nur-xsd", action="store_true", help="Nur die XSD-Schemata (UBL 2.1, CII D16B)")
+    p.set_defaults(func=_artefakte_laden)
+
+    p = sub.add_parser("reindex", help="Suchindex (data/index.sqlite) aus vorhandenen canonical.json neu aufbauen")
+    p.add_argument("ausgabe_verzeichnis", type=Path, nargs="?", default=Path("output"), help="Ausgabeverzeichnis (Standard: output)")
+    p.set_defaults(func=_reindex)
+
+    p = sub.add_parser("reexport", help="Ausgaben aus gespeicherten canonical.json neu erzeugen (ohne OCR/LLM), nur wo sich Eingaben geändert haben")
+    p.add_argument("pfade", type=Path, nargs="*", default=[Path("output")], help="Ausgabeverzeichnisse oder einzelne Rechnungsordner (Standard: output)")
+    p.add_argument(
+        "--ausgabe",
+        action="append",
+        default=None,
+        help="Nur diese Ausgabe: xrechnung_xml, zugferd_xml, zugferd_pdf (mehrfach möglich; Standard: die vorhandenen)",
+    )
+    p.add_argument("--profil", default=None, help="ZUGFeRD-Profil (Standard: das beim Export verwendete)")
+    p.add_argument("--erzwingen", action="store_true", help="Auch unveränderte Ausgaben neu erzeugen")
+    p.add_argument("--workers", type=int, default=None, help="Anzahl Prozesse (Standard: CPU-Kerne)")
+    p.set_defaults(func=_reexport)
+
+    p = sub.add_parser("hotfolder", help="Ordner und Maildirs überwachen und neue Rechnungen automatisch verarbeiten")
+    p.add_argument("--ordner", action="append", default=None, help="Hotfolder (mehrfach möglich; Standard: hotfolder_verzeichnisse)")
+    p.add_argument("--maildir", action="append", default=None, help="Maildir (mehrfach möglich; Standard: hotfolder_maildirs)")
+    p.add_argument("--ausgabe-verzeichnis", type=Path, default=Path("output"), help="Ausgabeverzeichnis (Standard: output)")
+    p.set_defaults(func=_hotfolder)
+
+    p = sub.add_parser("fortsetzen", help="Abgebrochene oder fehlgeschlagene Verarbeitungen ab der letzten fertigen Stufe fortsetzen")
+    p.add_argument("ausgabe_verzeichnis", type=Path, nargs="?", default=Path("output"), help="Ausgabeverzeichnis (Standard: output)")
+    p.set_defaults(func=_fortsetzen)
+
+    p = sub.add_parser("worker", help="Jobs aus der gemeinsamen Queue extrahieren (OCR/LLM) für einen Server im Worker-Modus")
+    p.add_argument("--queue", default=None, help="Queue-URL, z. B. redis://host:6379/0 (Standard: queue_url aus den Einstellungen)")
+    p.add_argument("--id", default=None, help="Worker-Name in Jobs und Logs (Standard: Rechnername-PID)")
+    p.add_argument("--einmal", action="store_true", help="Beenden, sobald die Queue leer ist")
+    p.set_defaults(func=_worker)
+
+    p = sub.add_parser("evaluate", help="LLM-Extraktion gegen einen Korpus mit Soll-Daten messen: Genauigkeit und Geschwindigkeit je Konfiguration")
+    p.add_argument("korpus", type=Path, help="Verzeichnis mit Rechnungen und ihren <name>.canonical.json (oder canonical.json im selben Ordner)")
+    p.add_argument(
+        "--konfig",
+        type=Path,
+        default=None,
+        help="JSON-Liste von Konfigurationen (name, modell oder endpoint, modellname, threads, kontext, prompt); "
+        "ersetzt die folgenden Optionen",
+    )
+    p.add_argument("--modell", default=None, help="GGUF-Modell, für den Lauf gestartet (Standard: llm_model_path)")
+    p.add_argument("--endpoint", default=None, help="Laufender OpenAI-kompatibler Server statt --modell, z. B. http://127.0.0.1:8080")
+    p.add_argument("--modellname", default="local", help="Modellname in der Anfrage (für Ollama/vLLM nötig)")
+    p.add_argument("--threads", type=int, default=6, help="Threads des gestarteten Servers (Standard: 6)")
+    p.add_argument("--kontext", type=int, default=4096, help="Kontextlänge des gestarteten Servers (Standard: 4096)")
+    p.add_argument("--prompt", type=Path, default=None, help="Datei mit eigener Prompt-Vorlage (Platzhalter wie PROMPT_TEMPLATE)")
+    p.add_argument("--regelsatz", action="append", default=[], help="Zusätzlicher Regelsatz, z. B. miete (mehrfach möglich)")
+    p.add_argument("--arbeitsordner", type=Path, default=None, help="Cache der extrahierten Rohtexte (Standard: data/evaluation)")
+    p.add_argument("--bericht", type=Path, default=Path("evaluation.json"), help="Bericht mit Ergebnis je Rechnung (Standard: evaluation.json)")
+    p.set_defaults(func=_evaluate)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Exact invoice arithmetic per EN 16931 (BR-CO rules) in integer cents.
+
+Line amounts are rounded once, VAT amounts once per category; all sums are
+exact. Large invoices use a scaled int64 NumPy path when available, which
+yields the same results as the Decimal path.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - optional dependency
+    np = None
+
+CENT = Decimal("0.01")
+HUNDRED = Decimal(100)
+
+# Positions from which the vectorized path pays off
+VECTORIZE_THRESHOLD = 1000
+# Quantities and prices are scaled by 10^4 on the vectorized path
+_SCALE = 10_000
+_INT64_SAFE = 9.0e18
+
+
+def to_decimal(v: Any) -> Decimal:
+    if isinstance(v, Decimal):
+        return v
+    if v is None:
+        return Decimal(0)
+    try:
+        if isinstance(v, float):
+            return Decimal(repr(v))
+        return Decimal(str(v).strip() or "0")
+    except InvalidOperation:
+        raise ValueError(f"Ungültiger Betrag: {v!r}")
+
+
+def to_cents(v: Any) -> int:
+    """Round an amount to whole cents (half up, away from zero)."""
+    return int((to_decimal(v) * HUNDRED).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def cents_to_decimal(c: int) -> Decimal:
+    return (Decimal(c) / HUNDRED).quantize(CENT)
+
+
+def _tax_key(ust: Optional[Dict[str, Any]]) -> Tuple[str, Decimal]:
+    ust = ust or {}
+    return ust.get("kategorie", "S"), to_decimal(ust.get("satz", 0))
+
+
+def _line_cents_decimal(positionen: List[Dict[str, Any]]) -> List[int]:
+    return [to_cents(to_decimal(p.get("menge", 0)) * to_decimal(p.get("einzelpreis_netto", 0))) for p in positionen]
+
+
+def _line_cents_numpy(positionen: List[Dict[str, Any]]) -> Optional[List[int]]:
+    """Vectorized line amounts, or None if the values do not fit the int64 scale."""
+    menge = np.asarray([p.get("menge", 0) or 0 for p in positionen], dtype=np.float64)
+    preis = np.asarray([p.get("einzelpreis_netto", 0) or 0 for p in positionen], dtype=np.float64)
+    q = np.rint(menge * _SCALE)
+    pr = np.rint(preis * _SCALE)
+    # Only exact when every value has at most four decimals and the product cannot overflow
+    if (np.abs(menge * _SCALE - q).max() > 1e-3 or np.abs(preis * _SCALE - pr).max() > 1e-3
+            or np.abs(q).max() * np.abs(pr).max() >= _INT64_SAFE):
+        return None
+    prod = q.astype(np.int64) * pr.astype(np.int64)  # scale 10^8
+    divisor = _SCALE * _SCALE // 100
+    cents = np.sign(prod) * ((np.abs(prod) + divisor // 2) // divisor)
+    return cents.tolist()
+
+
+def line_cents(positionen: List[Dict[str, Any]], vectorize: Optional[bool] = None) -> List[int]:
+    if vectorize is None:
+        vectorize = np is not None and len(positionen) >= VECTORIZE_THRESHOLD
+    if vectorize and np is not None and positionen:
+        cents = _line_cents_numpy(positionen)
+        if cents is not None:
+            return cents
+    return _line_cents_decimal(positionen)
+
+
+def berechne(
+    positionen: List[Dict[str, Any]],
+    nachlaesse_zuschlaege: Optional[Iterable[Dict[str, Any]]] = None,
+    vectorize: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """Compute line amounts, the VAT breakdown and the document totals.
+
+    Returns ``positionsbetraege`` (one Decimal per position), the
+    ``umsatzsteuer_aufschluesselung`` and ``summen`` with Decimal amounts.
+    """
+    lines = line_cents(positionen, vectorize=vectorize)
+
+    buckets: Dict[Tuple[str, Decimal], int] = {}
+    for pos, c in zip(positionen, lines):
+        key = _tax_key(pos.get("umsatzsteuer"))
+        buckets[key] = buckets.get(key, 0) + c
+
+    nachlaesse = 0
+    zuschlaege = 0
+    for nz in nachlaesse_zuschlaege or []:
+        c = to_cents(nz.get("betrag", 0))
+        key = _tax_key(nz.get("umsatzsteuer"))
+        if nz.get("zuschlag"):
+            zuschlaege += c
+            buckets[key] = buckets.get(key, 0) + c
+        else:
+            nachlaesse += c
+            buckets[key] = buckets.get(key, 0) - c
+
+    aufschluesselung = []
+    steuer_gesamt = 0
+    for (kat, satz), basis in buckets.items():
+        steuer = int((Decimal(basis) * satz / HUNDRED).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+        steuer_gesamt += steuer
+        aufschluesselung.append({
+            "kategorie": kat,
+            "satz": satz,
+            "steuerbasisbetrag": cents_to_decimal(basis),
+            "steuerbetrag": cents_to_decimal(steuer),
+        })
+
+    netto = sum(lines)
+    steuerbasis = netto - nachlaesse + zuschlaege
+    brutto = steuerbasis + steuer_gesamt
+    summen = {
+        "gesamt_netto": cents_to_decimal(netto),
+        "gesamt_umsatzsteuer": cents_to_decimal(steuer_gesamt),
+        "gesamt_brutto": cents_to_decimal(brutto),
+        "zahlbetrag": cents_to_decimal(brutto),
+    }
+    if nachlaesse_zuschlaege:
+        summen["summe_nachlaesse"] = cents_to_decimal(nachlaesse)
+        summen["summe_zuschlaege"] = cents_to_decimal(zuschlaege)
+        summen["steuerbasis"] = cents_to_decimal(steuerbasis)
+
+    return {
+        "positionsbetraege": [cents_to_decimal(c) for c in lines],
+        "umsatzsteuer_aufschluesselung": aufschluesselung,
+        "summen": summen,
+    }
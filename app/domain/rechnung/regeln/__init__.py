@@ -0,0 +1,3 @@
+# Importing the rule modules registers their rule sets
+from app.domain.rechnung.regeln import en_16931, gutschrift, miete, teilrechnung  # noqa: F401
+from app.domain.rechnung.regeln.regelwerk import Regelverletzung, Verstoss, pruefe  # noqa: F401
@@ -1,26 +1,104 @@
-from typing import Dict, Any
+import re
+from typing import Any, Dict
+
+from app.domain.rechnung_model import RECHNUNGSARTEN, Rechnung
+from app.domain.rechnung.berechnung import to_cents, to_decimal
+from app.domain.rechnung.regeln.regelwerk import Regelverletzung, immer, pruefe, regelsatz
+
+EN_16931 = regelsatz("en_16931", aktiv=immer)
+# National CIUS rules only warn, so invoices without e.g. an IBAN still convert
+XRECHNUNG = regelsatz("xrechnung", aktiv=immer, schwere="warnung")
+
+_LAENDERPREFIX = re.compile(r"^[A-Z]{2}")
+
+
+def _cents(v: Any) -> int:
+    return to_cents(v or 0)
+
+
+def _steuerbasis(r: Rechnung) -> Any:
+    return r.summen.steuerbasis if r.summen.steuerbasis is not None else r.summen.gesamt_netto
+
+
+def _summe_nz(r: Rechnung, zuschlag: bool) -> int:
+    return sum(_cents(nz.betrag) for nz in (r.nachlaesse_zuschlaege or []) if nz.zuschlag == zuschlag)
+
+
+# --- Document level (BR-*) ---
+EN_16931.add("BR-02", "Rechnungsnummer fehlt", lambda r: bool(r.dokument.rechnungsnummer.strip()), pfad="dokument.rechnungsnummer")
+EN_16931.add("BR-03", "Rechnungsdatum fehlt", lambda r: r.dokument.rechnungsdatum is not None, pfad="dokument.rechnungsdatum")
+EN_16931.add("BR-04", "Ungültige Rechnungsart", lambda r: r.dokument.rechnungsart in RECHNUNGSARTEN, pfad="dokument.rechnungsart")
+EN_16931.add("BR-05", "Währung fehlt", lambda r: bool(r.dokument.waehrung), pfad="dokument.waehrung")
+EN_16931.add("BR-06", "Name des Verkäufers fehlt", lambda r: bool(r.verkaeufer.name.strip()), pfad="verkaeufer.name")
+EN_16931.add("BR-07", "Name des Käufers fehlt", lambda r: bool(r.kaeufer.name.strip()), pfad="kaeufer.name")
+EN_16931.add("BR-09", "Land des Verkäufers fehlt", lambda r: bool(r.verkaeufer.anschrift.land), pfad="verkaeufer.anschrift.land")
+EN_16931.add("BR-11", "Land des Käufers fehlt", lambda r: bool(r.kaeufer.anschrift.land), pfad="kaeufer.anschrift.land")
+EN_16931.add("BR-16", "Mindestens eine Rechnungsposition erforderlich", lambda r: len(r.positionen) > 0, pfad="positionen")
+EN_16931.add("BR-CO-09", "USt-IdNr. des Verkäufers muss mit Ländercode beginnen",
+             lambda r: not r.verkaeufer.umsatzsteuer_id or bool(_LAENDERPREFIX.match(r.verkaeufer.umsatzsteuer_id)),
+             pfad="verkaeufer.umsatzsteuer_id")
+EN_16931.add("BR-CO-10", "Summe der Positionsbeträge stimmt nicht mit Gesamtnetto überein",
+             lambda r: sum(_cents(p.positionsbetrag_netto) for p in r.positionen) == _cents(r.summen.gesamt_netto),
+             pfad="summen.gesamt_netto")
+EN_16931.add("BR-CO-11", "Summe der Nachlässe stimmt nicht",
+             lambda r: _summe_nz(r, False) == _cents(r.summen.summe_nachlaesse), pfad="summen.summe_nachlaesse")
+EN_16931.add("BR-CO-12", "Summe der Zuschläge stimmt nicht",
+             lambda r: _summe_nz(r, True) == _cents(r.summen.summe_zuschlaege), pfad="summen.summe_zuschlaege")
+EN_16931.add("BR-CO-13", "Steuerbasis ungleich Netto - Nachlässe + Zuschläge",
+             lambda r: _cents(_steuerbasis(r)) == _cents(r.summen.gesamt_netto) - _summe_nz(r, False) + _summe_nz(r, True),
+             pfad="summen.steuerbasis")
+EN_16931.add("BR-CO-14", "Umsatzsteuer-Gesamtbetrag ungleich Summe der Aufschlüsselung",
+             lambda r: sum(_cents(b.steuerbetrag) for b in (r.umsatzsteuer_aufschluesselung or [])) == _cents(r.summen.gesamt_umsatzsteuer),
+             pfad="summen.gesamt_umsatzsteuer")
+EN_16931.add("BR-CO-15", "Bruttobetrag ungleich Steuerbasis + Umsatzsteuer",
+             lambda r: _cents(r.summen.gesamt_brutto) == _cents(_steuerbasis(r)) + _cents(r.summen.gesamt_umsatzsteuer),
+             pfad="summen.gesamt_brutto")
+EN_16931.add("BR-CO-16", "Zahlbetrag ungleich Bruttobetrag",
+             lambda r: r.summen.zahlbetrag is None or _cents(r.summen.zahlbetrag) == _cents(r.summen.gesamt_brutto),
+             pfad="summen.zahlbetrag")
+EN_16931.add("BR-CO-18", "Mindestens eine Umsatzsteuer-Aufschlüsselung erforderlich",
+             lambda r: bool(r.umsatzsteuer_aufschluesselung), pfad="umsatzsteuer_aufschluesselung")
+
+# --- Line level ---
+EN_16931.add("BR-21", "Positionsnummer fehlt", lambda p, r: p.positionsnummer is not None, "positionen", "positionsnummer")
+EN_16931.add("BR-23", "Einheit fehlt", lambda p, r: bool(p.einheit.strip()), "positionen", "einheit")
+EN_16931.add("BR-25", "Artikelbezeichnung fehlt", lambda p, r: bool(p.beschreibung.strip()), "positionen", "beschreibung")
+EN_16931.add("BR-27", "Negative Preise sind unzulässig", lambda p, r: p.einzelpreis_netto >= 0, "positionen", "einzelpreis_netto")
+EN_16931.add("BR-CO-04", "Umsatzsteuerkategorie der Position fehlt", lambda p, r: bool(p.umsatzsteuer.kategorie), "positionen", "umsatzsteuer.kategorie")
+EN_16931.add("BR-S-05", "Standardsatz (S) muss größer als 0 sein",
+             lambda p, r: p.umsatzsteuer.kategorie != "S" or p.umsatzsteuer.satz > 0, "positionen", "umsatzsteuer.satz")
+EN_16931.add("BR-Z-05", "Nullsatz (Z) muss 0 sein",
+             lambda p, r: p.umsatzsteuer.kategorie != "Z" or p.umsatzsteuer.satz == 0, "positionen", "umsatzsteuer.satz")
+EN_16931.add("BR-E-05", "Steuerbefreiung (E) muss Satz 0 haben",
+             lambda p, r: p.umsatzsteuer.kategorie != "E" or p.umsatzsteuer.satz == 0, "positionen", "umsatzsteuer.satz")
+# House rules carried over from the former check_basic
+EN_16931.add("BASIS-01", "Negative Mengen sind unzulässig", lambda p, r: p.menge >= 0, "positionen", "menge")
+EN_16931.add("BASIS-02", "Negative Positionsbeträge sind unzulässig", lambda p, r: p.positionsbetrag_netto >= 0, "positionen", "positionsbetrag_netto")
+
+# --- VAT breakdown level ---
+EN_16931.add("BR-CO-17", "Steuerbetrag ungleich Steuerbasis × Satz",
+             lambda b, r: _cents(b.steuerbetrag) == to_cents(to_decimal(b.steuerbasisbetrag) * to_decimal(b.satz) / 100),
+             "umsatzsteuer_aufschluesselung", "steuerbetrag")
+
+# --- XRechnung (BR-DE-*) ---
+XRECHNUNG.add("BR-DE-1", "Zahlungsanweisungen fehlen", lambda r: bool(r.zahlung.zahlungsart), pfad="zahlung.zahlungsart")
+XRECHNUNG.add("BR-DE-3", "Ort des Verkäufers fehlt", lambda r: bool(r.verkaeufer.anschrift.ort.strip()), pfad="verkaeufer.anschrift.ort")
+XRECHNUNG.add("BR-DE-4", "PLZ des Verkäufers fehlt", lambda r: bool(r.verkaeufer.anschrift.plz.strip()), pfad="verkaeufer.anschrift.plz")
+XRECHNUNG.add("BR-DE-8", "Ort des Käufers fehlt", lambda r: bool(r.kaeufer.anschrift.ort.strip()), pfad="kaeufer.anschrift.ort")
+XRECHNUNG.add("BR-DE-9", "PLZ des Käufers fehlt", lambda r: bool(r.kaeufer.anschrift.plz.strip()), pfad="kaeufer.anschrift.plz")
+XRECHNUNG.add("BR-DE-16", "USt-IdNr. oder Steuernummer des Verkäufers fehlt",
+              lambda r: bool(r.verkaeufer.umsatzsteuer_id or r.verkaeufer.steuernummer), pfad="verkaeufer.umsatzsteuer_id")
+XRECHNUNG.add("BR-DE-23", "IBAN für SEPA-Überweisung fehlt",
+              lambda r: r.zahlung.zahlungsart.upper() not in {"SEPA", "UEBERWEISUNG", "ÜBERWEISUNG"} or bool(r.zahlung.iban),
+              pfad="zahlung.iban")
 
 
 def check_basic(data: Dict[str, Any]) -> None:
-    # Minimal business rules per EN 16931 context
-    dokument = data.get("dokument", {})
-    """
-    if dokument.get("waehrung") != "EUR":
-        raise ValueError("Nur Währung EUR wird unterstützt")
-    """
+    """Validate a draft dict against all applicable rule sets.
 
-    rechnungsart = dokument.get("rechnungsart")
-    if rechnungsart not in {"RECHNUNG", "GUTSCHRIFT"}:
-        raise ValueError("Ungültige Rechnungsart")
-
-    positionen = data.get("positionen")
-    if not positionen or len(positionen) == 0:
-        raise ValueError("Mindestens eine Rechnungsposition erforderlich")
-
-    for pos in positionen:
-        if float(pos.get("menge", 0)) < 0:
-            raise ValueError("Negative Mengen sind unzulässig")
-        if float(pos.get("einzelpreis_netto", 0)) < 0:
-            raise ValueError("Negative Preise sind unzulässig")
-        if float(pos.get("positionsbetrag_netto", 0)) < 0:
-            raise ValueError("Negative Positionsbeträge sind unzulässig")
\ No newline at end of file
+    Kept for callers of the former minimal check; raises ``Regelverletzung``
+    listing every violation instead of stopping at the first one.
+    """
+    fehler = [v for v in pruefe(Rechnung.model_validate(data)) if v.schwere == "fehler"]
+    if fehler:
+        raise Regelverletzung(fehler)
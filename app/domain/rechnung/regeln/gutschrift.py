@@ -0,0 +1,12 @@
+from app.domain.rechnung.berechnung import to_cents
+from app.domain.rechnung.regeln.regelwerk import regelsatz
+
+# Credit notes (type code 381): amounts are stated positive, the document type carries the sign
+GUTSCHRIFT = regelsatz("gutschrift", aktiv=lambda r: r.dokument.rechnungsart == "GUTSCHRIFT")
+
+# EN 16931 does not require BT-25, so a credit note without it is only flagged
+GUTSCHRIFT.add("GS-01", "Gutschrift sollte die korrigierte Rechnung angeben (BT-25)",
+               lambda r: bool(r.dokument.vorherige_rechnungsnummer), pfad="dokument.vorherige_rechnungsnummer",
+               schwere="warnung")
+GUTSCHRIFT.add("GS-02", "Gutschriftsbetrag darf nicht negativ sein",
+               lambda r: to_cents(r.summen.gesamt_brutto) >= 0, pfad="summen.gesamt_brutto")
@@ -0,0 +1,9 @@
+from app.domain.rechnung.regeln.regelwerk import regelsatz
+
+# Rent invoices; not detectable from the document type, so only run when requested by name
+MIETE = regelsatz("miete")
+
+MIETE.add("MI-01", "Mietrechnung benötigt ein Fälligkeitsdatum",
+          lambda r: r.dokument.faelligkeitsdatum is not None, pfad="dokument.faelligkeitsdatum")
+MIETE.add("MI-02", "Mietrechnung muss den Leistungszeitraum in den Bemerkungen nennen",
+          lambda r: bool(r.bemerkungen), pfad="bemerkungen")
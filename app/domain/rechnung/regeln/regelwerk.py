@@ -0,0 +1,143 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.domain.rechnung_model import Rechnung
+
+# Collections of the Rechnung model that element rules can iterate over
+EBENEN = ("positionen", "nachlaesse_zuschlaege", "umsatzsteuer_aufschluesselung")
+
+
+@dataclass(frozen=True)
+class Verstoss:
+    regel: str
+    meldung: str
+    pfad: str = ""
+    schwere: str = "fehler"
+
+    def __str__(self) -> str:
+        return f"[{self.regel}] {self.meldung}" + (f" ({self.pfad})" if self.pfad else "")
+
+
+class Regelverletzung(ValueError):
+    """Raised with every blocking business-rule violation of an invoice at once."""
+
+    def __init__(self, verstoesse: List[Verstoss]):
+        self.verstoesse = verstoesse
+        super().__init__("; ".join(str(v) for v in verstoesse))
+
+
+@dataclass(frozen=True)
+class Regel:
+    id: str
+    meldung: str
+    pruefung: Callable[..., bool]
+    ebene: str = "rechnung"
+    pfad: str = ""
+    schwere: str = "fehler"
+
+
+class Regelsatz:
+    """A named set of rules, e.g. EN 16931 or the credit-note rules.
+
+    ``aktiv`` decides per invoice whether the set applies; sets without a
+    predicate only run when requested explicitly by name. Violations of a set
+    with ``schwere="warnung"`` are reported but do not reject the invoice.
+    """
+
+    def __init__(self, name: str, aktiv: Optional[Callable[[Rechnung], bool]] = None, schwere: str = "fehler"):
+        self.name = name
+        self.aktiv = aktiv
+        self.schwere = schwere
+        self.regeln: List[Regel] = []
+
+    def add(
+        self,
+        id: str,
+        meldung: str,
+        pruefung: Callable[..., bool],
+        ebene: str = "rechnung",
+        pfad: str = "",
+        schwere: Optional[str] = None,
+    ) -> None:
+        """Register a rule. Document rules get the Rechnung, element rules
+        ``(element, rechnung)``; ``pfad`` is relative to the element.
+        ``schwere`` overrides the severity of the set for this rule."""
+        if ebene != "rechnung" and ebene not in EBENEN:
+            raise ValueError(f"Unbekannte Regelebene: {ebene}")
+        self.regeln.append(Regel(id, meldung, pruefung, ebene, pfad, schwere or self.schwere))
+
+
+REGELSAETZE: Dict[str, Regelsatz] = {}
+
+
+def regelsatz(name: str, aktiv: Optional[Callable[[Rechnung], bool]] = None, schwere: str = "fehler") -> Regelsatz:
+    return REGELSAETZE.setdefault(name, Regelsatz(name, aktiv, schwere))
+
+
+def immer(_: Rechnung) -> bool:
+    return True
+
+
+def _violation(regel: Regel, pfad: str, fehler: Optional[Exception] = None) -> Verstoss:
+    meldung = regel.meldung if fehler is None else f"{regel.meldung} ({fehler})"
+    return Verstoss(regel.id, meldung, pfad, regel.schwere)
+
+
+class Pruefer:
+    """Rules of several sets flattened into one evaluator.
+
+    The invoice is walked exactly once: document rules first, then every
+    element of each collection against all rules of that level.
+    """
+
+    def __init__(self, regeln: Iterable[Regel]):
+        regeln = list(regeln)
+        self.dokument: Tuple[Regel, ...] = tuple(r for r in regeln if r.ebene == "rechnung")
+        self.elemente: Tuple[Tuple[str, Tuple[Regel, ...]], ...] = tuple(
+            (ebene, tuple(r for r in regeln if r.ebene == ebene)) for ebene in EBENEN
+        )
+
+    def __call__(self, rechnung: Rechnung) -> List[Verstoss]:
+        verstoesse: List[Verstoss] = []
+        for regel in self.dokument:
+            try:
+                if not regel.pruefung(rechnung):
+                    verstoesse.append(_violation(regel, regel.pfad))
+            except Exception as e:
+                verstoesse.append(_violation(regel, regel.pfad, e))
+
+        for ebene, regeln in self.elemente:
+            if not regeln:
+                continue
+            for i, element in enumerate(getattr(rechnung, ebene) or []):
+                for regel in regeln:
+                    try:
+                        ok = regel.pruefung(element, rechnung)
+                        fehler = None
+                    except Exception as e:
+                        ok, fehler = False, e
+                    if not ok:
+                        pfad = f"{ebene}.{i}" + (f".{regel.pfad}" if regel.pfad else "")
+                        verstoesse.append(_violation(regel, pfad, fehler))
+        return verstoesse
+
+
+@lru_cache(maxsize=None)
+def kompiliere(namen: Tuple[str, ...]) -> Pruefer:
+    return Pruefer(r for name in namen for r in REGELSAETZE[name].regeln)
+
+
+def aktive_regelsaetze(rechnung: Rechnung, zusaetzlich: Sequence[str] = ()) -> Tuple[str, ...]:
+    namen = [name for name, satz in REGELSAETZE.items() if satz.aktiv is not None and satz.aktiv(rechnung)]
+    for name in zusaetzlich:
+        if name not in REGELSAETZE:
+            raise ValueError(f"Unbekannter Regelsatz: {name}")
+        if name not in namen:
+            namen.append(name)
+    return tuple(namen)
+
+
+def pruefe(rechnung: Rechnung, regelsaetze: Sequence[str] = ()) -> List[Verstoss]:
+    """Evaluate all applicable rule sets and return every violation."""
+    return kompiliere(aktive_regelsaetze(rechnung, regelsaetze))(rechnung)
@@ -0,0 +1,11 @@
+from app.domain.rechnung.berechnung import to_cents
+from app.domain.rechnung.regeln.regelwerk import regelsatz
+
+# Partial invoices (type code 326) within a larger order or construction contract
+TEILRECHNUNG = regelsatz("teilrechnung", aktiv=lambda r: r.dokument.rechnungsart == "TEILRECHNUNG")
+
+TEILRECHNUNG.add("TR-01", "Teilrechnung muss auf Auftrag oder Vorrechnung verweisen",
+                 lambda r: bool(r.dokument.vorherige_rechnungsnummer or r.bemerkungen),
+                 pfad="dokument.vorherige_rechnungsnummer")
+TEILRECHNUNG.add("TR-02", "Zahlbetrag einer Teilrechnung muss positiv sein",
+                 lambda r: to_cents(r.summen.zahlbetrag) > 0, pfad="summen.zahlbetrag")
@@ -3,6 +3,23 @@ from typing import List, Optional
 from datetime import date
 from datetime import datetime
 
+# Supported invoice kinds and their UNTDID 1001 document type codes
+RECHNUNGSARTEN = {
+    "RECHNUNG": "380",
+    "GUTSCHRIFT": "381",
+    "TEILRECHNUNG": "326",
+}
+
+# Payment kinds and their UNTDID 4461 payment means codes ("1" = not defined)
+ZAHLUNGSARTEN = {
+    "BAR": "10",
+    "UEBERWEISUNG": "30",
+    "KARTE": "48",
+    "SEPA": "58",
+    "LASTSCHRIFT": "59",
+}
+
+
 class Anschrift(BaseModel):
     strasse: str
     plz: str
@@ -16,14 +33,22 @@ class Dokument(BaseModel):
     rechnungsdatum: date
     faelligkeitsdatum: Optional[date] = None
     waehrung: Optional[str] = "EUR"
+    # Preceding invoice (BT-25), e.g. the invoice a credit note corrects
+    vorherige_rechnungsnummer: Optional[str] = None
 
     @validator('rechnungsdatum', pre=True)
     def parse_german_date(cls, v):
         if not v:
             return None
-        # Accept DD.MM.YYYY format
+        if isinstance(v, date):
+            return v
+        # Accept DD.MM.YYYY format, and ISO dates as written to canonical.json / XML
         try:
             return datetime.strptime(v, "%d.%m.%Y").date()
+        except ValueError:
+            pass
+        try:
+            return date.fromisoformat(v)
         except ValueError:
             raise ValueError(f"Ungültiges Datum: {v}") 
 
@@ -55,6 +80,14 @@ class Rechnungsposition(BaseModel):
     )
 
 
+class NachlassZuschlag(BaseModel):
+    # Document level allowance (zuschlag=False) or charge (zuschlag=True)
+    zuschlag: bool = False
+    betrag: float
+    grund: Optional[str] = None
+    umsatzsteuer: UmsatzsteuerPosition
+
+
 class UmsatzsteuerAufschluesselung(BaseModel):
     kategorie: str
     satz: float
@@ -67,6 +100,9 @@ class Summen(BaseModel):
     gesamt_umsatzsteuer: float
     gesamt_brutto: float
     zahlbetrag: Optional[float] = None
+    summe_nachlaesse: Optional[float] = None
+    summe_zuschlaege: Optional[float] = None
+    steuerbasis: Optional[float] = None
 
     @field_validator("zahlbetrag", mode="before")
     def empty_str_to_none(cls, v):
@@ -90,6 +126,7 @@ class Rechnung(BaseModel):
     verkaeufer: Partei
     kaeufer: Partei
     positionen: List[Rechnungsposition]
+    nachlaesse_zuschlaege: Optional[List[NachlassZuschlag]] = None
     umsatzsteuer_aufschluesselung: Optional[List[UmsatzsteuerAufschluesselung]] = None
     summen: Summen
     zahlung: Zahlung
@@ -0,0 +1,233 @@
+"""Per-run checkpoints, so a failed or interrupted run resumes instead of starting over.
+
+Each input file (keyed by its SHA-256) gets ``<output_root>/_working/<hash>/``
+with a copy of the source, the artifacts of every finished stage (raw text,
+draft JSON, canonical JSON, XMLs, base PDF) and ``manifest.json`` listing
+them. A retry of the same file skips every recorded stage, in particular the
+LLM call. After a successful run only the raw text and the draft are kept.
+
+Runs of the same file (two uploads, a hot folder and a retry) share that
+directory, so a run holds ``<hash>.sperre`` next to it for its lifetime
+(:meth:`Lauf.sperren`); the second one waits and then sees the first one's
+result.
+"""
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from loguru import logger
+
+from app.infrastructure import ressourcen
+from app.infrastructure.engines import optional_import
+from app.infrastructure.storage import write_atomic
+
+MANIFEST = "manifest.json"
+# Still referenced by the result (files.raw_text) and handy when checking an extraction
+BEHALTEN = ("raw_text", "draft")
+# A lock of another host older than this is taken over (its holder is assumed dead)
+SPERRE_VERALTET_S = 2 * ressourcen.DEFAULT_AUFTRAG_TIMEOUT_S
+
+# Lock file → (holding thread, depth); the holding thread may take it again
+_gehalten: Dict[str, Tuple[int, int]] = {}
+_gehalten_lock = threading.Lock()
+
+
+def _prozess_lebt(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows
+        psutil = optional_import("psutil")
+        return psutil.pid_exists(pid) if psutil is not None else True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _veraltet(sperre: Path) -> bool:
+    try:
+        alter = time.time() - sperre.stat().st_mtime
+        inhalt = sperre.read_text(encoding="utf-8").split()
+    except OSError:
+        # Released meanwhile, or not readable: wait for it
+        return False
+    try:
+        host, pid = inhalt[0], int(inhalt[1])
+    except (IndexError, ValueError):
+        # Still being written; only stale once it is old
+        return alter > SPERRE_VERALTET_S
+    if host == socket.gethostname():
+        return not _prozess_lebt(pid)
+    return alter > SPERRE_VERALTET_S
+
+
+class Lauf:
+    """Checkpoints of one pipeline run in ``<work_root>/<hash>/``."""
+
+    def __init__(self, work_root: Path, quell_hash: str):
+        self.dir = Path(work_root) / quell_hash[:32]
+        self.quell_hash = quell_hash
+        self.manifest = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        path = self.dir / MANIFEST
+        try:
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+            if manifest.get("quell_hash") == self.quell_hash and manifest.get("status") == "offen":
+                return manifest
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Manifest unlesbar, starte Lauf neu: {path} ({e})")
+        # A finished run of the same file (processed again on purpose) starts from scratch
+        return {"quell_hash": self.quell_hash, "status": "offen", "quelle": None, "stufen": {}}
+
+    @contextmanager
+    def sperren(self) -> Iterator["Lauf"]:
+        """Hold the run exclusively (across threads and processes); the manifest is re-read once held.
+
+        Waiting honours the current ticket's deadline and cancellation.
+        """
+        sperre = self.dir.with_name(self.dir.name + ".sperre")
+        key = str(sperre.resolve())
+        ich = threading.get_ident()
+        with _gehalten_lock:
+            halter, tiefe = _gehalten.get(key, (None, 0))
+            if halter == ich:
+                _gehalten[key] = (ich, tiefe + 1)
+                eigen = False
+            else:
+                eigen = True
+        if eigen:
+            self._sperre_holen(sperre)
+            with _gehalten_lock:
+                _gehalten[key] = (ich, 1)
+            self.manifest = self._load()
+        try:
+            yield self
+        finally:
+            with _gehalten_lock:
+                halter, tiefe = _gehalten[key]
+                if tiefe > 1:
+                    _gehalten[key] = (halter, tiefe - 1)
+                else:
+                    del _gehalten[key]
+                    sperre.unlink(missing_ok=True)
+
+    def _sperre_holen(self, sperre: Path) -> None:
+        sperre.parent.mkdir(parents=True, exist_ok=True)
+        gemeldet = False
+        while True:
+            try:
+                fd = os.open(str(sperre), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if _veraltet(sperre):
+                    logger.warning(f"Verwaiste Sperre entfernt: {sperre}")
+                    sperre.unlink(missing_ok=True)
+                    continue
+                if not gemeldet:
+                    logger.info(f"Warte auf laufende Verarbeitung derselben Datei: {self.dir}")
+                    gemeldet = True
+                ressourcen.pruefen()
+                time.sleep(ressourcen.PRUEF_INTERVALL_S)
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(f"{socket.gethostname()} {os.getpid()} {datetime.now().isoformat(timespec='seconds')}\n")
+            return
+
+    def _save(self) -> None:
+        write_atomic(self.dir / MANIFEST, json.dumps(self.manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    @property
+    def stufen(self) -> Dict[str, Dict[str, Any]]:
+        return self.manifest["stufen"]
+
+    def hat(self, stufe: str) -> bool:
+        entry = self.stufen.get(stufe)
+        return entry is not None and (self.dir / entry["datei"]).is_file()
+
+    def pfad(self, stufe: str) -> Path:
+        return self.dir / self.stufen[stufe]["datei"]
+
+    def lesen(self, stufe: str) -> bytes:
+        return self.pfad(stufe).read_bytes()
+
+    def meta(self, stufe: str) -> Dict[str, Any]:
+        return self.stufen.get(stufe, {})
+
+    def merken(self, stufe: str, path: Path, **meta: Any) -> None:
+        """Record ``path`` (inside the run directory) as the artifact of ``stufe``."""
+        self.stufen[stufe] = {
+            "datei": Path(path).relative_to(self.dir).as_posix(),
+            "zeit": datetime.now().isoformat(timespec="seconds"),
+            **meta,
+        }
+        self._save()
+
+    def speichern(self, stufe: str, data: bytes, datei: str, **meta: Any) -> Path:
+        """Write ``data`` as the artifact of ``stufe`` and record it."""
+        path = self.dir / datei
+        write_atomic(path, data)
+        self.merken(stufe, path, **meta)
+        return path
+
+    def quelle_sichern(self, input_path: Path) -> None:
+        """Keep a copy of the input, so the run can be resumed after the upload is gone."""
+        quelle = self.manifest.get("quelle")
+        if quelle and (self.dir / quelle["datei"]).is_file():
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        ziel = self.dir / f"quelle{Path(input_path).suffix.lower()}"
+        if Path(input_path).resolve() != ziel.resolve():
+            shutil.copyfile(input_path, ziel)
+        self.manifest["quelle"] = {"name": Path(input_path).name, "datei": ziel.name}
+        self._save()
+
+    @property
+    def quelle(self) -> Optional[Path]:
+        quelle = self.manifest.get("quelle")
+        return self.dir / quelle["datei"] if quelle else None
+
+    def abschliessen(self) -> None:
+        """Mark the run finished and drop the artifacts only a resume would need."""
+        for stufe in [s for s in self.stufen if s not in BEHALTEN]:
+            (self.dir / self.stufen.pop(stufe)["datei"]).unlink(missing_ok=True)
+        if self.quelle is not None:
+            self.quelle.unlink(missing_ok=True)
+            self.manifest["quelle"] = None
+        shutil.rmtree(self.dir / "export", ignore_errors=True)
+        self.manifest["status"] = "fertig"
+        self._save()
+
+
+def behaltene_datei(work_root: Path, quell_hash: str, stufe: str) -> Optional[Path]:
+    """An artifact of a run, finished or not (after a finished run only ``BEHALTEN`` are left)."""
+    lauf_dir = Path(work_root) / quell_hash[:32]
+    try:
+        manifest = json.loads((lauf_dir / MANIFEST).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    entry = (manifest.get("stufen") or {}).get(stufe)
+    path = lauf_dir / entry["datei"] if entry else None
+    return path if path is not None and path.is_file() else None
+
+
+def offene_laeufe(work_root: Path) -> Iterator[Tuple[Lauf, Path]]:
+    """Unfinished runs below ``work_root`` whose source copy still exists, as ``(lauf, quelle)``."""
+    for manifest in sorted(Path(work_root).glob(f"*/{MANIFEST}")):
+        try:
+            quell_hash = json.loads(manifest.read_text(encoding="utf-8"))["quell_hash"]
+        except (OSError, ValueError, KeyError):
+            continue
+        lauf = Lauf(work_root, quell_hash)
+        if lauf.dir == manifest.parent and lauf.quelle is not None and lauf.quelle.is_file():
+            yield lauf, lauf.quelle
@@ -0,0 +1,132 @@
+"""Lazy backends and their warm-up state.
+
+Heavy libraries (PyMuPDF, pikepdf, WeasyPrint, OCR, the LLM stack) are only
+imported on first use via :func:`optional_import`, so the API, the CLI and pool
+workers start in a fraction of a second. :func:`warm_up` preloads selected
+engines in the background; :func:`readiness` reports which ones are warm.
+"""
+import importlib
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from loguru import logger
+
+_MISSING = object()
+_modules: Dict[str, Any] = {}
+
+
+def optional_import(name: str) -> Optional[ModuleType]:
+    """Import ``name`` on first use; ``None`` when the optional dependency is missing."""
+    module = _modules.get(name)
+    if module is None:
+        try:
+            module = importlib.import_module(name)
+        except Exception as e:  # pragma: no cover - optional dependency
+            logger.debug(f"Optionales Modul nicht verfügbar: {name} ({e})")
+            module = _MISSING
+        _modules[name] = module
+    return None if module is _MISSING else module
+
+
+def _warm_renderer(settings: Dict[str, Any]) -> None:
+    from app.services.export.pdf import renderer
+
+    renderer.warm_up()
+    renderer.warm_pool(int(settings.get("pdf_render_workers") or 0))
+    optional_import("pikepdf")
+
+
+def _warm_validator(settings: Dict[str, Any]) -> None:
+    from app.services.validation.xml_validator import warm_up
+
+    fehlend = warm_up()
+    if fehlend:
+        # Outputs would only ever be reported unchecked; keep /health/ready at 503 instead
+        raise RuntimeError(f"Validierungsartefakte fehlen ({', '.join(fehlend)}); python -m app.cli artefakte-laden")
+
+
+def _warm_ocr(settings: Dict[str, Any]) -> None:
+    from app.services.extraction import image_ocr, pdf_extractor  # noqa: F401
+
+    optional_import("ocrmypdf")
+
+
+def _warm_llm(settings: Dict[str, Any]) -> None:
+    from pathlib import Path
+
+    from app.services.llm.extractor import warm_llama_server
+
+    warm_llama_server(Path(settings["llm_model_path"]))
+
+
+def _warm_llm_small(settings: Dict[str, Any]) -> None:
+    from pathlib import Path
+
+    from app.services.llm.extractor import warm_llama_server
+
+    if settings.get("llm_small_model_path"):
+        warm_llama_server(Path(settings["llm_small_model_path"]))
+
+
+# Engine → warm-up function; the names are what ``vorwaermen`` in the settings lists
+ENGINES: Dict[str, Callable[[Dict[str, Any]], None]] = {
+    "renderer": _warm_renderer,
+    "validator": _warm_validator,
+    "ocr": _warm_ocr,
+    "llm": _warm_llm,
+    "llm_small": _warm_llm_small,
+}
+
+_state_lock = threading.Lock()
+_state: Dict[str, Dict[str, Any]] = {}
+
+
+def _set_state(name: str, **values: Any) -> None:
+    with _state_lock:
+        _state.setdefault(name, {}).update(values)
+
+
+def warm_engine(name: str, settings: Dict[str, Any]) -> bool:
+    """Warm one engine now; errors are recorded, not raised."""
+    _set_state(name, status="laeuft", fehler=None)
+    start = time.perf_counter()
+    try:
+        ENGINES[name](settings)
+    except Exception as e:
+        logger.error(f"Vorwärmen von {name} fehlgeschlagen: {e}")
+        _set_state(name, status="fehler", fehler=f"{type(e).__name__}: {e}")
+        return False
+    dauer_ms = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(f"{name} vorgewärmt ({dauer_ms} ms)")
+    _set_state(name, status="warm", dauer_ms=dauer_ms)
+    return True
+
+
+def warm_up(names: Iterable[str], settings: Dict[str, Any], background: bool = True) -> Optional[threading.Thread]:
+    """Warm the engines ``names`` one after another, by default in a daemon thread."""
+    unknown = [n for n in names if n not in ENGINES]
+    if unknown:
+        logger.warning(f"Unbekannte Engines in 'vorwaermen' ignoriert: {unknown}")
+    names = [n for n in names if n in ENGINES]
+    for name in names:
+        _set_state(name, status="ausstehend")
+
+    def run() -> None:
+        for name in names:
+            warm_engine(name, settings)
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def readiness() -> Dict[str, Any]:
+    """``{"bereit": bool, "engines": {name: {"status": ...}}}`` for the engines asked to warm up."""
+    with _state_lock:
+        engines = {name: dict(state) for name, state in _state.items()}
+    return {"bereit": all(s.get("status") == "warm" for s in engines.values()), "engines": engines}
@@ -0,0 +1,286 @@
+"""Hot folders and maildirs: continuous ingestion without manual uploads.
+
+Files dropped into a configured folder are processed once they have stopped
+changing (scanners and network copies write in pieces), then moved to
+``erledigt/`` or ``fehlgeschlagen/`` next to them; a failed file gets a
+``.fehler.txt`` with the reason. A file is claimed by moving it to
+``.in_arbeit/`` first, so several watchers never process it twice; files left
+there by a crash are put back on start.
+
+For maildirs the PDF and XML attachments of every mail are processed and the
+mail is moved to the Maildir++ folder ``.erledigt`` or ``.fehlgeschlagen``.
+Run only one watcher per maildir.
+
+Change events come from ``watchfiles`` (inotify); with ``hotfolder_polling``
+or without the package the folders are scanned at a fixed interval.
+
+Jobs run in the ``batch`` priority class, each folder and maildir as its own
+tenant: uploads go first, and a folder with thousands of files does not hold
+up the others.
+"""
+import email
+import email.message
+import email.policy
+import itertools
+import mailbox
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.infrastructure import ressourcen
+from app.infrastructure.engines import optional_import
+from app.infrastructure.storage import load_settings
+from app.services.extraction.raw_text import SUPPORTED_IMAGE_EXTS
+
+ERLEDIGT = "erledigt"
+FEHLGESCHLAGEN = "fehlgeschlagen"
+IN_ARBEIT = ".in_arbeit"
+DATEI_SUFFIXE = {".pdf", ".xml", ".docx", ".xlsx", ".txt", ".csv"} | SUPPORTED_IMAGE_EXTS
+# Mails carry logos and signatures as images; only e-invoice and PDF attachments count
+MAIL_SUFFIXE = {".pdf", ".xml"}
+# Upper bound between two scans, also while no change events arrive
+INTERVALL_S = 2.0
+
+
+def _frei(ziel: Path) -> Path:
+    # Never overwrite an earlier file of the same name in erledigt/ or fehlgeschlagen/
+    candidate, n = ziel, 1
+    while candidate.exists():
+        n += 1
+        candidate = ziel.with_name(f"{ziel.stem}-{n}{ziel.suffix}")
+    return candidate
+
+
+def _anhaenge(nachricht: email.message.Message) -> List[Tuple[str, bytes]]:
+    anhaenge = []
+    for part in nachricht.walk():
+        name = part.get_filename()
+        if name and Path(name).suffix.lower() in MAIL_SUFFIXE:
+            data = part.get_payload(decode=True)
+            if data:
+                anhaenge.append((Path(name).name, data))
+    return anhaenge
+
+
+class HotfolderWatcher:
+    """Watches the configured folders and maildirs and feeds new invoices into the pipeline."""
+
+    def __init__(
+        self,
+        settings: Dict[str, Any],
+        output_root: Path,
+        ordner: Optional[List[str]] = None,
+        maildirs: Optional[List[str]] = None,
+    ):
+        from app.infrastructure.pipeline import process_input_file
+        from app.infrastructure.worker import process_via_queue
+
+        self._process = process_via_queue if settings.get("worker_modus") else process_input_file
+        self.output_root = Path(output_root)
+        self.ordner = [Path(p) for p in (ordner if ordner is not None else settings.get("hotfolder_verzeichnisse") or [])]
+        self.maildirs = [Path(p) for p in (maildirs if maildirs is not None else settings.get("hotfolder_maildirs") or [])]
+        self.workers = max(1, int(settings.get("hotfolder_workers") or 1))
+        self.stabil_s = float(settings.get("hotfolder_stabil_sekunden") or 0)
+        self.polling = bool(settings.get("hotfolder_polling"))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hotfolder")
+        self._lock = threading.Lock()
+        self._laufend: Set[Any] = set()
+        self._gesehen: Dict[Path, Tuple[int, int]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- lifecycle -----------------------------------------------------------------
+
+    def start(self) -> None:
+        """Run the watcher in a background thread."""
+        self._thread = threading.Thread(target=self.run, name="hotfolder", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching; running jobs finish, their files are restored on the next start otherwise."""
+        self._stop.set()
+        self._pool.shutdown(wait=False)
+
+    def run(self) -> None:
+        """Watch until :meth:`stop` is called."""
+        for ordner in self.ordner:
+            ordner.mkdir(parents=True, exist_ok=True)
+            self._wiederherstellen(ordner)
+        self.maildirs = [m for m in self.maildirs if self._maildir_ok(m)]
+        pfade = [str(o) for o in self.ordner] + [str(m / sub) for m in self.maildirs for sub in ("new", "cur")]
+        if not pfade:
+            logger.warning("Keine Hotfolder oder Maildirs konfiguriert")
+            return
+        logger.info(f"Überwache {', '.join(pfade)}")
+
+        watchfiles = None if self.polling else optional_import("watchfiles")
+        self.scan()
+        if watchfiles is None:
+            while not self._stop.wait(INTERVALL_S):
+                self.scan()
+            return
+        # Change events only wake the scanner; the timeout re-checks files still settling
+        for _changes in watchfiles.watch(
+            *pfade,
+            stop_event=self._stop,
+            rust_timeout=int(INTERVALL_S * 1000),
+            yield_on_timeout=True,
+            recursive=False,
+        ):
+            self.scan()
+
+    # --- scanning ------------------------------------------------------------------
+
+    def _maildir_ok(self, pfad: Path) -> bool:
+        if all((pfad / sub).is_dir() for sub in ("new", "cur", "tmp")):
+            return True
+        logger.error(f"Kein Maildir (new/cur/tmp fehlen): {pfad}")
+        return False
+
+    def _wiederherstellen(self, ordner: Path) -> None:
+        arbeit = ordner / IN_ARBEIT
+        if arbeit.is_dir():
+            for datei in arbeit.iterdir():
+                logger.warning(f"Unterbrochene Verarbeitung, lege zurück: {datei.name}")
+                datei.rename(_frei(ordner / datei.name))
+
+    def _stabil(self, datei: Path) -> bool:
+        # Unchanged since the last scan and not written to for stabil_s seconds
+        try:
+            st = datei.stat()
+        except OSError:
+            return False
+        stamp = (st.st_size, st.st_mtime_ns)
+        vorher = self._gesehen.get(datei)
+        self._gesehen[datei] = stamp
+        return (vorher is None or vorher == stamp) and time.time() - st.st_mtime >= self.stabil_s
+
+    def _frei_fuer_auftrag(self, quelle: Path) -> Optional[ressourcen.Auftrag]:
+        with self._lock:
+            if len(self._laufend) >= self.workers:
+                return None
+        try:
+            return ressourcen.zulassen("batch", mandant=str(quelle))
+        except ressourcen.Ueberlastet:
+            # Uploads keep the queue full; the files simply wait in the folder
+            return None
+
+    def _submit(self, key: Any, auftrag: ressourcen.Auftrag, fn, *args: Any) -> None:
+        with self._lock:
+            self._laufend.add(key)
+
+        def job() -> None:
+            try:
+                with auftrag:
+                    fn(*args)
+            except Exception as e:
+                logger.exception(f"Hotfolder-Auftrag fehlgeschlagen: {e}")
+            finally:
+                with self._lock:
+                    self._laufend.discard(key)
+
+        try:
+            self._pool.submit(job)
+        except RuntimeError:
+            # Pool already shut down
+            auftrag.freigeben()
+            with self._lock:
+                self._laufend.discard(key)
+
+    def _kandidaten(self) -> List[List[Tuple[Path, Any, Any, Tuple[Any, ...]]]]:
+        # Per folder / maildir: (quelle, key, job, args) for every file or mail ready to start
+        quellen = []
+        for ordner in self.ordner:
+            try:
+                dateien = sorted(d for d in ordner.iterdir() if d.is_file() and not d.name.startswith("."))
+            except OSError as e:
+                logger.warning(f"Hotfolder nicht lesbar: {ordner} ({e})")
+                continue
+            self._gesehen = {p: s for p, s in self._gesehen.items() if p.parent != ordner or p in dateien}
+            quellen.append([
+                (ordner, datei, self._verarbeite_datei, (datei,))
+                for datei in dateien
+                if datei.suffix.lower() in DATEI_SUFFIXE and datei not in self._laufend and self._stabil(datei)
+            ])
+        for pfad in self.maildirs:
+            md = mailbox.Maildir(pfad, factory=None, create=False)
+            quellen.append([
+                (pfad, (pfad, key), self._verarbeite_mail, (pfad, key))
+                for key in sorted(md.keys())
+                if (pfad, key) not in self._laufend
+            ])
+        return quellen
+
+    def scan(self) -> int:
+        """Start jobs for every settled file and new mail while capacity is free; returns the number started.
+
+        Folders and maildirs take turns, so one busy source does not take all capacity.
+        """
+        gestartet = 0
+        for eintrag in itertools.chain.from_iterable(itertools.zip_longest(*self._kandidaten())):
+            if eintrag is None:
+                continue
+            quelle, key, fn, args = eintrag
+            auftrag = self._frei_fuer_auftrag(quelle)
+            if auftrag is None:
+                break
+            self._submit(key, auftrag, fn, *args)
+            gestartet += 1
+        return gestartet
+
+    # --- jobs ----------------------------------------------------------------------
+
+    def _verarbeite(self, datei: Path) -> Dict[str, Any]:
+        return self._process(input_path=datei, output_root=self.output_root, settings=load_settings())
+
+    def _verarbeite_datei(self, datei: Path) -> None:
+        arbeit = datei.parent / IN_ARBEIT / datei.name
+        arbeit.parent.mkdir(exist_ok=True)
+        try:
+            datei.rename(arbeit)
+        except FileNotFoundError:
+            return  # taken by another watcher
+        fehler = None
+        try:
+            result = self._verarbeite(arbeit)
+            logger.info(f"Hotfolder: {datei.name} → {result['status']} ({result.get('output_directory')})")
+        except Exception as e:
+            fehler = f"{type(e).__name__}: {e}"
+            logger.error(f"Hotfolder: {datei.name} fehlgeschlagen: {fehler}")
+        ziel = _frei(datei.parent / (FEHLGESCHLAGEN if fehler else ERLEDIGT) / datei.name)
+        ziel.parent.mkdir(exist_ok=True)
+        arbeit.rename(ziel)
+        if fehler:
+            ziel.with_name(ziel.name + ".fehler.txt").write_text(fehler + "\n", encoding="utf-8")
+
+    def _verarbeite_mail(self, pfad: Path, key: str) -> None:
+        md = mailbox.Maildir(pfad, factory=None, create=False)
+        try:
+            nachricht = md.get_message(key)
+        except KeyError:
+            return
+        betreff = nachricht.get("Subject", "")
+        fehler: List[str] = []
+        anhaenge = _anhaenge(email.message_from_bytes(nachricht.as_bytes(), policy=email.policy.default))
+        if not anhaenge:
+            fehler.append("Keine PDF- oder XML-Anhänge")
+        with tempfile.TemporaryDirectory(prefix="mail-") as tmp:
+            for name, data in anhaenge:
+                datei = Path(tmp) / name
+                datei.write_bytes(data)
+                try:
+                    result = self._verarbeite(datei)
+                    logger.info(f"Mail '{betreff}': {name} → {result['status']} ({result.get('output_directory')})")
+                except Exception as e:
+                    fehler.append(f"{name}: {type(e).__name__}: {e}")
+                    logger.error(f"Mail '{betreff}': {name} fehlgeschlagen: {e}")
+        if fehler:
+            # One header line, whatever the exception text contained
+            nachricht["X-Rechnung-Fehler"] = " ".join("; ".join(fehler).split())[:900]
+        md.add_folder(FEHLGESCHLAGEN if fehler else ERLEDIGT).add(nachricht)
+        md.remove(key)
@@ -0,0 +1,573 @@
+"""Shared job queue between the coordinator (API) and extraction workers.
+
+A job carries the uploaded file itself, so workers need nothing but the queue:
+they claim a job with a lease, keep it alive with heartbeats and upload the
+extraction result; the coordinator then exports it into the output tree.
+
+    wartend ──claim──▶ laeuft ──complete_extraction──▶ extrahiert ──claim_export──▶ exportiert ──finish──▶ fertig
+       ▲                  │ fail / lease expired
+       └── retry ─────────┴──▶ fehler (after max_versuche attempts)
+
+``claim_export`` lets exactly one coordinator thread (a waiting submitter or
+the result collector) export a job.
+
+Waiting jobs are claimed by priority class (``auftrag["klasse"]``: uploads
+before hot folders before re-exports), oldest first within a class.
+
+Backends: :class:`SqliteJobQueue` (one host, or several on a shared disk) and
+:class:`RedisJobQueue` for any redis-py compatible client, selected by
+``queue_url`` via :func:`open_queue`.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.infrastructure.engines import optional_import
+from app.infrastructure.ressourcen import DEFAULT_KLASSE, KLASSEN
+from app.infrastructure.storage import DATA_DIR
+
+QUEUE_PATH = DATA_DIR / "queue.sqlite"
+STATUS = ("wartend", "laeuft", "extrahiert", "exportiert", "fertig", "fehler")
+DEFAULT_MAX_VERSUCHE = 3
+
+
+def _klasse(auftrag: Dict[str, Any]) -> str:
+    klasse = auftrag.get("klasse")
+    return klasse if klasse in KLASSEN else DEFAULT_KLASSE
+
+
+@dataclass
+class Job:
+    id: str
+    status: str
+    auftrag: Dict[str, Any]
+    versuche: int = 0
+    worker: Optional[str] = None
+    lease_bis: Optional[float] = None
+    ergebnis: Optional[Dict[str, Any]] = None
+    fehler: Optional[str] = None
+    erstellt: float = 0.0
+    aktualisiert: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "auftrag": self.auftrag,
+            "versuche": self.versuche,
+            "worker": self.worker,
+            "ergebnis": self.ergebnis,
+            "fehler": self.fehler,
+            "erstellt": self.erstellt,
+            "aktualisiert": self.aktualisiert,
+        }
+
+
+class JobQueue(ABC):
+    """Queue interface shared by all backends; every method is safe to call from several processes."""
+
+    def __init__(self, max_versuche: int = DEFAULT_MAX_VERSUCHE):
+        self.max_versuche = max_versuche
+
+    @abstractmethod
+    def enqueue(self, auftrag: Dict[str, Any], eingabe: bytes, ergebnis: Optional[Dict[str, Any]] = None) -> str:
+        """Add a job for the file content ``eingabe``; returns its id.
+
+        With ``ergebnis`` (a duplicate known upfront) the job is stored ``fertig`` right away.
+        """
+
+    @abstractmethod
+    def claim(self, worker: str, lease_s: float) -> Optional[Job]:
+        """Take the next waiting job by class, then age (expired leases first go back to the queue)."""
+
+    @abstractmethod
+    def input(self, job_id: str) -> bytes:
+        """The uploaded file of a job."""
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker: str, lease_s: float) -> bool:
+        """Extend the lease; ``False`` if the job is no longer held by ``worker``."""
+
+    @abstractmethod
+    def complete_extraction(self, job_id: str, worker: str, ergebnis: Dict[str, Any]) -> bool:
+        """Upload a worker's result; ``False`` if the lease was lost in the meantime."""
+
+    @abstractmethod
+    def fail(self, job_id: str, worker: Optional[str], fehler: str, retry: bool = True) -> str:
+        """Record a failed attempt; returns the new status (``wartend`` while attempts remain)."""
+
+    @abstractmethod
+    def cancel(self, job_id: str) -> bool:
+        """Stop a job that is not done yet (status ``fehler``); its worker notices at the next heartbeat."""
+
+    @abstractmethod
+    def claim_export(self, job_id: str) -> Optional[Job]:
+        """Take an ``extrahiert`` job for export (status ``exportiert``); ``None`` if someone else has it."""
+
+    @abstractmethod
+    def finish(self, job_id: str, ergebnis: Dict[str, Any]) -> None:
+        """Store the coordinator's final result for a job taken by :meth:`claim_export` (status ``fertig``)."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        """A job by id, without its input."""
+
+    @abstractmethod
+    def list_jobs(self, status: str, limit: int = 100) -> List[Job]:
+        """Jobs in ``status``, oldest first."""
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status."""
+
+
+# --- SQLite -------------------------------------------------------------------------
+
+_COLUMNS = "id, status, auftrag, versuche, worker, lease_bis, ergebnis, fehler, erstellt, aktualisiert"
+
+
+class SqliteJobQueue(JobQueue):
+    """Queue in one SQLite file (WAL); claims run in ``BEGIN IMMEDIATE`` transactions."""
+
+    def __init__(self, path: Path = QUEUE_PATH, max_versuche: int = DEFAULT_MAX_VERSUCHE):
+        super().__init__(max_versuche)
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Autocommit; transactions are opened explicitly where needed
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    auftrag TEXT NOT NULL,
+                    eingabe BLOB,
+                    versuche INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_bis REAL,
+                    ergebnis TEXT,
+                    fehler TEXT,
+                    erstellt REAL NOT NULL,
+                    aktualisiert REAL NOT NULL,
+                    prioritaet INTEGER NOT NULL DEFAULT 1
+                )"""
+            )
+            # Queues created before priority classes existed
+            if "prioritaet" not in {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN prioritaet INTEGER NOT NULL DEFAULT 1")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, erstellt)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_warteschlange ON jobs(status, prioritaet, erstellt)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            status=row["status"],
+            auftrag=json.loads(row["auftrag"]),
+            versuche=row["versuche"],
+            worker=row["worker"],
+            lease_bis=row["lease_bis"],
+            ergebnis=json.loads(row["ergebnis"]) if row["ergebnis"] else None,
+            fehler=row["fehler"],
+            erstellt=row["erstellt"],
+            aktualisiert=row["aktualisiert"],
+        )
+
+    def enqueue(self, auftrag: Dict[str, Any], eingabe: bytes, ergebnis: Optional[Dict[str, Any]] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            """INSERT INTO jobs (id, status, auftrag, eingabe, ergebnis, erstellt, aktualisiert, prioritaet)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                job_id,
+                "wartend" if ergebnis is None else "fertig",
+                json.dumps(auftrag, ensure_ascii=False),
+                eingabe if ergebnis is None else None,
+                json.dumps(ergebnis, ensure_ascii=False, default=str) if ergebnis is not None else None,
+                now,
+                now,
+                KLASSEN.index(_klasse(auftrag)),
+            ),
+        )
+        return job_id
+
+    def claim(self, worker: str, lease_s: float) -> Optional[Job]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """UPDATE jobs SET
+                       status = CASE WHEN versuche >= ? THEN 'fehler' ELSE 'wartend' END,
+                       fehler = 'Lease abgelaufen (Worker ' || worker || ')', worker = NULL, aktualisiert = ?
+                   WHERE status = 'laeuft' AND lease_bis < ?""",
+                (self.max_versuche, now, now),
+            )
+            row = conn.execute("SELECT id FROM jobs WHERE status = 'wartend' ORDER BY prioritaet, erstellt LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                """UPDATE jobs SET status = 'laeuft', worker = ?, lease_bis = ?, versuche = versuche + 1,
+                       aktualisiert = ? WHERE id = ?""",
+                (worker, now + lease_s, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row["id"])
+
+    def input(self, job_id: str) -> bytes:
+        row = self._conn().execute("SELECT eingabe FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        return bytes(row["eingabe"])
+
+    def heartbeat(self, job_id: str, worker: str, lease_s: float) -> bool:
+        now = time.time()
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_bis = ?, aktualisiert = ? WHERE id = ? AND worker = ? AND status = 'laeuft'",
+            (now + lease_s, now, job_id, worker),
+        )
+        return cur.rowcount == 1
+
+    def complete_extraction(self, job_id: str, worker: str, ergebnis: Dict[str, Any]) -> bool:
+        cur = self._conn().execute(
+            """UPDATE jobs SET status = 'extrahiert', ergebnis = ?, fehler = NULL, lease_bis = NULL, aktualisiert = ?
+               WHERE id = ? AND worker = ? AND status = 'laeuft'""",
+            (json.dumps(ergebnis, ensure_ascii=False), time.time(), job_id, worker),
+        )
+        return cur.rowcount == 1
+
+    def fail(self, job_id: str, worker: Optional[str], fehler: str, retry: bool = True) -> str:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT versuche, worker, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] in ("fertig", "fehler") or (
+                worker is not None and (row["worker"] != worker or row["status"] != "laeuft")
+            ):
+                conn.execute("COMMIT")
+                return row["status"] if row is not None else "fehler"
+            status = "wartend" if retry and row["versuche"] < self.max_versuche else "fehler"
+            conn.execute(
+                "UPDATE jobs SET status = ?, fehler = ?, worker = NULL, lease_bis = NULL, aktualisiert = ? WHERE id = ?",
+                (status, fehler, time.time(), job_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return status
+
+    def cancel(self, job_id: str) -> bool:
+        cur = self._conn().execute(
+            """UPDATE jobs SET status = 'fehler', fehler = 'Abgebrochen', worker = NULL, lease_bis = NULL,
+                   eingabe = NULL, aktualisiert = ? WHERE id = ? AND status IN ('wartend', 'laeuft', 'extrahiert')""",
+            (time.time(), job_id),
+        )
+        return cur.rowcount == 1
+
+    def claim_export(self, job_id: str) -> Optional[Job]:
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = 'exportiert', aktualisiert = ? WHERE id = ? AND status = 'extrahiert'",
+            (time.time(), job_id),
+        )
+        return self.get(job_id) if cur.rowcount == 1 else None
+
+    def finish(self, job_id: str, ergebnis: Dict[str, Any]) -> None:
+        # The input is no longer needed once the outputs exist
+        self._conn().execute(
+            """UPDATE jobs SET status = 'fertig', ergebnis = ?, eingabe = NULL, aktualisiert = ?
+               WHERE id = ? AND status = 'exportiert'""",
+            (json.dumps(ergebnis, ensure_ascii=False, default=str), time.time(), job_id),
+        )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._conn().execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def list_jobs(self, status: str, limit: int = 100) -> List[Job]:
+        rows = self._conn().execute(
+            f"SELECT {_COLUMNS} FROM jobs WHERE status = ? ORDER BY erstellt LIMIT ?", (status, limit)
+        ).fetchall()
+        return [self._job(r) for r in rows]
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUS, 0)
+        for row in self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        return counts
+
+
+# --- Redis --------------------------------------------------------------------------
+
+
+def _text(value: Any) -> Optional[str]:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class RedisJobQueue(JobQueue):
+    """Queue on a Redis server, for workers on several hosts.
+
+    ``client`` is a redis-py compatible client (``redis.Redis``, or a local
+    stand-in with the same commands in tests). Layout below ``prefix``: one
+    hash per job, one list ``wartend:<klasse>`` per priority class (FIFO), the sorted set ``leases``
+    (job id → lease end) and one set of job ids per status. Transitions are
+    check-and-set transactions on the job's hash, so the reaper, a late worker
+    and a cancel never overwrite each other.
+    """
+
+    def __init__(self, client: Any, prefix: str = "rechnung", max_versuche: int = DEFAULT_MAX_VERSUCHE):
+        super().__init__(max_versuche)
+        self.r = client
+        self.prefix = prefix
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def _set_status(self, pipe: Any, job_id: str, alt: Optional[str], neu: str, **felder: Any) -> None:
+        if alt:
+            pipe.srem(self._key("status", alt), job_id)
+        pipe.sadd(self._key("status", neu), job_id)
+        felder = {k: ("" if v is None else v) for k, v in felder.items()}
+        pipe.hset(self._key("job", job_id), mapping={"status": neu, "aktualisiert": time.time(), **felder})
+
+    def _atomar(self, job_id: str, schritt: Callable[[Any], Tuple[Any, Optional[Callable[[Any], None]]]]) -> Any:
+        """Check-and-set on one job (WATCH/MULTI), like the guarded ``UPDATE … WHERE`` of the SQLite queue.
+
+        ``schritt`` reads the job through the watched pipeline and returns
+        ``(result, writes)``; ``writes`` queues the changes, or is ``None`` to
+        change nothing. If the job is modified in between, ``schritt`` runs again.
+        """
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._key("job", job_id))
+                    ergebnis, schreiben = schritt(pipe)
+                    if schreiben is None:
+                        pipe.unwatch()
+                        return ergebnis
+                    pipe.multi()
+                    schreiben(pipe)
+                    pipe.execute()
+                    return ergebnis
+                except Exception as e:
+                    # redis.exceptions.WatchError, or the same-named error of a stand-in client
+                    if type(e).__name__ != "WatchError":
+                        raise
+
+    def _requeue(self, pipe: Any, job: Job, fehler: str, retry: bool) -> str:
+        status = "wartend" if retry and job.versuche < self.max_versuche else "fehler"
+        pipe.zrem(self._key("leases"), job.id)
+        self._set_status(pipe, job.id, job.status, status, fehler=fehler, worker=None, lease_bis=None)
+        if status == "wartend":
+            # Retries go to the front of the queue
+            pipe.rpush(self._key("wartend", _klasse(job.auftrag)), job.id)
+        return status
+
+    def enqueue(self, auftrag: Dict[str, Any], eingabe: bytes, ergebnis: Optional[Dict[str, Any]] = None) -> str:
+        job_id = uuid.uuid4().hex
+        pipe = self.r.pipeline()
+        pipe.hset(self._key("job", job_id), mapping={
+            "auftrag": json.dumps(auftrag, ensure_ascii=False),
+            "versuche": 0,
+            "erstellt": time.time(),
+        })
+        if ergebnis is not None:
+            self._set_status(pipe, job_id, None, "fertig", ergebnis=json.dumps(ergebnis, ensure_ascii=False, default=str))
+        else:
+            pipe.hset(self._key("job", job_id), mapping={"eingabe": eingabe})
+            self._set_status(pipe, job_id, None, "wartend")
+            pipe.lpush(self._key("wartend", _klasse(auftrag)), job_id)
+        pipe.execute()
+        return job_id
+
+    def _reap(self, now: float) -> None:
+        for raw in self.r.zrangebyscore(self._key("leases"), "-inf", now):
+            job_id = _text(raw)
+
+            def ablauf(pipe: Any, job_id: str = job_id) -> Tuple[None, Optional[Callable[[Any], None]]]:
+                job = self._laden(pipe, job_id)
+                if job is None or job.status != "laeuft":
+                    # Stale lease of a job that finished, failed or was cancelled meanwhile
+                    return None, lambda p: p.zrem(self._key("leases"), job_id)
+                if job.lease_bis is not None and job.lease_bis >= now:
+                    return None, None
+                return None, lambda p: self._requeue(p, job, f"Lease abgelaufen (Worker {job.worker})", True)
+
+            self._atomar(job_id, ablauf)
+
+    def claim(self, worker: str, lease_s: float) -> Optional[Job]:
+        now = time.time()
+        self._reap(now)
+        for klasse in KLASSEN:
+            while True:
+                job_id = _text(self.r.rpop(self._key("wartend", klasse)))
+                if job_id is None:
+                    break
+                if self._atomar(job_id, lambda pipe, job_id=job_id: self._belegen(pipe, job_id, worker, now + lease_s)):
+                    return self.get(job_id)
+        return None
+
+    def _belegen(self, pipe: Any, job_id: str, worker: str, bis: float) -> Tuple[bool, Optional[Callable[[Any], None]]]:
+        # Skip stale entries, e.g. of a job requeued twice or cancelled while waiting
+        if _text(pipe.hget(self._key("job", job_id), "status")) != "wartend":
+            return False, None
+
+        def schreiben(p: Any) -> None:
+            p.hincrby(self._key("job", job_id), "versuche", 1)
+            p.zadd(self._key("leases"), {job_id: bis})
+            self._set_status(p, job_id, "wartend", "laeuft", worker=worker, lease_bis=bis)
+
+        return True, schreiben
+
+    def input(self, job_id: str) -> bytes:
+        data = self.r.hget(self._key("job", job_id), "eingabe")
+        if data is None:
+            raise KeyError(job_id)
+        return data if isinstance(data, bytes) else data.encode("latin-1")
+
+    def _holds(self, pipe: Any, job_id: str, worker: str) -> bool:
+        status, holder = pipe.hmget(self._key("job", job_id), ["status", "worker"])
+        return _text(status) == "laeuft" and _text(holder) == worker
+
+    def heartbeat(self, job_id: str, worker: str, lease_s: float) -> bool:
+        def schritt(pipe: Any) -> Tuple[bool, Optional[Callable[[Any], None]]]:
+            if not self._holds(pipe, job_id, worker):
+                return False, None
+            bis = time.time() + lease_s
+
+            def schreiben(p: Any) -> None:
+                p.zadd(self._key("leases"), {job_id: bis})
+                p.hset(self._key("job", job_id), mapping={"lease_bis": bis, "aktualisiert": time.time()})
+
+            return True, schreiben
+
+        return self._atomar(job_id, schritt)
+
+    def complete_extraction(self, job_id: str, worker: str, ergebnis: Dict[str, Any]) -> bool:
+        def schritt(pipe: Any) -> Tuple[bool, Optional[Callable[[Any], None]]]:
+            if not self._holds(pipe, job_id, worker):
+                return False, None
+
+            def schreiben(p: Any) -> None:
+                p.zrem(self._key("leases"), job_id)
+                self._set_status(
+                    p, job_id, "laeuft", "extrahiert",
+                    ergebnis=json.dumps(ergebnis, ensure_ascii=False), fehler=None, lease_bis=None,
+                )
+
+            return True, schreiben
+
+        return self._atomar(job_id, schritt)
+
+    def fail(self, job_id: str, worker: Optional[str], fehler: str, retry: bool = True) -> str:
+        def schritt(pipe: Any) -> Tuple[str, Optional[Callable[[Any], None]]]:
+            job = self._laden(pipe, job_id)
+            if job is None:
+                return "fehler", None
+            # A worker only fails the job it still runs; the coordinator any job not done yet
+            if job.status in ("fertig", "fehler") or (worker is not None and (job.status != "laeuft" or job.worker != worker)):
+                return job.status, None
+            status = "wartend" if retry and job.versuche < self.max_versuche else "fehler"
+            return status, lambda p: self._requeue(p, job, fehler, retry)
+
+        return self._atomar(job_id, schritt)
+
+    def cancel(self, job_id: str) -> bool:
+        def schritt(pipe: Any) -> Tuple[bool, Optional[Callable[[Any], None]]]:
+            status = _text(pipe.hget(self._key("job", job_id), "status"))
+            if status not in ("wartend", "laeuft", "extrahiert"):
+                return False, None
+
+            def schreiben(p: Any) -> None:
+                p.zrem(self._key("leases"), job_id)
+                # A stale entry in the waiting list is skipped by claim()
+                self._set_status(p, job_id, status, "fehler", fehler="Abgebrochen", worker=None, lease_bis=None)
+                p.hdel(self._key("job", job_id), "eingabe")
+
+            return True, schreiben
+
+        return self._atomar(job_id, schritt)
+
+    def claim_export(self, job_id: str) -> Optional[Job]:
+        def schritt(pipe: Any) -> Tuple[bool, Optional[Callable[[Any], None]]]:
+            if _text(pipe.hget(self._key("job", job_id), "status")) != "extrahiert":
+                return False, None
+            return True, lambda p: self._set_status(p, job_id, "extrahiert", "exportiert")
+
+        return self.get(job_id) if self._atomar(job_id, schritt) else None
+
+    def finish(self, job_id: str, ergebnis: Dict[str, Any]) -> None:
+        def schritt(pipe: Any) -> Tuple[None, Optional[Callable[[Any], None]]]:
+            if _text(pipe.hget(self._key("job", job_id), "status")) != "exportiert":
+                return None, None
+
+            def schreiben(p: Any) -> None:
+                self._set_status(
+                    p, job_id, "exportiert", "fertig", ergebnis=json.dumps(ergebnis, ensure_ascii=False, default=str)
+                )
+                p.hdel(self._key("job", job_id), "eingabe")
+
+            return None, schreiben
+
+        self._atomar(job_id, schritt)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._laden(self.r, job_id)
+
+    def _laden(self, client: Any, job_id: str) -> Optional[Job]:
+        fields = ["status", "auftrag", "versuche", "worker", "lease_bis", "ergebnis", "fehler", "erstellt", "aktualisiert"]
+        values = dict(zip(fields, (_text(v) for v in client.hmget(self._key("job", job_id), fields))))
+        if not values["status"]:
+            return None
+        return Job(
+            id=job_id,
+            status=values["status"],
+            auftrag=json.loads(values["auftrag"]),
+            versuche=int(values["versuche"] or 0),
+            worker=values["worker"] or None,
+            lease_bis=float(values["lease_bis"]) if values["lease_bis"] else None,
+            ergebnis=json.loads(values["ergebnis"]) if values["ergebnis"] else None,
+            fehler=values["fehler"] or None,
+            erstellt=float(values["erstellt"] or 0),
+            aktualisiert=float(values["aktualisiert"] or 0),
+        )
+
+    def list_jobs(self, status: str, limit: int = 100) -> List[Job]:
+        jobs = [self.get(_text(j)) for j in self.r.smembers(self._key("status", status))]
+        return sorted((j for j in jobs if j is not None), key=lambda j: j.erstellt)[:limit]
+
+    def counts(self) -> Dict[str, int]:
+        return {status: int(self.r.scard(self._key("status", status))) for status in STATUS}
+
+
+def open_queue(url: str = "", max_versuche: int = DEFAULT_MAX_VERSUCHE) -> JobQueue:
+    """Queue for ``url``: empty (``data/queue.sqlite``), ``sqlite:///<path>`` or ``redis://…``."""
+    if not url:
+        return SqliteJobQueue(QUEUE_PATH, max_versuche)
+    if url.startswith("sqlite:///"):
+        return SqliteJobQueue(Path(url[len("sqlite:///"):]), max_versuche)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        redis = optional_import("redis")
+        if redis is None:
+            raise RuntimeError("Für eine Redis-Queue wird das Paket 'redis' benötigt")
+        return RedisJobQueue(redis.Redis.from_url(url), max_versuche=max_versuche)
+    raise ValueError(f"Unbekannte Queue-URL: {url}")
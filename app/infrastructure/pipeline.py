@@ -1,16 +1,24 @@
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+import hashlib
 import json
 from loguru import logger
 
 from app.services.extraction.raw_text import extract_raw_text_to_file
-from app.services.llm.extractor import llm_extract_draft_json
-from app.services.llm.normalizer import validate_and_normalize
-from app.services.export.xrechnung.ubl_mapper import map_to_ubl
-from app.services.export.xrechnung.xrechnung_writer import write_xrechnung_xml
-from app.services.export.zugferd.cii_mapper import map_to_cii
-from app.services.export.zugferd.zugferd_writer import write_zugferd_xml
-from app.services.export.pdf.pdfa3 import generate_pdf_a3_with_xml
+from app.services.llm.cascade import extract_with_cascade
+from app.services.llm.normalizer import check_rules
+from app.services.ingest.einvoice import read_einvoice
+from app.services.export.outputs import (
+    EXPORT_STAGES, OUTPUT_FILES, export_fingerprints, output_dir_for, render_outputs, resolve_targets, write_outputs,
+)
+from app.services.export.zugferd.zugferd_writer import resolve_profile
+from app.services.validation.xml_validator import validate_xml
+from app.infrastructure.checkpoints import Lauf
+from app.infrastructure.ressourcen import Unterbrochen, pruefen
+from app.infrastructure.rechnungsindex import (
+    find_by_hash, find_by_key, get_entry, index_rechnung, remember_source, semantic_key,
+)
 
 from app.domain.rechnung_model import Rechnung
 
@@ -19,56 +27,243 @@ def ensure_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
 
-def process_input_file(input_path: Path, output_root: Path, settings: Dict[str, Any]) -> Dict[str, Any]:
-    logger.info(f"Verarbeite Datei: {input_path}")
+def validate_outputs(outputs: Dict[str, bytes]) -> Dict[str, Any]:
+    """XSD / Schematron check of the generated XML (reported, not blocking)."""
+    xml_validierung = {}
+    for name in ("xrechnung_xml", "zugferd_xml"):
+        if name not in outputs:
+            continue
+        bericht = validate_xml(outputs[name])
+        for v in bericht.verstoesse:
+            logger.warning(f"{OUTPUT_FILES[name]}: {v}")
+        xml_validierung[name] = bericht.as_dict()
+    return xml_validierung
+
 
-    # 1) Extract raw text
-    work_dir = output_root / "_working"
-    ensure_dir(work_dir)
-    raw_text_path = extract_raw_text_to_file(input_path=input_path, dest_dir=work_dir)
-    #return
-    # 2) LLM → draft JSON
-    llm_model_path = Path(settings.get("llm_model_path", "./models/model.gguf"))
-    #print(llm_model_path)
-    clip_model_path = Path(settings.get("clip_model_path", "models/mmproj-F32.gguf"))
-    draft_json = llm_extract_draft_json(raw_text_path=raw_text_path, model_path=llm_model_path, clip_model_path=clip_model_path)
-    # 3) Validation & Normalization → canonical Rechnung
-    print(draft_json)
-    canonical: Rechnung = validate_and_normalize(draft_json)
-
-    rechnungsnummer = canonical.dokument.rechnungsnummer
-    out_dir = output_root / rechnungsnummer
-    ensure_dir(out_dir)
-
-    canonical_json_path = out_dir / "canonical.json"
-    canonical_json_path.write_text(canonical.model_dump_json(indent=2, ensure_ascii=False), encoding="utf-8")
-
-    # 4) Exports
-    # XRechnung
-    ubl_invoice = map_to_ubl(canonical)
-    xrechnung_path = out_dir / "xrechnung.xml"
-    write_xrechnung_xml(ubl_invoice, xrechnung_path)
-
-    # ZUGFeRD
-    cii_invoice = map_to_cii(canonical)
-    zugferd_xml_path = out_dir / "zugferd.xml"
-    write_zugferd_xml(cii_invoice, zugferd_xml_path)
-
-    # PDF/A-3 with embedded ZUGFeRD XML
-    logo_path = settings.get("logo_path") or ""
-    pdf_path = out_dir / "zugferd.pdf"
-    #print(canonical.model_dump())
-    generate_pdf_a3_with_xml(canonical.model_dump(), zugferd_xml_path, pdf_path, logo_path=logo_path)
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
+
+def _duplicate_result(out_dir: str, art: str) -> Dict[str, Any]:
+    """Result of the earlier run in ``out_dir``, returned instead of processing again."""
+    entry = get_entry(out_dir) or {}
+    logger.info(f"Duplikat ({art}) von {out_dir}, überspringe Verarbeitung")
     return {
-        "status": "success",
-        "rechnungsnummer": rechnungsnummer,
-        "output_directory": str(out_dir.resolve()),
+        "status": "duplicate",
+        "duplikat": art,
+        "rechnungsnummer": entry.get("rechnungsnummer"),
+        "output_directory": out_dir,
         "files": {
-            "raw_text": str(raw_text_path.resolve()),
-            "canonical_json": str(canonical_json_path.resolve()),
-            "xrechnung_xml": str(xrechnung_path.resolve()),
-            "zugferd_xml": str(zugferd_xml_path.resolve()),
-            "zugferd_pdf": str(pdf_path.resolve()),
+            name: str(Path(out_dir) / filename)
+            for name, filename in OUTPUT_FILES.items()
+            if (Path(out_dir) / filename).exists()
         },
-    }
\ No newline at end of file
+    }
+
+
+def _free_output_dir(out_dir: Path, key: str) -> Path:
+    # Same supplier and number but a different total (e.g. a corrected invoice): never overwrite
+    candidate, n = out_dir, 1
+    while (candidate / "canonical.json").exists():
+        entry = get_entry(str(candidate.resolve()))
+        if entry is not None and entry.get("schluessel") == key:
+            return candidate
+        n += 1
+        candidate = out_dir.with_name(f"{out_dir.name}-{n}")
+    return candidate
+
+
+def _export_variante(settings: Dict[str, Any]) -> str:
+    # Checkpointed exports are only reused when rendered with the same options
+    return f"{settings['zugferd_profil']}|{bool(settings.get('xml_pretty_print'))}|{settings.get('logo_path') or ''}"
+
+
+@contextmanager
+def _teilergebnis(lauf: Lauf) -> Iterator[None]:
+    # A cancelled or timed-out run reports what it has finished; a retry resumes from there
+    try:
+        yield
+    except Unterbrochen as e:
+        e.teilergebnis.setdefault("fertige_stufen", sorted(lauf.stufen))
+        e.teilergebnis.setdefault("checkpoint", str(lauf.dir))
+        if lauf.hat("raw_text"):
+            e.teilergebnis.setdefault("raw_text", str(lauf.pfad("raw_text")))
+        raise
+
+
+def _extract(
+    input_path: Path,
+    lauf: Lauf,
+    settings: Dict[str, Any],
+    regelsaetze: Iterable[str],
+    on_field: Optional[Callable[[str, Any], None]],
+) -> Tuple[Rechnung, Optional[Path], Optional[Dict[str, Any]]]:
+    """Canonical invoice for the input, resuming from the run's checkpoints."""
+    raw_text_path = lauf.pfad("raw_text") if lauf.hat("raw_text") else None
+    if lauf.hat("canonical"):
+        logger.info(f"Kanonische Rechnung aus Checkpoint: {lauf.dir}")
+        canonical = Rechnung.model_validate_json(lauf.lesen("canonical"))
+        return canonical, raw_text_path, lauf.meta("canonical").get("llm")
+
+    # Structured e-invoices (XRechnung / ZUGFeRD) are read directly, no OCR or LLM
+    llm_info: Optional[Dict[str, Any]] = None
+    canonical: Optional[Rechnung] = read_einvoice(input_path)
+    if canonical is not None:
+        check_rules(canonical, regelsaetze)
+    else:
+        # 1) Extract raw text
+        if raw_text_path is None:
+            raw_text_path = extract_raw_text_to_file(input_path=input_path, dest_dir=lauf.dir)
+            lauf.merken("raw_text", raw_text_path)
+        # 2) LLM → draft JSON, small model first when configured;
+        # 3) validation & normalization → canonical Rechnung (failing fields are re-asked)
+        # The large model's draft is a checkpoint: a retry only repeats the field repair
+        draft_path = lauf.dir / "draft.json"
+        canonical, llm_info = extract_with_cascade(
+            raw_text_path,
+            settings,
+            regelsaetze=regelsaetze,
+            on_field=on_field,
+            draft_path=draft_path,
+            on_draft=lambda draft: lauf.merken("draft", draft_path),
+            resume_draft=json.loads(lauf.lesen("draft")) if lauf.hat("draft") else None,
+        )
+    lauf.speichern(
+        "canonical",
+        canonical.model_dump_json(indent=2, ensure_ascii=False).encode("utf-8"),
+        "canonical.json",
+        llm=llm_info,
+    )
+    return canonical, raw_text_path, llm_info
+
+
+def extract_invoice(
+    input_path: Path,
+    work_root: Path,
+    settings: Dict[str, Any],
+    on_field: Optional[Callable[[str, Any], None]] = None,
+) -> Tuple[Rechnung, Optional[str], Optional[Dict[str, Any]]]:
+    """Only the extraction (e-invoice, OCR, LLM), returning ``(canonical, raw_text, llm_info)``.
+
+    Used by workers; checkpointed in ``work_root`` like a full run, so a retry on
+    the same node resumes.
+    """
+    lauf = Lauf(work_root, file_sha256(input_path))
+    with lauf.sperren(), _teilergebnis(lauf):
+        canonical, raw_text_path, llm_info = _extract(input_path, lauf, settings, settings.get("regelsaetze") or (), on_field)
+        raw_text = raw_text_path.read_text(encoding="utf-8") if raw_text_path else None
+        lauf.abschliessen()
+    return canonical, raw_text, llm_info
+
+
+def duplicate_of(quell_hash: str) -> Optional[Dict[str, Any]]:
+    """Earlier result for a byte-identical source file, if any."""
+    existing = find_by_hash(quell_hash)
+    return _duplicate_result(existing, "inhalt") if existing else None
+
+
+def process_input_file(
+    input_path: Path,
+    output_root: Path,
+    settings: Dict[str, Any],
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    targets: Optional[Iterable[str]] = None,
+    profil: Optional[str] = None,
+    duplikate_pruefen: bool = True,
+) -> Dict[str, Any]:
+    """Extract, validate and export one invoice.
+
+    With ``duplikate_pruefen`` a byte-identical source file (checked before any
+    extraction) or an already processed invoice with the same supplier, number
+    and total returns the earlier result with ``status == "duplicate"``.
+
+    Every stage is checkpointed under ``<output_root>/_working/<hash>/``; running
+    the same file again after a failure resumes after the last finished stage.
+    A concurrent run of the same file waits until this one is done.
+    """
+    logger.info(f"Verarbeite Datei: {input_path}")
+    # Per-request export choice; checked before the expensive extraction
+    targets = resolve_targets(targets if targets is not None else settings.get("export_outputs"))
+    settings = {**settings, "zugferd_profil": resolve_profile(profil or settings.get("zugferd_profil"))}
+    regelsaetze = settings.get("regelsaetze") or ()
+
+    # 0) Exact duplicate: same file content as an earlier run
+    quell_hash = file_sha256(input_path)
+    lauf = Lauf(output_root / "_working", quell_hash)
+    # Same file in parallel (two uploads, hot folder and retry): one run at a time per checkpoint
+    with lauf.sperren():
+        if duplikate_pruefen:
+            existing = find_by_hash(quell_hash)
+            if existing:
+                # A run interrupted after its outputs were written is complete
+                if lauf.dir.exists():
+                    lauf.abschliessen()
+                return _duplicate_result(existing, "inhalt")
+
+        if lauf.stufen:
+            logger.info(f"Setze Lauf fort, vorhandene Stufen: {', '.join(lauf.stufen)}")
+        lauf.quelle_sichern(input_path)
+        with _teilergebnis(lauf):
+            canonical, raw_text_path, llm_info = _extract(input_path, lauf, settings, regelsaetze, on_field)
+
+        # Semantic duplicate: the same invoice received through another channel (mail and post)
+        key = semantic_key(canonical)
+        if duplikate_pruefen:
+            existing = find_by_key(key)
+            if existing:
+                remember_source(quell_hash, existing)
+                lauf.abschliessen()
+                return _duplicate_result(existing, "inhaltlich")
+
+        rechnungsnummer = canonical.dokument.rechnungsnummer
+        out_dir = _free_output_dir(output_dir_for(output_root, canonical), key)
+
+        # 4) Exports, rendered in memory; each finished stage is checkpointed
+        variante = _export_variante(settings)
+        done = {
+            name: lauf.lesen(name)
+            for name in EXPORT_STAGES
+            if lauf.hat(name) and lauf.meta(name).get("variante") == variante
+        }
+        with _teilergebnis(lauf):
+            pruefen()
+            outputs = render_outputs(
+                canonical,
+                settings,
+                targets,
+                done=done,
+                on_stage=lambda name, data: lauf.speichern(name, data, f"export/{name}", variante=variante),
+            )
+        xml_validierung = validate_outputs(outputs)
+        # 5) Written once, atomically
+        files = write_outputs(
+            outputs,
+            out_dir,
+            fingerprints=export_fingerprints(canonical, settings, outputs),
+            profil=settings["zugferd_profil"],
+            quell_hash=quell_hash,
+        )
+        # 6) Searchable index entry; the outputs are already complete without it
+        try:
+            raw_text = raw_text_path.read_text(encoding="utf-8") if raw_text_path else None
+            index_rechnung(canonical, str(out_dir.resolve()), raw_text=raw_text, quell_hash=quell_hash)
+        except Exception as e:
+            logger.warning(f"Indexierung fehlgeschlagen: {e}")
+        lauf.abschliessen()
+
+        return {
+            "status": "success",
+            "rechnungsnummer": rechnungsnummer,
+            "output_directory": str(out_dir.resolve()),
+            "zugferd_profil": settings["zugferd_profil"],
+            "llm": llm_info,
+            "xml_validierung": xml_validierung,
+            "files": {
+                "raw_text": str(raw_text_path.resolve()) if raw_text_path else None,
+                **files,
+            },
+        }
@@ -0,0 +1,343 @@
+"""Embedded SQLite index over the processed invoices.
+
+One row per output directory with the columns needed for listing and
+filtering, plus an FTS5 table over supplier/buyer names, line descriptions and
+the extracted raw text. Listing or searching never opens a ``canonical.json``;
+:func:`reindex` rebuilds the index from an existing output tree, taking the
+raw text from the run's checkpoint under ``_working``.
+
+The index also answers the duplicate checks: source files by content hash
+(``quellen``) and invoices by semantic key (supplier, number, gross total).
+"""
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from app.domain.rechnung.berechnung import to_cents
+from app.domain.rechnung_model import Rechnung
+from app.infrastructure.checkpoints import behaltene_datei
+from app.infrastructure.storage import DATA_DIR
+
+INDEX_PATH = DATA_DIR / "index.sqlite"
+# Raw text beyond this is not searchable; OCR output of long scans is mostly noise
+MAX_RAW_TEXT = 200_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rechnungen (
+    id INTEGER PRIMARY KEY,
+    output_directory TEXT NOT NULL UNIQUE,
+    rechnungsnummer TEXT NOT NULL,
+    rechnungsart TEXT,
+    rechnungsdatum TEXT,
+    faelligkeitsdatum TEXT,
+    verkaeufer TEXT,
+    verkaeufer_suche TEXT,
+    verkaeufer_ust_id TEXT,
+    kaeufer TEXT,
+    waehrung TEXT,
+    gesamt_netto REAL,
+    gesamt_brutto REAL,
+    zahlbetrag REAL,
+    schluessel TEXT,
+    indiziert TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quellen (
+    sha256 TEXT PRIMARY KEY,
+    output_directory TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rechnungen_datum ON rechnungen (rechnungsdatum, id);
+CREATE INDEX IF NOT EXISTS rechnungen_verkaeufer ON rechnungen (verkaeufer COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS rechnungen_brutto ON rechnungen (gesamt_brutto);
+CREATE INDEX IF NOT EXISTS quellen_verzeichnis ON quellen (output_directory);
+CREATE VIRTUAL TABLE IF NOT EXISTS rechnungen_fts USING fts5 (
+    verkaeufer, kaeufer, beschreibungen, raw_text,
+    tokenize = "unicode61 remove_diacritics 2"
+);
+"""
+
+_SPALTEN = (
+    "id", "output_directory", "rechnungsnummer", "rechnungsart", "rechnungsdatum", "faelligkeitsdatum",
+    "verkaeufer", "verkaeufer_ust_id", "kaeufer", "waehrung", "gesamt_netto", "gesamt_brutto", "zahlbetrag",
+    "schluessel", "indiziert",
+)
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready: set = set()
+
+
+def _suchform(value: Optional[str]) -> str:
+    """Case-insensitive form for substring filters; SQLite's LIKE only folds ASCII (``Ä``/``ä``, ``ß``/``SS``)."""
+    return unicodedata.normalize("NFKC", value or "").casefold()
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rechnungen'").fetchone()
+    spalten = {r[1] for r in conn.execute("PRAGMA table_info(rechnungen)")} if exists else set()
+    # Indexes created before duplicate detection lack the key column
+    if exists and "schluessel" not in spalten:
+        conn.execute("ALTER TABLE rechnungen ADD COLUMN schluessel TEXT")
+    if exists and "verkaeufer_suche" not in spalten:
+        conn.execute("ALTER TABLE rechnungen ADD COLUMN verkaeufer_suche TEXT")
+        with conn:
+            conn.executemany(
+                "UPDATE rechnungen SET verkaeufer_suche = ? WHERE id = ?",
+                [(_suchform(r[1]), r[0]) for r in conn.execute("SELECT id, verkaeufer FROM rechnungen").fetchall()],
+            )
+    conn.executescript(_SCHEMA)
+    conn.execute("CREATE INDEX IF NOT EXISTS rechnungen_schluessel ON rechnungen (schluessel)")
+
+
+def _connect(db_path: Optional[Path] = None) -> sqlite3.Connection:
+    """One connection per thread and database file (sqlite3 connections are not shared)."""
+    path = str(db_path or INDEX_PATH)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _schema_lock:
+            if path not in _schema_ready:
+                _create_schema(conn)
+                _schema_ready.add(path)
+        conns[path] = conn
+    return conn
+
+
+def _iso(d: Optional[date]) -> Optional[str]:
+    return d.isoformat() if d else None
+
+
+def _normalize(value: Optional[str]) -> str:
+    return re.sub(r"[\W_]+", "", value or "").upper()
+
+
+def lieferant_kennung(rechnung: Rechnung) -> str:
+    """Stable supplier identity: VAT id, else tax number, else the normalized name."""
+    v = rechnung.verkaeufer
+    return _normalize(v.umsatzsteuer_id) or _normalize(v.steuernummer) or _normalize(v.name) or "UNBEKANNT"
+
+
+def semantic_key(rechnung: Rechnung) -> str:
+    """Supplier + invoice number + gross total in cents; equal keys are the same invoice."""
+    return "|".join(
+        (lieferant_kennung(rechnung), _normalize(rechnung.dokument.rechnungsnummer), str(to_cents(rechnung.summen.gesamt_brutto)))
+    )
+
+
+def index_rechnung(
+    rechnung: Rechnung,
+    output_directory: str,
+    raw_text: Optional[str] = None,
+    quell_hash: Optional[str] = None,
+    db_path: Optional[Path] = None,
+) -> int:
+    """Insert or replace the entry for ``output_directory``; returns its id.
+
+    ``quell_hash`` (sha256 of the source file) is remembered for the exact duplicate check.
+    """
+    d, s = rechnung.dokument, rechnung.summen
+    row = {
+        "output_directory": str(output_directory),
+        "rechnungsnummer": d.rechnungsnummer,
+        "rechnungsart": d.rechnungsart,
+        "rechnungsdatum": _iso(d.rechnungsdatum),
+        "faelligkeitsdatum": _iso(d.faelligkeitsdatum),
+        "verkaeufer": rechnung.verkaeufer.name,
+        "verkaeufer_suche": _suchform(rechnung.verkaeufer.name),
+        "verkaeufer_ust_id": rechnung.verkaeufer.umsatzsteuer_id,
+        "kaeufer": rechnung.kaeufer.name,
+        "waehrung": d.waehrung,
+        "gesamt_netto": s.gesamt_netto,
+        "gesamt_brutto": s.gesamt_brutto,
+        "zahlbetrag": s.zahlbetrag if s.zahlbetrag is not None else s.gesamt_brutto,
+        "schluessel": semantic_key(rechnung),
+        "indiziert": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    beschreibungen = "\n".join(p.beschreibung for p in rechnung.positionen if p.beschreibung)
+    conn = _connect(db_path)
+    with conn:
+        cols = ", ".join(row)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in row if c != "output_directory")
+        rowid = conn.execute(
+            f"INSERT INTO rechnungen ({cols}) VALUES ({', '.join('?' * len(row))}) "
+            f"ON CONFLICT (output_directory) DO UPDATE SET {updates} RETURNING id",
+            tuple(row.values()),
+        ).fetchone()[0]
+        conn.execute("DELETE FROM rechnungen_fts WHERE rowid = ?", (rowid,))
+        conn.execute(
+            "INSERT INTO rechnungen_fts (rowid, verkaeufer, kaeufer, beschreibungen, raw_text) VALUES (?, ?, ?, ?, ?)",
+            (rowid, row["verkaeufer"], row["kaeufer"], beschreibungen, (raw_text or "")[:MAX_RAW_TEXT]),
+        )
+        if quell_hash:
+            conn.execute(
+                "INSERT OR REPLACE INTO quellen (sha256, output_directory) VALUES (?, ?)",
+                (quell_hash, row["output_directory"]),
+            )
+    return rowid
+
+
+def remember_source(quell_hash: str, output_directory: str, db_path: Optional[Path] = None) -> None:
+    """Map another source file (e.g. the scan of an e-mailed invoice) to an existing result."""
+    conn = _connect(db_path)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO quellen (sha256, output_directory) VALUES (?, ?)", (quell_hash, str(output_directory)))
+
+
+def _existing(output_directory: Optional[str]) -> Optional[str]:
+    # Entries whose directory was deleted by hand do not count as duplicates
+    if output_directory and (Path(output_directory) / "canonical.json").exists():
+        return output_directory
+    return None
+
+
+def find_by_hash(quell_hash: str, db_path: Optional[Path] = None) -> Optional[str]:
+    """Output directory of an earlier run on a byte-identical source file."""
+    row = _connect(db_path).execute("SELECT output_directory FROM quellen WHERE sha256 = ?", (quell_hash,)).fetchone()
+    return _existing(row[0] if row else None)
+
+
+def find_by_key(key: str, db_path: Optional[Path] = None) -> Optional[str]:
+    """Output directory of an already processed invoice with the same :func:`semantic_key`."""
+    rows = _connect(db_path).execute(
+        "SELECT output_directory FROM rechnungen WHERE schluessel = ? ORDER BY id", (key,)
+    ).fetchall()
+    return next((d for d in (_existing(r[0]) for r in rows) if d), None)
+
+
+def get_entry(output_directory: str, db_path: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    row = _connect(db_path).execute(
+        f"SELECT {', '.join(_SPALTEN)} FROM rechnungen WHERE output_directory = ?", (str(output_directory),)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def remove_rechnung(output_directory: str, db_path: Optional[Path] = None) -> None:
+    conn = _connect(db_path)
+    with conn:
+        found = conn.execute("SELECT id FROM rechnungen WHERE output_directory = ?", (str(output_directory),)).fetchone()
+        if found:
+            conn.execute("DELETE FROM rechnungen_fts WHERE rowid = ?", (found[0],))
+            conn.execute("DELETE FROM rechnungen WHERE id = ?", (found[0],))
+        conn.execute("DELETE FROM quellen WHERE output_directory = ?", (str(output_directory),))
+
+
+def _fts_query(q: str) -> Optional[str]:
+    """User input → FTS5 query: every word must match as prefix, syntax characters are ignored."""
+    words = re.findall(r"\w+", q)
+    return " ".join(f'"{w}"*' for w in words) or None
+
+
+def list_rechnungen(
+    q: Optional[str] = None,
+    von: Optional[date] = None,
+    bis: Optional[date] = None,
+    lieferant: Optional[str] = None,
+    min_betrag: Optional[float] = None,
+    max_betrag: Optional[float] = None,
+    limit: int = 50,
+    offset: int = 0,
+    db_path: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """Filtered page of index entries, newest invoice date first.
+
+    ``q`` is a full-text search over names, line descriptions and raw text;
+    ``lieferant`` matches the supplier name case-insensitively (full Unicode
+    case folding) as substring.
+    """
+    where: List[str] = []
+    params: List[Any] = []
+    fts = _fts_query(q) if q else None
+    if fts:
+        where.append("r.id IN (SELECT rowid FROM rechnungen_fts WHERE rechnungen_fts MATCH ?)")
+        params.append(fts)
+    if von:
+        where.append("r.rechnungsdatum >= ?")
+        params.append(von.isoformat())
+    if bis:
+        where.append("r.rechnungsdatum <= ?")
+        params.append(bis.isoformat())
+    if lieferant:
+        where.append("instr(r.verkaeufer_suche, ?) > 0")
+        params.append(_suchform(lieferant))
+    if min_betrag is not None:
+        where.append("r.gesamt_brutto >= ?")
+        params.append(min_betrag)
+    if max_betrag is not None:
+        where.append("r.gesamt_brutto <= ?")
+        params.append(max_betrag)
+    clause = f"WHERE {' AND '.join(where)}" if where else ""
+
+    conn = _connect(db_path)
+    gesamt = conn.execute(f"SELECT COUNT(*) FROM rechnungen r {clause}", params).fetchone()[0]
+    rows = conn.execute(
+        f"SELECT {', '.join('r.' + c for c in _SPALTEN)} FROM rechnungen r {clause} "
+        "ORDER BY r.rechnungsdatum DESC, r.id DESC LIMIT ? OFFSET ?",
+        [*params, limit, offset],
+    ).fetchall()
+    return {"gesamt": gesamt, "limit": limit, "offset": offset, "eintraege": [dict(r) for r in rows]}
+
+
+def _iter_output_dirs(output_root: Path) -> Iterator[Path]:
+    for canonical in sorted(Path(output_root).rglob("canonical.json")):
+        if "_working" not in canonical.parts:
+            yield canonical.parent
+
+
+def _quell_hashes(out_dir: Path, db_path: Optional[Path]) -> List[str]:
+    # Recorded in the export manifest since it exists; older directories only via their index entry
+    try:
+        manifest = json.loads((out_dir / ".export.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = {}
+    rows = _connect(db_path).execute(
+        "SELECT sha256 FROM quellen WHERE output_directory = ?", (str(out_dir.resolve()),)
+    ).fetchall()
+    return list(dict.fromkeys([h for h in [manifest.get("quell_hash")] if h] + [r[0] for r in rows]))
+
+
+def _raw_text(output_root: Path, quell_hashes: List[str]) -> Optional[str]:
+    """Raw text kept in the checkpoint of the run that produced the invoice, if any."""
+    for quell_hash in quell_hashes:
+        path = behaltene_datei(Path(output_root) / "_working", quell_hash, "raw_text")
+        if path is not None:
+            return path.read_text(encoding="utf-8", errors="replace")
+    return None
+
+
+def reindex(output_root: Path, db_path: Optional[Path] = None) -> int:
+    """Index every ``canonical.json`` below ``output_root`` and drop entries whose directory is gone."""
+    count = 0
+    for out_dir in _iter_output_dirs(output_root):
+        try:
+            rechnung = Rechnung.model_validate(json.loads((out_dir / "canonical.json").read_text(encoding="utf-8")))
+        except Exception as e:
+            logger.warning(f"Überspringe {out_dir}: {e}")
+            continue
+        hashes = _quell_hashes(out_dir, db_path)
+        index_rechnung(
+            rechnung,
+            str(out_dir.resolve()),
+            raw_text=_raw_text(output_root, hashes),
+            quell_hash=hashes[0] if hashes else None,
+            db_path=db_path,
+        )
+        count += 1
+
+    conn = _connect(db_path)
+    for row in conn.execute("SELECT output_directory FROM rechnungen").fetchall():
+        if not (Path(row[0]) / "canonical.json").exists():
+            remove_rechnung(row[0], db_path=db_path)
+    return count
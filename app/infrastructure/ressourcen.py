@@ -0,0 +1,555 @@
+"""Admission control and per-stage concurrency limits.
+
+Every invoice job takes a ticket from :func:`zulassen`; when ``max_auftraege``
+jobs are already running or waiting, it raises :class:`Ueberlastet` (HTTP 429
+with ``Retry-After``) instead of queueing without bound. Inside a job the
+memory-hungry stages (OCR, LLM, render, Ghostscript) each take a slot with
+``with stufe("llm"): ...``, so excess work waits in line instead of swapping.
+
+Limits come from ``stufen_limits`` in the settings; unset stages are sized
+from the CPU count and, for the LLM, from available memory and model size.
+They are read once per process (first use or :func:`configure`).
+
+Every ticket has a priority class (``interaktiv`` for uploads, ``batch`` for
+hot folders, ``reexport``) and a tenant (e.g. the hot folder it came from).
+Free stage slots go to the waiting work by weighted fair queuing, first across
+classes (``prioritaet_gewichte``), then across the tenants of a class, FIFO
+within a tenant. Since every stage queues anew, a batch job yields to
+interactive work at each stage boundary. ``interaktiv_reserve`` tickets are
+kept free for uploads, so a full batch never makes them wait for 429s.
+
+Deadlines: a job may run ``auftrag_timeout_sekunden``, each stage slot is held
+at most ``stufen_timeouts[stufe]``. A ticket can also be cancelled
+(:func:`abbrechen`, e.g. when the client disconnects). Work inside a stage
+checks with :func:`pruefen`, waits at most :func:`restzeit` and starts
+external programs through :func:`prozess`, which kills the whole process
+group. A cancelled or expired job raises :class:`Abgebrochen`; a stage that
+runs out of time raises :class:`StufenTimeout`, which callers with a fallback
+(OCR → embedded text, Ghostscript → pikepdf output) catch to continue with a
+partial result.
+"""
+import math
+import os
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from app.infrastructure.engines import optional_import
+from app.infrastructure.storage import load_settings
+
+STUFEN = ("ocr", "llm", "render", "ghostscript")
+KLASSEN = ("interaktiv", "batch", "reexport")
+# Share of contended stage slots: with all three waiting, 8 of 11 go to uploads
+DEFAULT_GEWICHTE = {"interaktiv": 8, "batch": 2, "reexport": 1}
+# Work outside any ticket (CLI commands)
+DEFAULT_KLASSE = "batch"
+# Latencies kept per class for the percentiles in status()
+LATENZ_FENSTER = 1000
+# Working memory of a llama server beyond the (memory-mapped) model file: KV cache, buffers
+LLM_ZUSATZ_BYTES = 1 << 30
+# Assumed job duration for Retry-After until the first job has finished
+DEFAULT_DAUER_S = 30.0
+# Longest a stage slot may be held; the LLM includes starting its server
+DEFAULT_TIMEOUTS = {"ocr": 300.0, "llm": 900.0, "render": 120.0, "ghostscript": 120.0}
+DEFAULT_AUFTRAG_TIMEOUT_S = 1800.0
+# How often blocking waits look for a cancellation
+PRUEF_INTERVALL_S = 0.5
+
+
+class Ueberlastet(Exception):
+    """Raised when the job queue is full; ``retry_after`` is in seconds."""
+
+    def __init__(self, retry_after: int, auftraege: int):
+        super().__init__(f"Warteschlange voll ({auftraege} Aufträge), bitte in {retry_after} s erneut versuchen")
+        self.retry_after = retry_after
+
+
+class Unterbrochen(Exception):
+    """A job or stage stopped before finishing; ``teilergebnis`` holds what was done so far."""
+
+    zeitlimit = False
+
+    def __init__(self, grund: str, stufe: Optional[str] = None):
+        super().__init__(f"{grund} (Stufe {stufe})" if stufe else grund)
+        self.grund = grund
+        self.stufe = stufe
+        self.teilergebnis: Dict[str, Any] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"fehler": str(self), "grund": self.grund, "stufe": self.stufe, "teilergebnis": self.teilergebnis}
+
+
+class Abgebrochen(Unterbrochen):
+    """The job was cancelled or exceeded ``auftrag_timeout_sekunden``; nothing may continue."""
+
+
+class StufenTimeout(Unterbrochen):
+    """One stage exceeded its entry in ``stufen_timeouts``; the job may go on without it."""
+
+    zeitlimit = True
+
+
+def verfuegbarer_speicher() -> Optional[int]:
+    """Available RAM in bytes, ``None`` if it cannot be determined."""
+    psutil = optional_import("psutil")
+    if psutil is not None:
+        return int(psutil.virtual_memory().available)
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _llm_limit(settings: Dict[str, Any]) -> int:
+    # As many llama servers as fit next to each other in the memory available now
+    sizes = []
+    for key in ("llm_model_path", "llm_small_model_path"):
+        path = Path(settings.get(key) or "")
+        if settings.get(key) and path.is_file():
+            sizes.append(path.stat().st_size)
+    speicher = verfuegbarer_speicher()
+    if not sizes or speicher is None:
+        return 1
+    return max(1, speicher // (max(sizes) + LLM_ZUSATZ_BYTES))
+
+
+def default_limits(settings: Dict[str, Any]) -> Dict[str, int]:
+    cpus = os.cpu_count() or 1
+    return {
+        "ocr": max(1, cpus // 2),
+        "llm": _llm_limit(settings),
+        "render": max(1, cpus // 2),
+        "ghostscript": max(1, cpus // 2),
+    }
+
+
+class _Stufe:
+    """Slots of one stage, handed out by weighted fair queuing. Guarded by ``_lock``."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.aktiv = 0
+        # klasse -> mandant -> waiting threads, FIFO
+        self.warteschlangen: Dict[str, Dict[str, Deque[threading.Event]]] = {}
+        # Start-time fair queuing: every class (and tenant within its class) carries a virtual
+        # time that advances by 1/weight per slot; the smallest finish time is served next
+        self.virtuell = 0.0
+        self.virtuell_klasse: Dict[str, float] = {}
+        self.pass_klasse: Dict[str, float] = {}
+        self.pass_mandant: Dict[Tuple[str, str], float] = {}
+
+    @property
+    def wartend(self) -> int:
+        return sum(len(q) for mandanten in self.warteschlangen.values() for q in mandanten.values())
+
+    def wartend_je_klasse(self) -> Dict[str, int]:
+        return {k: sum(len(q) for q in m.values()) for k, m in self.warteschlangen.items() if m}
+
+    def _aufholen(self, klasse: str, mandant: str) -> None:
+        # A class or tenant that was idle rejoins at the current virtual time, without saved-up credit
+        mandanten = self.warteschlangen.get(klasse)
+        if not mandanten:
+            self.pass_klasse[klasse] = max(self.pass_klasse.get(klasse, 0.0), self.virtuell)
+        if not mandanten or mandant not in mandanten:
+            key = (klasse, mandant)
+            self.pass_mandant[key] = max(self.pass_mandant.get(key, 0.0), self.virtuell_klasse.get(klasse, 0.0))
+
+    def _belasten(self, klasse: str, mandant: str) -> None:
+        key = (klasse, mandant)
+        self.virtuell = self.pass_klasse[klasse]
+        self.virtuell_klasse[klasse] = self.pass_mandant[key]
+        self.pass_klasse[klasse] += 1.0 / _gewicht(klasse)
+        self.pass_mandant[key] += 1.0
+        self.aktiv += 1
+
+    def anfordern(self, klasse: str, mandant: str) -> Optional[threading.Event]:
+        """Take a slot now (``None``) or queue up; the returned event is set once granted."""
+        self._aufholen(klasse, mandant)
+        if self.aktiv < self.limit and not self.wartend:
+            self._belasten(klasse, mandant)
+            return None
+        event = threading.Event()
+        self.warteschlangen.setdefault(klasse, {}).setdefault(mandant, deque()).append(event)
+        return event
+
+    def zurueckziehen(self, klasse: str, mandant: str, event: threading.Event) -> bool:
+        """Leave the queue; ``False`` if the slot was granted meanwhile (then release it)."""
+        queue = self.warteschlangen.get(klasse, {}).get(mandant)
+        if event.is_set() or queue is None or event not in queue:
+            return False
+        queue.remove(event)
+        if not queue:
+            del self.warteschlangen[klasse][mandant]
+        return True
+
+    def freigeben(self) -> None:
+        self.aktiv -= 1
+        while self.aktiv < self.limit and self.wartend:
+            klasse = min(
+                (k for k, m in self.warteschlangen.items() if m),
+                key=lambda k: (self.pass_klasse[k] + 1.0 / _gewicht(k), -_gewicht(k)),
+            )
+            mandanten = self.warteschlangen[klasse]
+            mandant = min(mandanten, key=lambda m: self.pass_mandant[(klasse, m)])
+            event = mandanten[mandant].popleft()
+            if not mandanten[mandant]:
+                del mandanten[mandant]
+            self._belasten(klasse, mandant)
+            event.set()
+
+
+_lock = threading.Lock()
+_stufen: Dict[str, _Stufe] = {}
+_max_auftraege = 0
+_reserve = 0
+_gewichte: Dict[str, int] = dict(DEFAULT_GEWICHTE)
+_auftraege = 0
+_auftraege_klasse: Dict[str, int] = {}
+_dauer_s = DEFAULT_DAUER_S
+_latenzen: Dict[str, Deque[float]] = {}
+_abgelehnt: Dict[str, int] = {}
+_timeouts: Dict[str, float] = dict(DEFAULT_TIMEOUTS)
+_auftrag_timeout_s = DEFAULT_AUFTRAG_TIMEOUT_S
+_laufend: Dict[str, "Auftrag"] = {}
+_aktuell: ContextVar[Optional["Auftrag"]] = ContextVar("auftrag", default=None)
+# (stage name, deadline) of the stage slot the calling code holds
+_stufe_frist: ContextVar[Optional[Tuple[str, float]]] = ContextVar("stufe_frist", default=None)
+
+
+def _gewicht(klasse: str) -> int:
+    return max(1, int(_gewichte.get(klasse, 1)))
+
+
+def configure(settings: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """(Re)create the limits from ``settings``; call before work starts, e.g. at server start."""
+    global _max_auftraege, _reserve, _gewichte, _timeouts, _auftrag_timeout_s
+    settings = settings if settings is not None else load_settings()
+    limits = {**default_limits(settings), **(settings.get("stufen_limits") or {})}
+    with _lock:
+        _stufen.clear()
+        for name in STUFEN:
+            _stufen[name] = _Stufe(max(1, int(limits[name])))
+        _max_auftraege = max(1, int(settings.get("max_auftraege") or 1))
+        _reserve = min(_max_auftraege - 1, max(0, int(settings.get("interaktiv_reserve") or 0)))
+        _gewichte = {**DEFAULT_GEWICHTE, **(settings.get("prioritaet_gewichte") or {})}
+        _timeouts = {**DEFAULT_TIMEOUTS, **(settings.get("stufen_timeouts") or {})}
+        _auftrag_timeout_s = float(settings.get("auftrag_timeout_sekunden", DEFAULT_AUFTRAG_TIMEOUT_S) or 0)
+    logger.info(
+        f"Ressourcenlimits: {limits}, max. {_max_auftraege} Aufträge ({_reserve} für Uploads reserviert), "
+        f"Gewichte {_gewichte}"
+    )
+    return limits
+
+
+def _ensure_configured() -> None:
+    if not _stufen:
+        configure()
+
+
+@contextmanager
+def stufe(name: str) -> Iterator[None]:
+    """Hold one slot of stage ``name`` for the duration of the block, waiting if none is free.
+
+    Waiting work is served by the class and tenant of the current ticket. A
+    cancelled ticket stops waiting; inside the block the stage deadline applies.
+    """
+    _ensure_configured()
+    s = _stufen[name]
+    auftrag = _aktuell.get()
+    klasse, mandant = (auftrag.klasse, auftrag.mandant) if auftrag is not None else (DEFAULT_KLASSE, "")
+    pruefen()
+    with _lock:
+        event = s.anfordern(klasse, mandant)
+    if event is not None:
+        try:
+            while not event.wait(PRUEF_INTERVALL_S):
+                pruefen()
+        except BaseException:
+            with _lock:
+                if not s.zurueckziehen(klasse, mandant, event):
+                    s.freigeben()
+            raise
+    timeout = _timeouts.get(name) or 0
+    token = _stufe_frist.set((name, time.monotonic() + timeout) if timeout > 0 else None)
+    try:
+        yield
+    finally:
+        _stufe_frist.reset(token)
+        with _lock:
+            s.freigeben()
+
+
+class Auftrag:
+    """Admission ticket for one job, taken by :func:`zulassen`.
+
+    ``with`` around the work measures it, starts its deadline, makes it the
+    current ticket of the stage slots taken inside and releases it; a ticket
+    that is never entered must be released with :meth:`freigeben`.
+    """
+
+    def __init__(self, klasse: str = "interaktiv", mandant: str = "", auftrag_id: Optional[str] = None) -> None:
+        self.id = auftrag_id or uuid.uuid4().hex
+        self.klasse = klasse
+        self.mandant = mandant
+        self.grund: Optional[str] = None
+        self.frist: Optional[float] = None
+        self._erstellt = time.monotonic()
+        self._start: Optional[float] = None
+        self._frei = False
+        self._token: Any = None
+        self._abbruch = threading.Event()
+        self._rueckrufe: List[Callable[[], None]] = []
+
+    @property
+    def abgebrochen(self) -> bool:
+        return self._abbruch.is_set()
+
+    def abbrechen(self, grund: str = "Abgebrochen") -> None:
+        """Cancel the job: waiting stages give up, running programs and LLM requests are stopped."""
+        with _lock:
+            if self._abbruch.is_set():
+                return
+            self.grund = grund
+            self._abbruch.set()
+            rueckrufe = list(self._rueckrufe)
+        logger.warning(f"Auftrag {self.id} abgebrochen: {grund}")
+        for rueckruf in rueckrufe:
+            try:
+                rueckruf()
+            except Exception as e:
+                logger.debug(f"Abbruch-Rückruf fehlgeschlagen: {e}")
+
+    def freigeben(self) -> None:
+        global _auftraege, _dauer_s
+        with _lock:
+            if self._frei:
+                return
+            self._frei = True
+            _auftraege -= 1
+            _auftraege_klasse[self.klasse] -= 1
+            _laufend.pop(self.id, None)
+            if self._start is not None:
+                ende = time.monotonic()
+                # Moving average of the job duration, the basis for Retry-After
+                _dauer_s = 0.8 * _dauer_s + 0.2 * (ende - self._start)
+                # Latency as the submitter sees it: from admission to the result
+                _latenzen.setdefault(self.klasse, deque(maxlen=LATENZ_FENSTER)).append(ende - self._erstellt)
+
+    def __enter__(self) -> "Auftrag":
+        self._start = time.monotonic()
+        if _auftrag_timeout_s > 0:
+            self.frist = self._start + _auftrag_timeout_s
+        self._token = _aktuell.set(self)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        _aktuell.reset(self._token)
+        self.freigeben()
+
+
+def aktuelle_klasse() -> str:
+    """Priority class of the ticket the calling code runs under."""
+    auftrag = _aktuell.get()
+    return auftrag.klasse if auftrag is not None else DEFAULT_KLASSE
+
+
+def aktueller_auftrag() -> Optional[Auftrag]:
+    return _aktuell.get()
+
+
+def zulassen(klasse: str = "interaktiv", mandant: str = "", auftrag_id: Optional[str] = None) -> Auftrag:
+    """Admit one job or raise :class:`Ueberlastet` when ``max_auftraege`` are in the system.
+
+    Other classes than ``interaktiv`` leave ``interaktiv_reserve`` tickets free.
+    ``auftrag_id`` (default: random) is the id :func:`abbrechen` takes.
+    """
+    global _auftraege
+    if klasse not in KLASSEN:
+        raise ValueError(f"Unbekannte Prioritätsklasse: {klasse}")
+    _ensure_configured()
+    auftrag = Auftrag(klasse, mandant, auftrag_id)
+    with _lock:
+        if auftrag.id in _laufend:
+            raise ValueError(f"Auftrag {auftrag.id} läuft bereits")
+        grenze = _max_auftraege if klasse == "interaktiv" else _max_auftraege - _reserve
+        if _auftraege >= grenze:
+            _abgelehnt[klasse] = _abgelehnt.get(klasse, 0) + 1
+            # A slot frees up when the next running job finishes
+            parallel = max(1, min(_stufen["llm"].limit, _max_auftraege))
+            raise Ueberlastet(max(1, math.ceil(_dauer_s / parallel)), _auftraege)
+        _auftraege += 1
+        _auftraege_klasse[klasse] = _auftraege_klasse.get(klasse, 0) + 1
+        _laufend[auftrag.id] = auftrag
+    return auftrag
+
+
+def abbrechen(auftrag_id: str, grund: str = "Abgebrochen") -> bool:
+    """Cancel the admitted job ``auftrag_id``; ``False`` if there is none."""
+    with _lock:
+        auftrag = _laufend.get(auftrag_id)
+    if auftrag is None:
+        return False
+    auftrag.abbrechen(grund)
+    return True
+
+
+# --- deadlines and cancellation -----------------------------------------------------
+
+
+def restzeit() -> Optional[float]:
+    """Seconds left for the current stage and job, ``None`` without any deadline."""
+    jetzt = time.monotonic()
+    fristen = []
+    auftrag = _aktuell.get()
+    if auftrag is not None and auftrag.frist is not None:
+        fristen.append(auftrag.frist)
+    stufe_frist = _stufe_frist.get()
+    if stufe_frist is not None:
+        fristen.append(stufe_frist[1])
+    return max(0.0, min(fristen) - jetzt) if fristen else None
+
+
+def pruefen() -> None:
+    """Raise :class:`Abgebrochen` or :class:`StufenTimeout` if the current work has to stop."""
+    auftrag = _aktuell.get()
+    stufe_frist = _stufe_frist.get()
+    name = stufe_frist[0] if stufe_frist else None
+    jetzt = time.monotonic()
+    if auftrag is not None:
+        if auftrag.abgebrochen:
+            raise Abgebrochen(auftrag.grund or "Abgebrochen", name)
+        if auftrag.frist is not None and jetzt >= auftrag.frist:
+            e = Abgebrochen(f"Zeitlimit des Auftrags ({_auftrag_timeout_s:.0f} s) überschritten", name)
+            e.zeitlimit = True
+            raise e
+    if stufe_frist is not None and jetzt >= stufe_frist[1]:
+        raise StufenTimeout(f"Zeitlimit ({_timeouts[name]:.0f} s) überschritten", name)
+
+
+@contextmanager
+def bei_abbruch(rueckruf: Callable[[], None]) -> Iterator[None]:
+    """Call ``rueckruf`` (e.g. closing a connection) if the current job is cancelled inside the block."""
+    auftrag = _aktuell.get()
+    if auftrag is None:
+        yield
+        return
+    with _lock:
+        auftrag._rueckrufe.append(rueckruf)
+        schon = auftrag.abgebrochen
+    if schon:
+        rueckruf()
+    try:
+        yield
+    finally:
+        with _lock:
+            auftrag._rueckrufe.remove(rueckruf)
+
+
+def _beenden(proc: subprocess.Popen) -> None:
+    # The whole group: OCRmyPDF runs Tesseract and Ghostscript as children
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        try:
+            proc.wait(timeout=5)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def prozess(cmd: Sequence[str], input: Optional[bytes] = None) -> subprocess.CompletedProcess:
+    """Run ``cmd`` capturing stdout/stderr, like ``subprocess.run``, within the current deadlines.
+
+    On cancellation or timeout the process group is killed and
+    :class:`Abgebrochen` / :class:`StufenTimeout` raised.
+    """
+    proc = subprocess.Popen(
+        list(cmd),
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    ausgabe: List[Any] = []
+    # communicate() in a helper thread: retrying it after a timeout loses the rest of the input
+    leser = threading.Thread(target=lambda: ausgabe.extend(proc.communicate(input)), daemon=True)
+    leser.start()
+    try:
+        while leser.is_alive():
+            rest = restzeit()
+            leser.join(PRUEF_INTERVALL_S if rest is None else max(0.01, min(PRUEF_INTERVALL_S, rest)))
+            if leser.is_alive():
+                pruefen()
+    except BaseException:
+        _beenden(proc)
+        leser.join()
+        raise
+    stdout, stderr = ausgabe
+    return subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr)
+
+
+def _perzentil(werte: List[float], p: float) -> float:
+    return werte[max(0, math.ceil(p * len(werte)) - 1)]
+
+
+def latenzen() -> Dict[str, Dict[str, Any]]:
+    """Per class: number of recent jobs, p50/p95/max latency in seconds, rejected admissions."""
+    with _lock:
+        daten = {k: sorted(_latenzen.get(k, ())) for k in KLASSEN}
+        abgelehnt = dict(_abgelehnt)
+    return {
+        klasse: {
+            "anzahl": len(werte),
+            "p50_s": round(_perzentil(werte, 0.5), 2) if werte else None,
+            "p95_s": round(_perzentil(werte, 0.95), 2) if werte else None,
+            "max_s": round(werte[-1], 2) if werte else None,
+            "abgelehnt": abgelehnt.get(klasse, 0),
+        }
+        for klasse, werte in daten.items()
+    }
+
+
+def status() -> Dict[str, Any]:
+    """Queue depth: admitted jobs, per stage active and waiting work, latency per class."""
+    _ensure_configured()
+    with _lock:
+        result = {
+            "auftraege": {
+                "belegt": _auftraege,
+                "max": _max_auftraege,
+                "reserviert_interaktiv": _reserve,
+                "je_klasse": {k: _auftraege_klasse.get(k, 0) for k in KLASSEN},
+                "mittlere_dauer_s": round(_dauer_s, 1),
+            },
+            "laufend": [
+                {
+                    "id": a.id,
+                    "klasse": a.klasse,
+                    "mandant": a.mandant,
+                    "sekunden": round(time.monotonic() - a._erstellt, 1),
+                    "abgebrochen": a.abgebrochen,
+                }
+                for a in _laufend.values()
+            ],
+            "stufen": {
+                name: {"limit": s.limit, "aktiv": s.aktiv, "wartend": s.wartend, "wartend_je_klasse": s.wartend_je_klasse()}
+                for name, s in _stufen.items()
+            },
+        }
+    result["latenz"] = latenzen()
+    return result
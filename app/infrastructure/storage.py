@@ -1,64 +1,211 @@
 from pathlib import Path
+import copy
 import json
-from typing import Dict, Any
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from loguru import logger
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 DATA_DIR = BASE_DIR / "data"
 SETTINGS_PATH = DATA_DIR / "einstellungen.json"
 FIRMENDATEN_PATH = DATA_DIR / "firmendaten.json"
 
-DEFAULT_SETTINGS: Dict[str, Any] = {
-    "output_directory": str((BASE_DIR / "output").resolve()),
-    "llm_model_path": str((BASE_DIR / "models" / "Qwen2.5-VL-7B-Instruct-Q5_K_M.gguf").resolve()),
-    "clip_model_path": str((BASE_DIR / "models" / "mmproj-F32.gguf").resolve()),
-    "logo_path": "",
-}
-
-DEFAULT_FIRMENDATEN: Dict[str, Any] = {
-    "name": "",
-    "umsatzsteuer_id": "",
-    "steuernummer": "",
-    "anschrift": {
-        "strasse": "",
-        "plz": "",
-        "ort": "",
-        "land": "DE",
-    },
-    "zahlung": {
-        "zahlungsart": "SEPA",
-        "iban": "",
-        "bic": "",
-    },
-}
+
+class Einstellungen(BaseModel):
+    """Application settings (``data/einstellungen.json``); unknown keys are kept."""
+
+    model_config = ConfigDict(extra="allow")
+
+    output_directory: str = str((BASE_DIR / "output").resolve())
+    llm_model_path: str = str((BASE_DIR / "models" / "Qwen2.5-VL-7B-Instruct-Q5_K_M.gguf").resolve())
+    clip_model_path: str = str((BASE_DIR / "models" / "mmproj-F32.gguf").resolve())
+    # Optional small model (e.g. Qwen2.5 1.5B) tried first; the large model only runs
+    # when its result is incomplete or below llm_kaskade_schwelle
+    llm_small_model_path: str = ""
+    llm_kaskade_schwelle: float = Field(0.85, ge=0, le=1)
+    logo_path: str = ""
+    xml_pretty_print: bool = False
+    # Warm WeasyPrint worker processes (at most one per CPU), so the PDF renders beside the
+    # XML serializers instead of competing with them for the GIL; 0 renders in-process
+    pdf_render_workers: int = Field(2, ge=0)
+    # Outputs written per invoice; a subset skips the stages only the others need
+    export_outputs: List[str] = ["canonical_json", "xrechnung_xml", "zugferd_xml", "zugferd_pdf"]
+    # MINIMUM, BASIC WL, BASIC, EN16931, EXTENDED or XRECHNUNG
+    zugferd_profil: str = "EN16931"
+    # Engines preloaded at server start (renderer, validator, ocr, llm, llm_small);
+    # /health/ready reports 200 once all of them are warm
+    vorwaermen: List[str] = []
+    # Jobs admitted at once (running + waiting); further uploads get 429 with Retry-After
+    max_auftraege: int = Field(8, ge=1)
+    # Concurrent work per stage (ocr, llm, render, ghostscript); unset stages are sized
+    # from the CPU count and, for llm, from free memory and model size
+    stufen_limits: Dict[str, int] = {}
+    # Share of contended stage slots per priority class (interaktiv, batch, reexport)
+    prioritaet_gewichte: Dict[str, int] = {"interaktiv": 8, "batch": 2, "reexport": 1}
+    # Admission tickets only uploads may take, so hot folders and re-exports never fill the queue
+    interaktiv_reserve: int = Field(2, ge=0)
+    # Longest a job may run (0: no limit); it is cancelled and reports its finished stages
+    auftrag_timeout_sekunden: float = Field(1800, ge=0)
+    # Longest a stage may run (ocr, llm, render, ghostscript); OCR and Ghostscript fall back
+    # to the embedded text / pikepdf output, defaults: ocr 300, llm 900, render 120, ghostscript 120
+    stufen_timeouts: Dict[str, float] = {}
+    # Hot folders: new files are processed automatically and moved to erledigt/ or fehlgeschlagen/
+    hotfolder_verzeichnisse: List[str] = []
+    # Maildirs whose PDF/XML attachments are processed; mails move to .erledigt / .fehlgeschlagen
+    hotfolder_maildirs: List[str] = []
+    hotfolder_workers: int = Field(2, ge=1)
+    # A file is picked up once it has not changed for this long (scanner or copy still writing)
+    hotfolder_stabil_sekunden: float = Field(2.0, ge=0)
+    # Scan at an interval instead of inotify, e.g. for SMB/NFS shares without change events
+    hotfolder_polling: bool = False
+    # The API only queues uploads; `python -m app.cli worker` processes extract them
+    worker_modus: bool = False
+    # Job queue shared with the workers: empty (data/queue.sqlite), sqlite:///<path> or redis://host:6379/0
+    queue_url: str = ""
+    # A job whose worker sent no heartbeat for this long goes back to the queue
+    job_lease_sekunden: float = Field(120, gt=0)
+    job_max_versuche: int = Field(3, ge=1)
+
+
+class FirmenAnschrift(BaseModel):
+    strasse: str = ""
+    plz: str = ""
+    ort: str = ""
+    land: str = "DE"
+
+
+class FirmenZahlung(BaseModel):
+    zahlungsart: str = "SEPA"
+    iban: str = ""
+    bic: str = ""
+
+
+class Firmendaten(BaseModel):
+    """Own company data (``data/firmendaten.json``)."""
+
+    name: str = ""
+    umsatzsteuer_id: str = ""
+    steuernummer: str = ""
+    anschrift: FirmenAnschrift = Field(default_factory=FirmenAnschrift)
+    zahlung: FirmenZahlung = Field(default_factory=FirmenZahlung)
+
+
+DEFAULT_SETTINGS: Dict[str, Any] = Einstellungen().model_dump()
+DEFAULT_FIRMENDATEN: Dict[str, Any] = Firmendaten().model_dump()
 
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def _load_json(path: Path, default: Dict[str, Any]) -> Dict[str, Any]:
-    if not path.exists():
-        path.write_text(json.dumps(default, ensure_ascii=False, indent=2), encoding="utf-8")
-        return default
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write ``data`` to a temporary file next to ``path`` and rename it into place,
+    so readers never see a half-written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except Exception:
-        return default
-
-
-def _save_json(path: Path, data: Dict[str, Any]) -> None:
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class JsonStore:
+    """A validated JSON document on disk, cached in memory.
+
+    Reads only ``stat`` the file and re-parse it when mtime or size changed
+    (e.g. edited by hand or written by another process). Writes are validated,
+    go through :func:`write_atomic` under a lock and refresh the cache, so
+    concurrent requests never see a half-written file.
+    """
+
+    def __init__(self, path: Path, model: Type[BaseModel]):
+        self.path = path
+        self.model = model
+        self._lock = threading.RLock()
+        self._cache: Optional[Dict[str, Any]] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+
+    def _current_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            return self.model.model_validate_json(self.path.read_bytes()).model_dump()
+        except (ValueError, ValidationError) as e:
+            if self._cache is not None:
+                logger.error(f"{self.path.name} ist ungültig, behalte geladene Werte: {e}")
+                return self._cache
+            backup = self.path.with_name(f"{self.path.stem}.defekt-{int(time.time())}{self.path.suffix}")
+            logger.error(f"{self.path.name} ist ungültig, verwende Standardwerte (Sicherung: {backup.name}): {e}")
+            os.replace(self.path, backup)
+            return self._write(self.model().model_dump())
+
+    def _write(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        write_atomic(self.path, json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"))
+        self._cache, self._stamp = data, self._current_stamp()
+        return data
+
+    def load(self) -> Dict[str, Any]:
+        """Current values as a fresh dict (callers may modify it)."""
+        stamp = self._current_stamp()
+        with self._lock:
+            if self._cache is None or stamp != self._stamp:
+                if stamp is None:
+                    self._write(self.model().model_dump())
+                else:
+                    self._cache, self._stamp = self._read(), stamp
+            return copy.deepcopy(self._cache)
+
+    def save(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate and replace the whole document; raises ``ValidationError``."""
+        validated = self.model.model_validate(data).model_dump()
+        with self._lock:
+            return copy.deepcopy(self._write(validated))
+
+    def update(self, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge ``changes`` into the stored values (nested dicts one level deep) and save."""
+        with self._lock:
+            data = self.load()
+            for key, value in changes.items():
+                if isinstance(value, dict) and isinstance(data.get(key), dict):
+                    data[key] = {**data[key], **value}
+                else:
+                    data[key] = value
+            return self.save(data)
+
+
+settings_store = JsonStore(SETTINGS_PATH, Einstellungen)
+firmendaten_store = JsonStore(FIRMENDATEN_PATH, Firmendaten)
 
 
 def load_settings() -> Dict[str, Any]:
-    return _load_json(SETTINGS_PATH, DEFAULT_SETTINGS)
+    return settings_store.load()
 
 
 def save_settings(data: Dict[str, Any]) -> None:
-    _save_json(SETTINGS_PATH, data)
+    settings_store.save(data)
+
+
+def update_settings(changes: Dict[str, Any]) -> Dict[str, Any]:
+    return settings_store.update(changes)
 
 
 def load_firmendaten() -> Dict[str, Any]:
-    return _load_json(FIRMENDATEN_PATH, DEFAULT_FIRMENDATEN)
+    return firmendaten_store.load()
 
 
 def save_firmendaten(data: Dict[str, Any]) -> None:
-    _save_json(FIRMENDATEN_PATH, data)
\ No newline at end of file
+    firmendaten_store.save(data)
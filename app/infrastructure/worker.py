@@ -0,0 +1,272 @@
+"""Worker mode: the API coordinates, stateless workers extract.
+
+With ``worker_modus`` the API puts uploads into the job queue (see
+``jobqueue``) instead of processing them. Any number of
+``python -m app.cli worker`` processes, on any host that reaches the queue,
+claim jobs, run OCR and the LLM and upload the canonical invoice. The
+coordinator writes it into the output tree: it stores the result as the run's
+canonical checkpoint, so the regular pipeline only exports, de-duplicates and
+indexes. Workers need the queue and their models, nothing else.
+"""
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from loguru import logger
+
+from app.infrastructure import ressourcen
+from app.infrastructure.checkpoints import Lauf
+from app.infrastructure.jobqueue import Job, JobQueue, open_queue
+from app.infrastructure.pipeline import duplicate_of, extract_invoice, file_sha256, process_input_file
+from app.infrastructure.storage import DATA_DIR
+
+WORKER_DIR = DATA_DIR / "worker"
+# Jobs whose submitter stopped waiting are finished by the collector after this long
+VERWAIST_S = 300.0
+
+_queues: Dict[Any, JobQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def queue_for(settings: Dict[str, Any]) -> JobQueue:
+    """The queue configured in ``settings`` (``queue_url``), one instance per URL."""
+    key = (settings.get("queue_url") or "", int(settings.get("job_max_versuche") or 3))
+    with _queues_lock:
+        if key not in _queues:
+            _queues[key] = open_queue(*key)
+        return _queues[key]
+
+
+# --- coordinator --------------------------------------------------------------------
+
+
+def enqueue_file(
+    queue: JobQueue,
+    input_path: Path,
+    name: Optional[str] = None,
+    targets: Optional[Iterable[str]] = None,
+    profil: Optional[str] = None,
+    duplikate_pruefen: bool = True,
+    warten: bool = False,
+    klasse: str = ressourcen.DEFAULT_KLASSE,
+) -> str:
+    """Queue one file; a known duplicate is finished at once without bothering a worker.
+
+    ``warten`` marks jobs whose submitter waits and exports the result itself;
+    ``klasse`` is the priority class workers claim by.
+    """
+    quell_hash = file_sha256(input_path)
+    auftrag = {
+        "name": Path(name or input_path.name).name,
+        "quell_hash": quell_hash,
+        "targets": list(targets) if targets is not None else None,
+        "profil": profil,
+        "duplikate_pruefen": duplikate_pruefen,
+        "warten": warten,
+        "klasse": klasse,
+    }
+    duplikat = duplicate_of(quell_hash) if duplikate_pruefen else None
+    return queue.enqueue(auftrag, input_path.read_bytes(), ergebnis=duplikat)
+
+
+def finalize_job(queue: JobQueue, job: Job, output_root: Path, settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Export an extracted job into ``output_root``; the job ends ``fertig`` or ``fehler``.
+
+    Returns ``None`` without exporting if another thread took the job first.
+    """
+    job = queue.claim_export(job.id)
+    if job is None:
+        return None
+    auftrag, ergebnis = job.auftrag, job.ergebnis or {}
+    try:
+        lauf = Lauf(Path(output_root) / "_working", auftrag["quell_hash"])
+        # Held across the checkpoint writes and the export, which takes it again
+        with lauf.sperren(), tempfile.TemporaryDirectory(prefix="job-") as tmp:
+            if ergebnis.get("raw_text") is not None:
+                lauf.speichern("raw_text", ergebnis["raw_text"].encode("utf-8"), "raw_text.txt")
+            lauf.speichern(
+                "canonical",
+                json.dumps(ergebnis["canonical"], ensure_ascii=False, indent=2).encode("utf-8"),
+                "canonical.json",
+                llm=ergebnis.get("llm"),
+            )
+            path = Path(tmp) / auftrag["name"]
+            path.write_bytes(queue.input(job.id))
+            result = process_input_file(
+                path,
+                Path(output_root),
+                settings,
+                targets=auftrag.get("targets"),
+                profil=auftrag.get("profil"),
+                duplikate_pruefen=auftrag.get("duplikate_pruefen", True),
+            )
+    except Exception as e:
+        logger.error(f"Export von Job {job.id} fehlgeschlagen: {e}")
+        queue.fail(job.id, None, f"Export: {type(e).__name__}: {e}", retry=False)
+        return None
+    queue.finish(job.id, result)
+    return result
+
+
+def wait_for_job(
+    queue: JobQueue,
+    job_id: str,
+    output_root: Path,
+    settings: Dict[str, Any],
+    poll_s: float = 0.5,
+) -> Job:
+    """Block until the job is ``fertig`` or ``fehler``, exporting it once a worker is done.
+
+    Cancelling the current ticket (or its deadline) cancels the job as well.
+    """
+    while True:
+        try:
+            ressourcen.pruefen()
+        except ressourcen.Unterbrochen:
+            queue.cancel(job_id)
+            raise
+        job = queue.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job.status == "extrahiert" and finalize_job(queue, job, output_root, settings) is not None:
+            continue
+        if job.status in ("fertig", "fehler"):
+            return job
+        time.sleep(poll_s)
+
+
+def process_via_queue(
+    input_path: Path,
+    output_root: Path,
+    settings: Dict[str, Any],
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    targets: Optional[Iterable[str]] = None,
+    profil: Optional[str] = None,
+    duplikate_pruefen: bool = True,
+) -> Dict[str, Any]:
+    """Drop-in for ``process_input_file`` that lets a worker extract.
+
+    Field events are not available: the LLM runs on the worker. The job gets
+    the priority class of the current admission ticket.
+    """
+    queue = queue_for(settings)
+    job_id = enqueue_file(
+        queue,
+        input_path,
+        targets=targets,
+        profil=profil,
+        duplikate_pruefen=duplikate_pruefen,
+        warten=True,
+        klasse=ressourcen.aktuelle_klasse(),
+    )
+    job = wait_for_job(queue, job_id, output_root, settings)
+    if job.status == "fehler":
+        raise RuntimeError(job.fehler or "Job fehlgeschlagen")
+    return job.ergebnis or {}
+
+
+class ResultCollector:
+    """Exports extracted jobs nobody waits for (``POST /api/jobs``, crashed submitters)."""
+
+    def __init__(self, settings: Dict[str, Any], output_root: Path, poll_s: float = 1.0):
+        self.settings = settings
+        self.output_root = Path(output_root)
+        self.poll_s = poll_s
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self.run, name="job-collector", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        queue = queue_for(self.settings)
+        while not self._stop.wait(self.poll_s):
+            try:
+                for job in queue.list_jobs("extrahiert"):
+                    if not job.auftrag.get("warten") or time.time() - job.aktualisiert > VERWAIST_S:
+                        finalize_job(queue, job, self.output_root, self.settings)
+                # The exporting process died mid-export
+                for job in queue.list_jobs("exportiert"):
+                    if time.time() - job.aktualisiert > VERWAIST_S:
+                        queue.fail(job.id, None, "Export abgebrochen", retry=False)
+            except Exception as e:
+                logger.error(f"Ergebnisse abholen fehlgeschlagen: {e}")
+
+
+# --- worker -------------------------------------------------------------------------
+
+
+def _heartbeat(
+    queue: JobQueue, job_id: str, worker: str, lease_s: float, stop: threading.Event, auftrag: ressourcen.Auftrag
+) -> None:
+    while not stop.wait(lease_s / 3):
+        if not queue.heartbeat(job_id, worker, lease_s):
+            # Cancelled via the API or requeued after a stall: stop OCR / LLM right away
+            logger.warning(f"Lease für Job {job_id} verloren, Verarbeitung wird abgebrochen")
+            auftrag.abbrechen("Job abgebrochen oder Lease verloren")
+            return
+
+
+def run_job(queue: JobQueue, job: Job, worker: str, settings: Dict[str, Any], lease_s: float) -> None:
+    """Extract one claimed job and upload the result; failures go back to the queue for a retry.
+
+    Runs under its own ticket, so stage and job deadlines apply; a job that
+    timed out is not retried.
+    """
+    name = job.auftrag["name"]
+    logger.info(f"Job {job.id}: {name} (Versuch {job.versuche})")
+    stop = threading.Event()
+    klasse = job.auftrag.get("klasse")
+    auftrag = ressourcen.zulassen(klasse if klasse in ressourcen.KLASSEN else ressourcen.DEFAULT_KLASSE, auftrag_id=job.id)
+    threading.Thread(
+        target=_heartbeat, args=(queue, job.id, worker, lease_s, stop, auftrag), daemon=True
+    ).start()
+    try:
+        with auftrag, tempfile.TemporaryDirectory(prefix="job-") as tmp:
+            path = Path(tmp) / name
+            path.write_bytes(queue.input(job.id))
+            canonical, raw_text, llm_info = extract_invoice(path, WORKER_DIR / "_working", settings)
+        ergebnis = {"canonical": canonical.model_dump(mode="json"), "raw_text": raw_text, "llm": llm_info}
+        if queue.complete_extraction(job.id, worker, ergebnis):
+            logger.info(f"Job {job.id}: extrahiert ({canonical.dokument.rechnungsnummer})")
+    except ressourcen.Unterbrochen as e:
+        status = queue.fail(job.id, worker, f"{e} {e.teilergebnis}", retry=False)
+        logger.error(f"Job {job.id} unterbrochen ({status}): {e}")
+    except Exception as e:
+        status = queue.fail(job.id, worker, f"{type(e).__name__}: {e}")
+        logger.error(f"Job {job.id} fehlgeschlagen ({status}): {e}")
+    finally:
+        stop.set()
+
+
+def run_worker(
+    settings: Dict[str, Any],
+    worker: Optional[str] = None,
+    poll_s: float = 1.0,
+    stop: Optional[threading.Event] = None,
+    einmal: bool = False,
+) -> int:
+    """Claim and extract jobs until ``stop`` is set (or the queue is empty with ``einmal``)."""
+    queue = queue_for(settings)
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    lease_s = float(settings.get("job_lease_sekunden") or 120)
+    stop = stop or threading.Event()
+    count = 0
+    logger.info(f"Worker {worker} gestartet")
+    while not stop.is_set():
+        job = queue.claim(worker, lease_s)
+        if job is None:
+            if einmal:
+                break
+            stop.wait(poll_s)
+            continue
+        run_job(queue, job, worker, settings, lease_s)
+        count += 1
+    return count
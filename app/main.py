@@ -1,20 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
 import uvicorn
+import asyncio
 import shutil
 import uuid
-from typing import Optional
+import json
+import queue
+import threading
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Optional
 # load env variables
 from dotenv import load_dotenv
 load_dotenv()
 
 # Local modules
-from app.infrastructure.storage import load_settings, save_settings, load_firmendaten, save_firmendaten
+from loguru import logger
+from pydantic import ValidationError
+
+from app.infrastructure import engines, ressourcen, worker
+from app.infrastructure.storage import load_settings, update_settings, load_firmendaten, save_firmendaten
 from app.infrastructure.pipeline import process_input_file
+from app.infrastructure.rechnungsindex import list_rechnungen
+from app.services.export.outputs import resolve_targets
+from app.services.export.reexport import reexport_dir, reexport_lauf, reexport_starten
+from app.services.export.zugferd.zugferd_writer import resolve_profile
+from app.services.validation.xml_validator import fehlende_artefakte
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 UI_DIR = BASE_DIR / "app" / "ui"
@@ -22,7 +38,42 @@ UI_DIR = BASE_DIR / "app" / "ui"
 DATA_DIR = BASE_DIR / "data"
 OUTPUT_DIR = BASE_DIR / "output"
 
-app = FastAPI(title="Rechnung Konverter (Offline)")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy engines load in the background; the server accepts requests right away
+    settings = load_settings()
+    ressourcen.configure(settings)
+    engines.warm_up(settings.get("vorwaermen") or [], settings)
+    fehlend = fehlende_artefakte()
+    if fehlend:
+        # Without them every XML is only reported as unchecked (gueltig: null)
+        logger.error(f"Validierungsartefakte fehlen: {', '.join(fehlend)}; python -m app.cli artefakte-laden")
+    collector = None
+    if settings.get("worker_modus"):
+        # Exports the jobs submitted via /api/jobs once a worker has extracted them
+        collector = worker.ResultCollector(settings, OUTPUT_DIR)
+        collector.start()
+    watcher = None
+    if settings.get("hotfolder_verzeichnisse") or settings.get("hotfolder_maildirs"):
+        from app.infrastructure.hotfolder import HotfolderWatcher
+
+        watcher = HotfolderWatcher(settings, OUTPUT_DIR)
+        watcher.start()
+    yield
+    if watcher is not None:
+        watcher.stop()
+    if collector is not None:
+        collector.stop()
+    from app.services.export.pdf.renderer import shutdown_pool
+    from app.services.llm.extractor import stop_warm_servers
+
+    shutdown_pool()
+    stop_warm_servers()
+
+
+app = FastAPI(title="Rechnung Konverter (Offline)", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -45,6 +96,24 @@ app.mount("/output", StaticFiles(directory=str(OUTPUT_DIR)), name="output")
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+@app.get("/health/live")
+def health_live():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+def health_ready():
+    # 503 until every engine listed in "vorwaermen" is warm
+    status = engines.readiness()
+    return JSONResponse(status, status_code=200 if status["bereit"] else 503)
+
+
+@app.get("/api/warteschlange")
+def get_warteschlange():
+    # Queue depth: admitted jobs, active / waiting work per stage, latency per priority class
+    return ressourcen.status()
+
+
 @app.get("/api/settings")
 def get_settings():
     settings = load_settings()
@@ -52,8 +121,12 @@ def get_settings():
 
 
 @app.post("/api/settings")
-def update_settings(payload: dict):
-    save_settings(payload)
+def post_settings(payload: dict):
+    # Partial update: keys not in the payload keep their stored value
+    try:
+        update_settings(payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
     return JSONResponse({"status": "ok"})
 
 
@@ -64,12 +137,44 @@ def get_firmendaten():
 
 @app.post("/api/firmendaten")
 def update_firmendaten(payload: dict):
-    save_firmendaten(payload)
+    try:
+        save_firmendaten(payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
     return JSONResponse({"status": "ok"})
 
 
-@app.post("/api/process")
-async def process(file: UploadFile = File(...)):
+@app.get("/api/rechnungen")
+def get_rechnungen(
+    q: Optional[str] = None,
+    von: Optional[date] = None,
+    bis: Optional[date] = None,
+    lieferant: Optional[str] = None,
+    min_betrag: Optional[float] = None,
+    max_betrag: Optional[float] = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    """Paginated list of processed invoices from the index.
+
+    ``q`` searches supplier/buyer names, line descriptions and raw text;
+    the other parameters filter by invoice date, supplier and gross amount.
+    """
+    return JSONResponse(
+        list_rechnungen(
+            q=q,
+            von=von,
+            bis=bis,
+            lieferant=lieferant,
+            min_betrag=min_betrag,
+            max_betrag=max_betrag,
+            limit=limit,
+            offset=offset,
+        )
+    )
+
+
+def _persist_upload(file: UploadFile) -> Path:
     if not file.filename:
         raise HTTPException(status_code=400, detail="Datei erforderlich")
 
@@ -80,21 +185,99 @@ async def process(file: UploadFile = File(...)):
 
     with tmp_path.open("wb") as f:
         shutil.copyfileobj(file.file, f)
+    return tmp_path
+
+
+def _export_choice(ausgaben: Optional[str], profil: Optional[str]) -> dict:
+    """Parse the optional ``ausgaben`` (comma separated) and ``profil`` form fields."""
+    targets: Optional[List[str]] = None
+    if ausgaben:
+        targets = [a.strip() for a in ausgaben.split(",") if a.strip()]
+    try:
+        if targets is not None:
+            resolve_targets(targets)
+        if profil:
+            resolve_profile(profil)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"targets": targets, "profil": profil or None}
+
+
+def _zulassen(klasse: str = "interaktiv", auftrag_id: Optional[str] = None) -> ressourcen.Auftrag:
+    try:
+        return ressourcen.zulassen(klasse, auftrag_id=auftrag_id or None)
+    except ressourcen.Ueberlastet as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+def _unterbrochen(e: ressourcen.Unterbrochen) -> HTTPException:
+    # Deadline: 504; cancelled: 409. Both report the finished stages
+    return HTTPException(status_code=504 if e.zeitlimit else 409, detail=e.as_dict())
+
+
+async def _bei_trennung_abbrechen(request: Request, auftrag: ressourcen.Auftrag) -> None:
+    # Nobody waits for the result any more: free OCR / LLM for others
+    while not await request.is_disconnected():
+        await asyncio.sleep(1)
+    auftrag.abbrechen("Verbindung zum Client getrennt")
+
+
+def _processor(settings: dict):
+    # In worker mode the extraction runs on a worker, the export here
+    return worker.process_via_queue if settings.get("worker_modus") else process_input_file
+
+
+def _remember_output(result: dict) -> None:
+    # Persist last output directory for quick access in UI
+    try:
+        update_settings({"last_output_path": result.get("output_directory")})
+    except Exception:
+        pass
+
+
+@app.post("/api/process")
+async def process(
+    request: Request,
+    file: UploadFile = File(...),
+    ausgaben: Optional[str] = Form(None),
+    profil: Optional[str] = Form(None),
+    erneut: bool = Form(False),
+    auftrag_id: Optional[str] = Form(None),
+):
+    """Process one invoice. ``ausgaben`` limits the outputs (e.g. ``xrechnung_xml``),
+    ``profil`` selects the ZUGFeRD profile; both default to the settings.
+    Duplicates return the earlier result unless ``erneut`` is set. With a
+    client-chosen ``auftrag_id`` the job can be cancelled via
+    ``POST /api/jobs/{auftrag_id}/abbrechen``; a disconnect cancels it too."""
+    choice = _export_choice(ausgaben, profil)
+    auftrag = _zulassen(auftrag_id=auftrag_id)
+    try:
+        tmp_path = _persist_upload(file)
+    except BaseException:
+        auftrag.freigeben()
+        raise
 
     try:
         settings = load_settings()
-        result = process_input_file(
-            input_path=tmp_path,
-            output_root=OUTPUT_DIR,
-            settings=settings,
-        )
-        # Persist last output directory for quick access in UI
+        # In the thread pool: the stage limits may make the job wait, the event loop must not
+        waechter = asyncio.create_task(_bei_trennung_abbrechen(request, auftrag))
         try:
-            s = load_settings()
-            s["last_output_path"] = result.get("output_directory")
-            save_settings(s)
-        except Exception:
-            pass
+            with auftrag:
+                result = await run_in_threadpool(
+                    _processor(settings),
+                    input_path=tmp_path,
+                    output_root=OUTPUT_DIR,
+                    settings=settings,
+                    duplikate_pruefen=not erneut,
+                    **choice,
+                )
+        finally:
+            waechter.cancel()
+        _remember_output(result)
+    except ressourcen.Unterbrochen as e:
+        raise _unterbrochen(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
@@ -106,5 +289,187 @@ async def process(file: UploadFile = File(...)):
     return JSONResponse(result)
 
 
+@app.post("/api/jobs", status_code=202)
+def submit_job(
+    file: UploadFile = File(...),
+    ausgaben: Optional[str] = Form(None),
+    profil: Optional[str] = Form(None),
+    erneut: bool = Form(False),
+    klasse: str = Form("batch"),
+):
+    """Queue an invoice for the workers and return at once; poll ``/api/jobs/{id}``.
+
+    ``klasse`` (``interaktiv``, ``batch``, ``reexport``) decides which jobs workers take first."""
+    settings = load_settings()
+    if not settings.get("worker_modus"):
+        raise HTTPException(status_code=409, detail="Worker-Modus ist nicht aktiv")
+    if klasse not in ressourcen.KLASSEN:
+        raise HTTPException(status_code=400, detail=f"Unbekannte Prioritätsklasse: {klasse}")
+    choice = _export_choice(ausgaben, profil)
+    tmp_path = _persist_upload(file)
+    try:
+        job_id = worker.enqueue_file(
+            worker.queue_for(settings),
+            tmp_path,
+            name=file.filename,
+            duplikate_pruefen=not erneut,
+            klasse=klasse,
+            **choice,
+        )
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return {"job_id": job_id, "status": worker.queue_for(settings).get(job_id).status}
+
+
+@app.get("/api/jobs")
+def get_jobs():
+    """Number of jobs per status in the worker queue."""
+    return worker.queue_for(load_settings()).counts()
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = worker.queue_for(load_settings()).get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job nicht gefunden")
+    return job.as_dict()
+
+
+@app.post("/api/jobs/{job_id}/abbrechen")
+def cancel_job(job_id: str):
+    """Cancel a running upload (its ``auftrag_id``) or, in worker mode, a queued job.
+
+    Running OCRmyPDF / Ghostscript processes are killed and LLM generation stops;
+    the request of the job answers 409 with the stages finished so far."""
+    if ressourcen.abbrechen(job_id, "Über die API abgebrochen"):
+        return {"abgebrochen": True, "id": job_id}
+    settings = load_settings()
+    if settings.get("worker_modus") and worker.queue_for(settings).cancel(job_id):
+        return {"abgebrochen": True, "id": job_id}
+    raise HTTPException(status_code=404, detail="Kein laufender Auftrag mit dieser ID")
+
+
+@app.post("/api/reexport")
+async def reexport(payload: dict):
+    """Rebuild outputs from the stored canonical.json, without OCR or LLM.
+
+    ``output_directory`` selects one invoice, without it the whole output tree is
+    re-exported in the background: the answer is ``202`` with the id of the run,
+    its progress is at ``GET /api/reexport/{id}``. Only outputs whose inputs
+    (logo, template, profile, settings) changed are rendered unless
+    ``erzwingen`` is set. ``ausgaben`` and ``profil`` default to what each
+    invoice was exported with.
+    """
+    ausgaben = payload.get("ausgaben")
+    if isinstance(ausgaben, list):
+        ausgaben = ",".join(ausgaben)
+    choice = _export_choice(ausgaben, payload.get("profil"))
+    erzwingen = bool(payload.get("erzwingen"))
+    out_dir: Optional[Path] = None
+    if payload.get("output_directory"):
+        out_dir = Path(payload["output_directory"]).resolve()
+        if OUTPUT_DIR.resolve() not in out_dir.parents or not (out_dir / "canonical.json").is_file():
+            raise HTTPException(status_code=404, detail="Rechnung nicht gefunden")
+
+    settings = load_settings()
+    if out_dir is not None:
+        with _zulassen("reexport"):
+            result = await run_in_threadpool(reexport_dir, out_dir, settings, erzwingen=erzwingen, **choice)
+        if result["fehler"]:
+            raise HTTPException(status_code=500, detail=result["fehler"])
+        return JSONResponse(result)
+    # One low-priority ticket per invoice, rendered in the background under the shared stage slots
+    lauf = await run_in_threadpool(reexport_starten, [OUTPUT_DIR], settings, erzwingen=erzwingen, **choice)
+    return JSONResponse(lauf.as_dict(berichte=False), status_code=202)
+
+
+@app.get("/api/reexport/{lauf_id}")
+def get_reexport(lauf_id: str):
+    lauf = reexport_lauf(lauf_id)
+    if lauf is None:
+        raise HTTPException(status_code=404, detail="Neu-Export nicht gefunden")
+    return lauf.as_dict()
+
+
+@app.post("/api/reexport/{lauf_id}/abbrechen")
+def cancel_reexport(lauf_id: str):
+    lauf = reexport_lauf(lauf_id)
+    if lauf is None:
+        raise HTTPException(status_code=404, detail="Neu-Export nicht gefunden")
+    if not lauf.abbrechen("Über die API abgebrochen"):
+        raise HTTPException(status_code=409, detail=f"Neu-Export ist bereits {lauf.status}")
+    return {"abgebrochen": True, "id": lauf_id}
+
+
+@app.post("/api/process/stream")
+def process_stream(
+    file: UploadFile = File(...),
+    ausgaben: Optional[str] = Form(None),
+    profil: Optional[str] = Form(None),
+    erneut: bool = Form(False),
+    auftrag_id: Optional[str] = Form(None),
+):
+    """Like /api/process, but streams NDJSON events.
+
+    The first line ``{"event": "auftrag", "id": ...}`` names the job for
+    ``POST /api/jobs/{id}/abbrechen``; closing the stream cancels it as well.
+    Each top-level invoice field is sent as ``{"event": "field", ...}`` as soon
+    as the LLM has produced it; the last line is either ``result`` or ``error``.
+    """
+    choice = _export_choice(ausgaben, profil)
+    auftrag = _zulassen(auftrag_id=auftrag_id)
+    try:
+        tmp_path = _persist_upload(file)
+    except BaseException:
+        auftrag.freigeben()
+        raise
+    events: "queue.Queue[Optional[dict]]" = queue.Queue()
+    events.put({"event": "auftrag", "id": auftrag.id})
+
+    def run() -> None:
+        try:
+            settings = load_settings()
+            with auftrag:
+                result = _processor(settings)(
+                    input_path=tmp_path,
+                    output_root=OUTPUT_DIR,
+                    settings=settings,
+                    on_field=lambda key, value: events.put({"event": "field", "key": key, "value": value}),
+                    duplikate_pruefen=not erneut,
+                    **choice,
+                )
+            _remember_output(result)
+            events.put({"event": "result", "result": result})
+        except ressourcen.Unterbrochen as e:
+            events.put({"event": "error", "detail": str(e), **e.as_dict()})
+        except Exception as e:
+            events.put({"event": "error", "detail": str(e)})
+        finally:
+            tmp_path.unlink(missing_ok=True)
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    async def stream():
+        # Async, so a client disconnect cancels it at the sleep and the job is stopped
+        fertig = False
+        try:
+            while True:
+                try:
+                    event = events.get_nowait()
+                except queue.Empty:
+                    await asyncio.sleep(0.05)
+                    continue
+                if event is None:
+                    fertig = True
+                    return
+                yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        finally:
+            if not fertig:
+                auftrag.abbrechen("Verbindung zum Client getrennt")
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=False)
\ No newline at end of file
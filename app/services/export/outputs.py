@@ -0,0 +1,220 @@
+"""Export stage graph: the requested output formats rendered in memory.
+
+Every stage starts as soon as its inputs are done, so XRechnung, the ZUGFeRD
+XML and the PDF render run concurrently and only the PDF/A-3 finish waits for
+the CII XML. Stages no requested output needs are skipped entirely.
+"""
+import contextvars
+import hashlib
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from app.domain.rechnung_model import Rechnung
+from app.infrastructure.rechnungsindex import lieferant_kennung
+from app.infrastructure.storage import write_atomic
+from app.services.export.pdf.pdfa3 import finish_pdf_a3, render_base_pdf
+from app.services.export.pdf.renderer import TEMPLATE_DIR
+from app.services.export.xrechnung.xrechnung_writer import serialize_xrechnung
+from app.services.export.zugferd.zugferd_writer import PROFILES, resolve_profile, serialize_zugferd
+
+# Output kind → file name inside the invoice's output directory
+OUTPUT_FILES = {
+    "canonical_json": "canonical.json",
+    "xrechnung_xml": "xrechnung.xml",
+    "zugferd_xml": "zugferd.xml",
+    "zugferd_pdf": "zugferd.pdf",
+}
+
+
+# Per output directory: fingerprint of the inputs each file was rendered from
+EXPORT_MANIFEST = ".export.json"
+# Bump when a writer's output changes, so every file counts as outdated once
+EXPORT_VERSION = "1"
+# Output → the inputs it depends on, besides the canonical invoice
+_OUTPUT_INPUTS = {
+    "canonical_json": (),
+    "xrechnung_xml": ("pretty",),
+    "zugferd_xml": ("pretty", "profil"),
+    "zugferd_pdf": ("pretty", "profil", "vorlage", "logo"),
+}
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def _file_hash(path: Path) -> str:
+    # Cached by (path, mtime, size): a bulk run hashes the logo and template once
+    try:
+        st = path.stat()
+    except OSError:
+        return ""
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    if key not in _file_hashes:
+        _file_hashes[key] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return _file_hashes[key]
+
+
+def export_fingerprints(canonical: Rechnung, settings: Dict[str, Any], targets: Iterable[str]) -> Dict[str, str]:
+    """Hash of everything each output in ``targets`` is rendered from; a changed hash means stale."""
+    inputs = {
+        "pretty": str(bool(settings.get("xml_pretty_print"))),
+        "profil": resolve_profile(settings.get("zugferd_profil")),
+        "vorlage": _file_hash(TEMPLATE_DIR / "invoice.html") + _file_hash(TEMPLATE_DIR / "invoice.css"),
+        "logo": _file_hash(Path(settings["logo_path"])) if settings.get("logo_path") else "",
+    }
+    basis = hashlib.sha256(_stage_canonical_json(canonical, settings, {})).hexdigest()
+    fingerprints = {}
+    for name in targets:
+        parts = [EXPORT_VERSION, name, basis] + [inputs[i] for i in _OUTPUT_INPUTS[name]]
+        fingerprints[name] = hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+def read_export_manifest(out_dir: Path) -> Dict[str, Any]:
+    try:
+        return json.loads((Path(out_dir) / EXPORT_MANIFEST).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _path_component(value: str) -> str:
+    # Invoice numbers like "2024/17" must not create sub-directories or leave the output root
+    cleaned = re.sub(r'[\\/:*?"<>|\x00-\x1f]+', "_", value).strip(" .")
+    return cleaned or "_"
+
+
+def output_dir_for(output_root: Path, rechnung: Rechnung) -> Path:
+    """``<root>/<supplier>/<invoice number>``; the supplier level keeps equal numbers of
+    different suppliers apart."""
+    return Path(output_root) / _path_component(lieferant_kennung(rechnung)) / _path_component(
+        rechnung.dokument.rechnungsnummer or "ohne-nummer"
+    )
+
+
+def _stage_canonical_json(canonical: Rechnung, settings: Dict[str, Any], done: Dict[str, bytes]) -> bytes:
+    return canonical.model_dump_json(indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _stage_xrechnung_xml(canonical: Rechnung, settings: Dict[str, Any], done: Dict[str, bytes]) -> bytes:
+    return serialize_xrechnung(canonical, pretty=bool(settings.get("xml_pretty_print")))
+
+
+def _stage_zugferd_xml(canonical: Rechnung, settings: Dict[str, Any], done: Dict[str, bytes]) -> bytes:
+    return serialize_zugferd(
+        canonical,
+        pretty=bool(settings.get("xml_pretty_print")),
+        profil=settings.get("zugferd_profil"),
+    )
+
+
+def _stage_base_pdf(canonical: Rechnung, settings: Dict[str, Any], done: Dict[str, bytes]) -> bytes:
+    # Runs in a warm render process when pdf_render_workers > 0
+    return render_base_pdf(
+        canonical.model_dump(),
+        logo_path=settings.get("logo_path") or "",
+        render_workers=int(settings.get("pdf_render_workers") or 0),
+    )
+
+
+def _stage_zugferd_pdf(canonical: Rechnung, settings: Dict[str, Any], done: Dict[str, bytes]) -> bytes:
+    # PDF/A-3 with embedded ZUGFeRD XML; the only stage that waits for another
+    conformance = PROFILES[resolve_profile(settings.get("zugferd_profil"))][1]
+    return finish_pdf_a3(done["base_pdf"], done["zugferd_xml"], conformance=conformance)
+
+
+# Export stage → (stages it needs, function); only stages listed in OUTPUT_FILES are written
+EXPORT_STAGES: Dict[str, Tuple[Tuple[str, ...], Callable[[Rechnung, Dict[str, Any], Dict[str, bytes]], bytes]]] = {
+    "canonical_json": ((), _stage_canonical_json),
+    "xrechnung_xml": ((), _stage_xrechnung_xml),
+    "zugferd_xml": ((), _stage_zugferd_xml),
+    "base_pdf": ((), _stage_base_pdf),
+    "zugferd_pdf": (("base_pdf", "zugferd_xml"), _stage_zugferd_pdf),
+}
+
+
+def resolve_targets(targets: Optional[Iterable[str]]) -> Tuple[str, ...]:
+    """Requested outputs in OUTPUT_FILES order; ``None`` or empty means all."""
+    wanted = set(targets or OUTPUT_FILES)
+    unknown = wanted - set(OUTPUT_FILES)
+    if unknown:
+        raise ValueError(f"Unbekannte Ausgabe(n): {', '.join(sorted(unknown))} (erlaubt: {', '.join(OUTPUT_FILES)})")
+    return tuple(name for name in OUTPUT_FILES if name in wanted)
+
+
+def _required_stages(targets: Iterable[str], done: Iterable[str] = ()) -> Set[str]:
+    # Finished stages are neither run again nor do their inputs have to be
+    needed: Set[str] = set()
+    skip = set(done)
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed and name not in skip:
+            needed.add(name)
+            todo.extend(EXPORT_STAGES[name][0])
+    return needed
+
+
+def render_outputs(
+    canonical: Rechnung,
+    settings: Dict[str, Any],
+    targets: Optional[Iterable[str]] = None,
+    done: Optional[Dict[str, bytes]] = None,
+    on_stage: Optional[Callable[[str, bytes], None]] = None,
+) -> Dict[str, bytes]:
+    """Render ``targets`` (default: ``settings["export_outputs"]`` or all) in memory.
+
+    ``settings["zugferd_profil"]`` selects the ZUGFeRD / Factur-X profile.
+    Stages already in ``done`` (e.g. from a checkpoint) are not run again;
+    ``on_stage`` is called with every stage result as soon as it is ready.
+    """
+    targets = resolve_targets(targets if targets is not None else settings.get("export_outputs"))
+    resolve_profile(settings.get("zugferd_profil"))  # fail before any stage starts
+    done = dict(done or {})
+    pending = _required_stages(targets, done)
+    running: Dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(pending)), thread_name_prefix="export") as pool:
+        while pending or running:
+            for name in [n for n in pending if all(d in done for d in EXPORT_STAGES[n][0])]:
+                pending.discard(name)
+                # In the caller's context: stage slots see its ticket (priority, deadline, cancellation)
+                stage = EXPORT_STAGES[name][1]
+                running[pool.submit(contextvars.copy_context().run, stage, canonical, settings, done)] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                # Re-raises the stage's exception; the pool still waits for the others
+                name = running.pop(future)
+                done[name] = future.result()
+                if on_stage is not None:
+                    on_stage(name, done[name])
+    return {name: done[name] for name in targets}
+
+
+def write_outputs(
+    outputs: Dict[str, bytes],
+    out_dir: Path,
+    fingerprints: Optional[Dict[str, str]] = None,
+    profil: Optional[str] = None,
+    quell_hash: Optional[str] = None,
+) -> Dict[str, str]:
+    """Write rendered outputs atomically and return their absolute paths.
+
+    ``fingerprints`` (see :func:`export_fingerprints`) and the ZUGFeRD
+    ``profil`` are recorded in the directory's export manifest for re-exports,
+    ``quell_hash`` (the source file's sha256) for rebuilding the index.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for name, data in outputs.items():
+        path = out_dir / OUTPUT_FILES[name]
+        write_atomic(path, data)
+        files[name] = str(path.resolve())
+    if fingerprints is not None:
+        manifest = read_export_manifest(out_dir)
+        manifest.setdefault("fingerprints", {}).update({n: fingerprints[n] for n in outputs if n in fingerprints})
+        if profil:
+            manifest["zugferd_profil"] = profil
+        if quell_hash:
+            manifest["quell_hash"] = quell_hash
+        write_atomic(out_dir / EXPORT_MANIFEST, json.dumps(manifest, indent=2).encode("utf-8"))
+    return files
@@ -0,0 +1,153 @@
+"""Native PDF/A-3b post-processing with pikepdf.
+
+Turns a rendered PDF (ideally WeasyPrint output with ``pdf_variant="pdf/a-3b"``)
+into a ZUGFeRD / Factur-X invoice: sRGB OutputIntent, the XML as associated
+file (``/AF``, ``AFRelationship /Alternative``) and XMP metadata with the
+PDF/A identification and the Factur-X extension schema. No external process
+is started.
+"""
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+
+from lxml import etree
+
+from app.infrastructure.engines import optional_import
+
+# Bound by _load_pikepdf() on first use; pikepdf is optional and slow to import
+pikepdf = Array = Dictionary = Name = None
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent.parent
+ICC_PROFILE = BASE_DIR / "resources" / "srgb.icc"
+
+XML_ATTACHMENT_NAME = "factur-x.xml"
+FACTURX_NS = "urn:factur-x:pdfa:CrossIndustryDocument:invoice:1p0#"
+RDF_NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+PDFAID_NS = "http://www.aiim.org/pdfa/ns/id/"
+
+_FACTURX_PROPERTIES = (
+    ("DocumentFileName", "The name of the embedded XML document"),
+    ("DocumentType", "The type of the hybrid document in capital letters, e.g. INVOICE or ORDER"),
+    ("Version", "The actual version of the standard applying to the embedded XML document"),
+    ("ConformanceLevel", "The conformance level of the embedded XML document"),
+)
+
+_FACTURX_XMP = """<rdf:RDF xmlns:rdf="{rdf}">
+<rdf:Description rdf:about="" xmlns:fx="{fx}">
+  <fx:DocumentType>INVOICE</fx:DocumentType>
+  <fx:DocumentFileName>{filename}</fx:DocumentFileName>
+  <fx:Version>1.0</fx:Version>
+  <fx:ConformanceLevel>{conformance}</fx:ConformanceLevel>
+</rdf:Description>
+<rdf:Description rdf:about=""
+    xmlns:pdfaExtension="http://www.aiim.org/pdfa/ns/extension/"
+    xmlns:pdfaSchema="http://www.aiim.org/pdfa/ns/schema#"
+    xmlns:pdfaProperty="http://www.aiim.org/pdfa/ns/property#">
+  <pdfaExtension:schemas><rdf:Bag><rdf:li rdf:parseType="Resource">
+    <pdfaSchema:schema>Factur-X PDFA Extension Schema</pdfaSchema:schema>
+    <pdfaSchema:namespaceURI>{fx}</pdfaSchema:namespaceURI>
+    <pdfaSchema:prefix>fx</pdfaSchema:prefix>
+    <pdfaSchema:property><rdf:Seq>{properties}</rdf:Seq></pdfaSchema:property>
+  </rdf:li></rdf:Bag></pdfaExtension:schemas>
+</rdf:Description>
+</rdf:RDF>"""
+
+_PROPERTY = (
+    '<rdf:li rdf:parseType="Resource"><pdfaProperty:name>{0}</pdfaProperty:name>'
+    "<pdfaProperty:valueType>Text</pdfaProperty:valueType><pdfaProperty:category>external</pdfaProperty:category>"
+    "<pdfaProperty:description>{1}</pdfaProperty:description></rdf:li>"
+)
+
+
+def _load_pikepdf() -> bool:
+    global pikepdf, Array, Dictionary, Name
+    if pikepdf is None:
+        module = optional_import("pikepdf")
+        if module is None:
+            return False
+        Array, Dictionary, Name = module.Array, module.Dictionary, module.Name
+        pikepdf = module
+    return True
+
+
+def _facturx_descriptions(filename: str, conformance: str) -> list:
+    xml = _FACTURX_XMP.format(
+        rdf=RDF_NS,
+        fx=FACTURX_NS,
+        filename=filename,
+        conformance=conformance,
+        properties="".join(_PROPERTY.format(*p) for p in _FACTURX_PROPERTIES),
+    )
+    return list(etree.fromstring(xml))
+
+
+def _add_output_intent(pdf: "pikepdf.Pdf") -> None:
+    if "/OutputIntents" in pdf.Root and len(pdf.Root.OutputIntents):
+        return
+    icc = pdf.make_stream(ICC_PROFILE.read_bytes(), N=3)
+    intent = Dictionary(
+        Type=Name.OutputIntent,
+        S=Name.GTS_PDFA1,
+        OutputConditionIdentifier="sRGB IEC61966-2.1",
+        Info="sRGB IEC61966-2.1",
+        DestOutputProfile=icc,
+    )
+    pdf.Root.OutputIntents = Array([pdf.make_indirect(intent)])
+
+
+def _attach_xml(pdf: "pikepdf.Pdf", xml: bytes, filename: str) -> None:
+    now = datetime.now(timezone.utc).strftime("D:%Y%m%d%H%M%S+00'00'")
+    spec = pikepdf.AttachedFileSpec(
+        pdf,
+        xml,
+        description="Factur-X/ZUGFeRD Rechnung",
+        filename=filename,
+        mime_type="text/xml",
+        creation_date=now,
+        mod_date=now,
+        relationship=Name.Alternative,
+    )
+    pdf.attachments[filename] = spec
+    # Keep /AF in sync with the name tree when an attachment is replaced
+    kept = [f for f in pdf.Root.get("/AF", Array()) if str(f.get("/UF", f.get("/F", ""))) != filename]
+    pdf.Root.AF = Array(kept + [spec.obj])
+
+
+def _update_xmp(pdf: "pikepdf.Pdf", filename: str, conformance: str) -> None:
+    # Sync the document info into XMP and declare PDF/A-3b
+    with pdf.open_metadata(set_pikepdf_as_editor=False) as meta:
+        meta.load_from_docinfo(pdf.docinfo)
+        meta["pdfaid:part"] = "3"
+        meta["pdfaid:conformance"] = "B"
+
+    root = etree.fromstring(bytes(pdf.Root.Metadata.read_bytes()))
+    rdf = root if root.tag == f"{{{RDF_NS}}}RDF" else root.find(f".//{{{RDF_NS}}}RDF")
+    for desc in list(rdf):
+        # Replace Factur-X data from an earlier run instead of duplicating it
+        if any(str(ns) == FACTURX_NS for ns in desc.nsmap.values()) or desc.find(".//{*}schemas") is not None:
+            rdf.remove(desc)
+    rdf.extend(_facturx_descriptions(filename, conformance))
+    packet = etree.tostring(root, encoding="utf-8")
+    pdf.Root.Metadata = pdf.make_stream(
+        b'<?xpacket begin="\xef\xbb\xbf" id="W5M0MpCehiHzreSzNTczkc9d"?>\n' + packet + b'\n<?xpacket end="w"?>',
+        Type=Name.Metadata,
+        Subtype=Name.XML,
+    )
+
+
+def make_pdfa3(
+    pdf_bytes: bytes,
+    xml: bytes,
+    conformance: str = "EN 16931",
+    filename: str = XML_ATTACHMENT_NAME,
+) -> bytes:
+    """Return ``pdf_bytes`` as PDF/A-3b with ``xml`` attached as Factur-X invoice."""
+    if not _load_pikepdf():
+        raise RuntimeError("pikepdf ist nicht installiert")
+    with pikepdf.open(BytesIO(pdf_bytes)) as pdf:
+        _add_output_intent(pdf)
+        _attach_xml(pdf, xml, filename)
+        _update_xmp(pdf, filename, conformance)
+        out = BytesIO()
+        pdf.save(out)
+        return out.getvalue()
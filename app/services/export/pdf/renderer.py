@@ -0,0 +1,176 @@
+"""Warm WeasyPrint renderer for the invoice PDF.
+
+The compiled Jinja template, the parsed ``invoice.css``, one shared
+``FontConfiguration`` and the image cache (logo) live for the whole process,
+so a render only pays for template substitution and layout; they are reloaded
+when ``invoice.html`` or ``invoice.css`` change on disk. Optionally a pool
+of worker processes, each warmed up once, takes the renders off the caller.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from jinja2 import Environment, FileSystemLoader
+from loguru import logger
+
+from app.infrastructure.engines import optional_import
+from app.infrastructure.ressourcen import PRUEF_INTERVALL_S, pruefen
+
+# Bound by _load_weasyprint() on first use; importing WeasyPrint takes a noticeable moment
+CSS = HTML = FontConfiguration = None
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent.parent
+TEMPLATE_DIR = BASE_DIR / "resources" / "invoice"
+
+jinja_env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), auto_reload=False)
+
+# Decoded images keyed by URL, shared by all renders of this process
+_image_cache: Dict[str, Any] = {}
+_logo_stamp: Dict[str, float] = {}
+_vorlage_stamp: Optional[tuple] = None
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = Lock()
+
+
+def _load_weasyprint() -> bool:
+    global CSS, HTML, FontConfiguration
+    if HTML is None:
+        weasyprint = optional_import("weasyprint")
+        fonts = optional_import("weasyprint.text.fonts")
+        if weasyprint is None or fonts is None:
+            return False
+        CSS, FontConfiguration = weasyprint.CSS, fonts.FontConfiguration
+        HTML = weasyprint.HTML
+    return True
+
+
+@lru_cache(maxsize=1)
+def _template():
+    return jinja_env.get_template("invoice.html")
+
+
+@lru_cache(maxsize=1)
+def _font_config() -> "FontConfiguration":
+    return FontConfiguration()
+
+
+@lru_cache(maxsize=1)
+def _stylesheet() -> "CSS":
+    return CSS(filename=str(TEMPLATE_DIR / "invoice.css"), font_config=_font_config())
+
+
+def _check_vorlage() -> None:
+    # A changed template or stylesheet (e.g. a new customer layout) is picked up without restart
+    global _vorlage_stamp
+    stamp = tuple((TEMPLATE_DIR / name).stat().st_mtime_ns for name in ("invoice.html", "invoice.css"))
+    if stamp != _vorlage_stamp:
+        if _vorlage_stamp is not None:
+            logger.info("Rechnungsvorlage geändert, lade neu")
+            jinja_env.cache.clear()
+            _template.cache_clear()
+            _stylesheet.cache_clear()
+        _vorlage_stamp = stamp
+
+
+def _logo_url(logo_path: Optional[str]) -> Optional[str]:
+    """File URL of the logo; the cached decode is dropped when the file changes."""
+    if not logo_path:
+        return None
+    path = Path(logo_path)
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        logger.warning(f"Logo nicht gefunden: {logo_path}")
+        return None
+    url = path.resolve().as_uri()
+    if _logo_stamp.get(url) != mtime:
+        _image_cache.pop(url, None)
+        _logo_stamp[url] = mtime
+    return url
+
+
+def render_invoice_pdf(
+    rechnung: Dict[str, Any],
+    logo_path: Optional[str] = None,
+    pdf_variant: Optional[str] = None,
+) -> bytes:
+    """Render the invoice layout for ``rechnung`` (canonical dict) to PDF bytes."""
+    if not _load_weasyprint():
+        raise RuntimeError("WeasyPrint ist nicht installiert")
+    _check_vorlage()
+    html = _template().render(logo_url=_logo_url(logo_path), **rechnung)
+    document = HTML(string=html, base_url=str(TEMPLATE_DIR))
+    return document.write_pdf(
+        stylesheets=[_stylesheet()],
+        font_config=_font_config(),
+        cache=_image_cache,
+        pdf_variant=pdf_variant,
+    )
+
+
+def warm_up() -> None:
+    """Compile the template, parse the CSS and load the fonts ahead of the first invoice."""
+    _template()
+    if not _load_weasyprint():
+        return
+    _stylesheet()
+    # One throwaway layout resolves the fonts used by the stylesheet
+    HTML(string="<p>Rechnung 0,00 €</p>").write_pdf(stylesheets=[_stylesheet()], font_config=_font_config())
+
+
+def _render_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_up)
+            _pool_workers = workers
+        return _pool
+
+
+def warm_pool(workers: int) -> None:
+    """Start the ``workers`` render processes and wait until each has loaded template and fonts."""
+    if workers <= 0:
+        return
+    workers = min(workers, os.cpu_count() or 1)
+    pool = _render_pool(workers)
+    # Each submit starts a process while none is idle; the initializer does the warm-up
+    for future in [pool.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+
+
+def render_invoice_pdf_pooled(
+    rechnung: Dict[str, Any],
+    logo_path: Optional[str] = None,
+    pdf_variant: Optional[str] = None,
+    workers: int = 0,
+) -> bytes:
+    """Like :func:`render_invoice_pdf`, in one of ``workers`` warm processes (0: in-process)."""
+    if workers <= 0:
+        return render_invoice_pdf(rechnung, logo_path, pdf_variant)
+    workers = min(workers, os.cpu_count() or 1)
+    future = _render_pool(workers).submit(render_invoice_pdf, rechnung, logo_path, pdf_variant)
+    while True:
+        try:
+            return future.result(timeout=PRUEF_INTERVALL_S)
+        except FutureTimeout:
+            try:
+                pruefen()
+            except Exception:
+                # Dropped if still queued; a running render finishes in its worker and is discarded
+                future.cancel()
+                raise
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -0,0 +1,265 @@
+"""Re-export stored invoices from ``canonical.json``, without OCR or LLM.
+
+Only outputs whose inputs changed are rebuilt: every output directory keeps
+the fingerprints of what its files were rendered from (see
+``export_fingerprints``), so after a new logo only the PDFs are rendered
+again, after a new profile the ZUGFeRD XML and PDF, and so on.
+
+The CLI re-exports in a process pool. In the server a bulk re-export runs in
+the background (:func:`reexport_starten`) on threads instead, every directory
+as its own ``reexport`` ticket, so the shared render / Ghostscript slots and
+the low priority of the class apply. When no directory gets a ticket for
+``ZULASSUNG_MAX_S``, the run gives up instead of waiting forever.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+from loguru import logger
+
+from app.domain.rechnung_model import Rechnung
+from app.infrastructure import ressourcen
+from app.services.export.outputs import (
+    OUTPUT_FILES,
+    export_fingerprints,
+    read_export_manifest,
+    render_outputs,
+    resolve_targets,
+    write_outputs,
+)
+from app.services.export.zugferd.zugferd_writer import resolve_profile
+
+# Directories re-exported at once in the server; more would only wait for render slots
+SERVER_WORKERS = 2
+# How long a run waits without getting any admission ticket before it gives up
+ZULASSUNG_MAX_S = 600.0
+NICHT_ZUGELASSEN = "Nicht zugelassen: Server ausgelastet"
+# Finished background runs kept for GET /api/reexport/{id}
+LAEUFE_BEHALTEN = 20
+
+
+def iter_output_dirs(output_root: Path) -> Iterator[Path]:
+    """Every invoice directory (one with a ``canonical.json``) below ``output_root``."""
+    for canonical in sorted(Path(output_root).rglob("canonical.json")):
+        if "_working" not in canonical.parts:
+            yield canonical.parent
+
+
+def reexport_dir(
+    out_dir: Path,
+    settings: Dict[str, Any],
+    targets: Optional[Sequence[str]] = None,
+    profil: Optional[str] = None,
+    erzwingen: bool = False,
+) -> Dict[str, Any]:
+    """Rebuild the stale outputs of one invoice directory. Never raises.
+
+    ``targets`` defaults to the outputs present in the directory (``canonical.json``
+    itself is the source and never rewritten), ``profil`` to the profile it was
+    exported with. ``erzwingen`` rebuilds even unchanged outputs.
+    """
+    out_dir = Path(out_dir)
+    result: Dict[str, Any] = {"output_directory": str(out_dir.resolve()), "neu": [], "aktuell": [], "fehler": None}
+    try:
+        canonical = Rechnung.model_validate_json((out_dir / "canonical.json").read_bytes())
+        result["rechnungsnummer"] = canonical.dokument.rechnungsnummer
+        manifest = read_export_manifest(out_dir)
+        if targets is None:
+            targets = [n for n, f in OUTPUT_FILES.items() if n != "canonical_json" and (out_dir / f).exists()]
+        targets = [t for t in resolve_targets(targets) if t != "canonical_json"]
+        settings = {**settings, "zugferd_profil": resolve_profile(profil or manifest.get("zugferd_profil"))}
+
+        wanted = export_fingerprints(canonical, settings, targets)
+        stored = manifest.get("fingerprints") or {}
+        stale = [
+            t for t in targets
+            if erzwingen or stored.get(t) != wanted[t] or not (out_dir / OUTPUT_FILES[t]).exists()
+        ]
+        result["aktuell"] = [t for t in targets if t not in stale]
+        if stale:
+            write_outputs(render_outputs(canonical, settings, stale), out_dir, fingerprints=wanted, profil=settings["zugferd_profil"])
+        result["neu"] = stale
+    except Exception as e:
+        result["fehler"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+class ReexportLauf:
+    """A bulk re-export running in the background of the server."""
+
+    def __init__(self, anzahl: int) -> None:
+        self.id = uuid.uuid4().hex
+        self.status = "laeuft"
+        self.anzahl = anzahl
+        self.berichte: List[Dict[str, Any]] = []
+        self.fehler: Optional[str] = None
+        self.gestartet = time.time()
+        self.beendet: Optional[float] = None
+        self.zugelassen = time.monotonic()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._auftraege: Set[ressourcen.Auftrag] = set()
+
+    @property
+    def abgebrochen(self) -> bool:
+        return self._stop.is_set()
+
+    def abbrechen(self, grund: str = "Abgebrochen") -> bool:
+        """Stop the run: waiting directories are skipped, running ones cancelled; ``False`` if it is over."""
+        with self._lock:
+            if self.status != "laeuft":
+                return False
+            self._stop.set()
+            laufend = list(self._auftraege)
+        for auftrag in laufend:
+            auftrag.abbrechen(grund)
+        return True
+
+    def as_dict(self, berichte: bool = True) -> Dict[str, Any]:
+        with self._lock:
+            liste = list(self.berichte)
+        data = {
+            "id": self.id,
+            "status": self.status,
+            "rechnungen": self.anzahl,
+            "erledigt": len(liste),
+            "neu_exportiert": sum(1 for b in liste if b["neu"]),
+            "fehlgeschlagen": sum(1 for b in liste if b["fehler"]),
+            "fehler": self.fehler,
+            "gestartet": self.gestartet,
+            "beendet": self.beendet,
+        }
+        if berichte:
+            data["berichte"] = liste
+        return data
+
+
+_laeufe: "OrderedDict[str, ReexportLauf]" = OrderedDict()
+_laeufe_lock = threading.Lock()
+
+
+def _uebersprungen(out_dir: Path, grund: str) -> Dict[str, Any]:
+    return {"output_directory": str(Path(out_dir).resolve()), "neu": [], "aktuell": [], "fehler": grund}
+
+
+def _als_auftrag(task: Callable[[Path], Dict[str, Any]], lauf: Optional[ReexportLauf], out_dir: Path) -> Dict[str, Any]:
+    # Waits while the server is full, uploads keep their reserved capacity
+    lauf = lauf or ReexportLauf(1)
+    while True:
+        if lauf.abgebrochen:
+            return _uebersprungen(out_dir, lauf.fehler or "Abgebrochen")
+        try:
+            auftrag = ressourcen.zulassen("reexport", mandant="reexport")
+            break
+        except ressourcen.Ueberlastet as e:
+            rest = lauf.zugelassen + ZULASSUNG_MAX_S - time.monotonic()
+            if rest <= 0:
+                # No ticket for the whole run in ZULASSUNG_MAX_S: the remaining directories would fare no better
+                with lauf._lock:
+                    if not lauf.abgebrochen:
+                        logger.warning(f"Neu-Export {lauf.id} aufgegeben, seit {ZULASSUNG_MAX_S:.0f} s nicht zugelassen")
+                        lauf.fehler = NICHT_ZUGELASSEN
+                        lauf._stop.set()
+                continue
+            lauf._stop.wait(min(float(e.retry_after), rest))
+    lauf.zugelassen = time.monotonic()
+    with lauf._lock:
+        lauf._auftraege.add(auftrag)
+    try:
+        # Cancelled between admission and registration
+        if lauf.abgebrochen:
+            auftrag.freigeben()
+            return _uebersprungen(out_dir, lauf.fehler or "Abgebrochen")
+        with auftrag:
+            return task(out_dir)
+    finally:
+        with lauf._lock:
+            lauf._auftraege.discard(auftrag)
+
+
+def reexport_all(
+    paths: Iterable[Path],
+    settings: Dict[str, Any],
+    targets: Optional[Sequence[str]] = None,
+    profil: Optional[str] = None,
+    erzwingen: bool = False,
+    workers: Optional[int] = None,
+    chunksize: int = 8,
+    im_server: bool = False,
+    lauf: Optional[ReexportLauf] = None,
+    dirs: Optional[Sequence[Path]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Re-export every invoice directory below ``paths`` in a process pool, one report each.
+
+    ``im_server`` uses ``workers`` threads (default ``SERVER_WORKERS``) under
+    admission tickets instead of a process per core; ``lauf`` makes them
+    cancellable. ``dirs`` skips the directory scan.
+    """
+    if dirs is None:
+        dirs = [d for p in paths for d in iter_output_dirs(p)]
+    task = partial(
+        reexport_dir,
+        settings=settings,
+        targets=tuple(targets) if targets else None,
+        profil=profil,
+        erzwingen=erzwingen,
+    )
+    if im_server:
+        with ThreadPoolExecutor(max_workers=workers or SERVER_WORKERS, thread_name_prefix="reexport") as pool:
+            yield from pool.map(partial(_als_auftrag, task, lauf), dirs)
+        return
+    if workers == 1 or len(dirs) <= 1:
+        yield from map(task, dirs)
+        return
+    # Every process renders itself; a render pool per process would multiply them
+    task = partial(task, settings={**settings, "pdf_render_workers": 0})
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(task, dirs, chunksize=chunksize)
+
+
+def reexport_starten(
+    paths: Iterable[Path],
+    settings: Dict[str, Any],
+    targets: Optional[Sequence[str]] = None,
+    profil: Optional[str] = None,
+    erzwingen: bool = False,
+    workers: Optional[int] = None,
+) -> ReexportLauf:
+    """Start a bulk re-export in a background thread of the server; progress via :func:`reexport_lauf`."""
+    dirs = [d for p in paths for d in iter_output_dirs(p)]
+    lauf = ReexportLauf(len(dirs))
+    with _laeufe_lock:
+        _laeufe[lauf.id] = lauf
+        fertig = [i for i, l in _laeufe.items() if l.status != "laeuft"]
+        for alt in fertig[: max(0, len(fertig) - LAEUFE_BEHALTEN)]:
+            del _laeufe[alt]
+
+    def run() -> None:
+        try:
+            for bericht in reexport_all(
+                [], settings, targets=targets, profil=profil, erzwingen=erzwingen,
+                workers=workers, im_server=True, lauf=lauf, dirs=dirs,
+            ):
+                with lauf._lock:
+                    lauf.berichte.append(bericht)
+        except Exception as e:
+            logger.error(f"Neu-Export {lauf.id} fehlgeschlagen: {e}")
+            lauf.fehler = f"{type(e).__name__}: {e}"
+        with lauf._lock:
+            lauf.status = "fehler" if lauf.fehler else "abgebrochen" if lauf.abgebrochen else "fertig"
+            lauf.beendet = time.time()
+        logger.info(f"Neu-Export {lauf.id}: {lauf.status} ({len(lauf.berichte)}/{lauf.anzahl})")
+
+    threading.Thread(target=run, name=f"reexport-{lauf.id[:8]}", daemon=True).start()
+    return lauf
+
+
+def reexport_lauf(lauf_id: str) -> Optional[ReexportLauf]:
+    """A background re-export started by :func:`reexport_starten` (the latest finished ones are kept)."""
+    with _laeufe_lock:
+        return _laeufe.get(lauf_id)
@@ -0,0 +1,125 @@
+"""Single-pass XML output straight from the model.
+
+Writers emit precompiled tag templates into a list of string chunks; no
+intermediate dicts or element trees are built. Qualified names are interned
+per namespace once (``cbc.ID`` → ``"cbc:ID"``), text and attribute values are
+escaped on the way out.
+"""
+import re
+import sys
+from decimal import ROUND_HALF_UP
+from typing import Any, Callable, Dict, List, Optional
+
+from app.domain.rechnung.berechnung import CENT, to_decimal
+
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8'?>\n"
+
+# Control characters are not allowed in XML 1.0 (OCR text occasionally contains form feeds)
+_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_TEXT_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+_ATTR_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "\n": "&#10;", "\t": "&#9;"})
+
+
+def escape_text(value: str) -> str:
+    return _ILLEGAL.sub("", value).translate(_TEXT_ESCAPES)
+
+
+def escape_attr(value: str) -> str:
+    return _ILLEGAL.sub("", value).translate(_ATTR_ESCAPES)
+
+
+class Namespace:
+    """Interned qualified names of one namespace, built on first use: ``cbc.ID``."""
+
+    def __init__(self, uri: str, prefix: Optional[str] = None):
+        self.uri = uri
+        self.prefix = prefix
+
+    def __getattr__(self, local: str) -> str:
+        if local.startswith("__"):
+            raise AttributeError(local)
+        tag = sys.intern(f"{self.prefix}:{local}" if self.prefix else local)
+        setattr(self, local, tag)
+        return tag
+
+
+def nsmap(*namespaces: Namespace) -> Dict[str, str]:
+    """``xmlns`` attributes declaring ``namespaces`` on the root element."""
+    return {f"xmlns:{ns.prefix}" if ns.prefix else "xmlns": ns.uri for ns in namespaces}
+
+
+class XmlStream:
+    """Append-only XML writer; ``with w.element(tag):`` opens and closes an element."""
+
+    def __init__(self, pretty: bool = False):
+        self._out: List[str] = []
+        self._stack: List[str] = []
+        self._pretty = pretty
+        self._fragments: Dict[Any, str] = {}
+
+    def _newline(self) -> None:
+        if self._pretty and self._out:
+            self._out.append("\n" + "  " * len(self._stack))
+
+    def element(self, tag: str, attrib: Optional[Dict[str, str]] = None) -> "XmlStream":
+        self._newline()
+        if attrib:
+            attrs = "".join(f' {k}="{escape_attr(str(v))}"' for k, v in attrib.items())
+            self._out.append(f"<{tag}{attrs}>")
+        else:
+            self._out.append(f"<{tag}>")
+        self._stack.append(tag)
+        return self
+
+    def __enter__(self) -> "XmlStream":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        tag = self._stack.pop()
+        self._newline()
+        self._out.append(f"</{tag}>")
+
+    def leaf(self, tag: str, text: Any, attrib: Optional[Dict[str, str]] = None) -> None:
+        """Write ``<tag>text</tag>``; nothing is written for ``None``."""
+        if text is None:
+            return
+        self._newline()
+        if attrib:
+            attrs = "".join(f' {k}="{escape_attr(str(v))}"' for k, v in attrib.items())
+            self._out.append(f"<{tag}{attrs}>{escape_text(str(text))}</{tag}>")
+        else:
+            self._out.append(f"<{tag}>{escape_text(str(text))}</{tag}>")
+
+    def cached(self, key: Any, write: Callable[..., None], *args: Any) -> None:
+        """Write ``write(self, *args)`` once per ``key`` and depth, then replay the
+        rendered fragment, e.g. for the tax category repeated on every line."""
+        key = (key, len(self._stack))
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            start = len(self._out)
+            write(self, *args)
+            fragment = self._fragments[key] = "".join(self._out[start:])
+            del self._out[start:]
+        self._out.append(fragment)
+
+    def getvalue(self) -> bytes:
+        body = "".join(self._out)
+        return (XML_DECLARATION + body + ("\n" if self._pretty else "")).encode("utf-8")
+
+
+def render(write: Callable[..., None], *args: Any, pretty: bool = False) -> bytes:
+    """Run ``write(stream, *args)`` and return the finished document as bytes."""
+    stream = XmlStream(pretty)
+    write(stream, *args)
+    return stream.getvalue()
+
+
+def betrag(v: Any) -> str:
+    """Monetary amount with exactly two decimals."""
+    return str(to_decimal(v).quantize(CENT, rounding=ROUND_HALF_UP))
+
+
+def zahl(v: Any) -> str:
+    """Quantity, price or percentage without trailing zeros."""
+    d = to_decimal(v)
+    return format(d.normalize(), "f") if d else "0"
@@ -1,99 +1,127 @@
 from pathlib import Path
-from typing import Dict, Any
-from lxml import etree
-
-NSMAP = {
-    None: "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2",
-    "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
-    "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
-}
-
-
-def _el(tag: str, text: Any = None, ns: str = "cbc"):
-    qname = etree.QName(NSMAP[ns], tag)
-    el = etree.Element(qname)
-    if text is not None:
-        el.text = str(text)
-    return el
-
-
-def write_xrechnung_xml(ubl_invoice: Dict[str, Any], out_path: Path) -> None:
-    inv = etree.Element(etree.QName(NSMAP[None], "Invoice"), nsmap=NSMAP)
-
-    inv.append(_el("CustomizationID", ubl_invoice["CustomizationID"]))
-    inv.append(_el("ProfileID", ubl_invoice["ProfileID"]))
-    inv.append(_el("ID", ubl_invoice["ID"]))
-    inv.append(_el("IssueDate", ubl_invoice["IssueDate"]))
-    inv.append(_el("InvoiceTypeCode", ubl_invoice["InvoiceTypeCode"]))
-    inv.append(_el("DocumentCurrencyCode", ubl_invoice["DocumentCurrencyCode"]))
-
-    # Parties
-    def party_el(role_key: str):
-        role = etree.Element(etree.QName(NSMAP["cac"], role_key))
-        party = etree.Element(etree.QName(NSMAP["cac"], "Party"))
-
-        pname = etree.Element(etree.QName(NSMAP["cac"], "PartyName"))
-        pname.append(_el("Name", ubl_invoice[role_key]["Party"]["PartyName"]))
-        party.append(pname)
-
-        addr = etree.Element(etree.QName(NSMAP["cac"], "PostalAddress"))
-        a = ubl_invoice[role_key]["Party"]["PostalAddress"]
-        addr.append(_el("StreetName", a["StreetName"]))
-        addr.append(_el("CityName", a["CityName"]))
-        addr.append(_el("PostalZone", a["PostalZone"]))
-        country = etree.Element(etree.QName(NSMAP["cac"], "Country"))
-        country.append(_el("IdentificationCode", a["Country"]["IdentificationCode"]))
-        addr.append(country)
-        party.append(addr)
-
-        role.append(party)
-        inv.append(role)
-
-    party_el("AccountingSupplierParty")
-    party_el("AccountingCustomerParty")
-
-    # TaxTotal
-    tax_total = etree.Element(etree.QName(NSMAP["cac"], "TaxTotal"))
-    tax_total.append(_el("TaxAmount", ubl_invoice["TaxTotal"]["TaxAmount"]))
-    for st in ubl_invoice["TaxTotal"].get("TaxSubtotal", []):
-        tax_sub = etree.Element(etree.QName(NSMAP["cac"], "TaxSubtotal"))
-        tax_sub.append(_el("TaxableAmount", st["TaxableAmount"]))
-        tax_sub.append(_el("TaxAmount", st["TaxAmount"]))
-        tax_cat = etree.Element(etree.QName(NSMAP["cac"], "TaxCategory"))
-        tax_cat.append(_el("ID", st["TaxCategory"]["ID"]))
-        tax_cat.append(_el("Percent", st["TaxCategory"]["Percent"]))
-        tax_sub.append(tax_cat)
-        tax_total.append(tax_sub)
-    inv.append(tax_total)
-
-    # MonetaryTotal
-    mtotal = etree.Element(etree.QName(NSMAP["cac"], "LegalMonetaryTotal"))
-    mt = ubl_invoice["LegalMonetaryTotal"]
-    mtotal.append(_el("LineExtensionAmount", mt["LineExtensionAmount"]))
-    mtotal.append(_el("TaxExclusiveAmount", mt["TaxExclusiveAmount"]))
-    mtotal.append(_el("TaxInclusiveAmount", mt["TaxInclusiveAmount"]))
-    mtotal.append(_el("PayableAmount", mt["PayableAmount"]))
-    inv.append(mtotal)
-
-    # Lines
-    for ln in ubl_invoice["InvoiceLine"]:
-        line = etree.Element(etree.QName(NSMAP["cac"], "InvoiceLine"))
-        line.append(_el("ID", ln["ID"]))
-        qty = etree.Element(etree.QName(NSMAP["cbc"], "InvoicedQuantity"), unitCode=str(ln["InvoicedQuantity"]["unitCode"]))
-        qty.text = str(ln["InvoicedQuantity"]["value"])
-        line.append(qty)
-        line.append(_el("LineExtensionAmount", ln["LineExtensionAmount"]))
-        item = etree.Element(etree.QName(NSMAP["cac"], "Item"))
-        item.append(_el("Description", ln["Item"]["Description"]))
-        taxc = etree.Element(etree.QName(NSMAP["cac"], "ClassifiedTaxCategory"))
-        taxc.append(_el("ID", ln["Item"]["ClassifiedTaxCategory"]["ID"]))
-        taxc.append(_el("Percent", ln["Item"]["ClassifiedTaxCategory"]["Percent"]))
-        item.append(taxc)
-        line.append(item)
-        price = etree.Element(etree.QName(NSMAP["cac"], "Price"))
-        price.append(_el("PriceAmount", ln["Price"]["PriceAmount"]))
-        line.append(price)
-        inv.append(line)
-
-    tree = etree.ElementTree(inv)
-    tree.write(str(out_path), encoding="UTF-8", xml_declaration=True, pretty_print=True)
\ No newline at end of file
+
+from app.domain.rechnung_model import RECHNUNGSARTEN, ZAHLUNGSARTEN, Partei, Rechnung
+from app.services.export.xml_stream import Namespace, XmlStream, betrag, nsmap, render, zahl
+
+UBL_NS = "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+CBC_NS = "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+CAC_NS = "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+
+CUSTOMIZATION_ID = "urn:cen.eu:en16931:2017"
+PROFILE_ID = "urn:fdc:de.gov:xrechnung:3.0.1"
+
+ubl = Namespace(UBL_NS)
+cbc = Namespace(CBC_NS, "cbc")
+cac = Namespace(CAC_NS, "cac")
+NSMAP = nsmap(ubl, cbc, cac)
+
+
+def _tax_category(w: XmlStream, tag: str, kategorie: str, satz: float) -> None:
+    with w.element(tag):
+        w.leaf(cbc.ID, kategorie)
+        w.leaf(cbc.Percent, zahl(satz))
+        with w.element(cac.TaxScheme):
+            w.leaf(cbc.ID, "VAT")
+
+
+def _party(w: XmlStream, role: str, p: Partei) -> None:
+    with w.element(role), w.element(cac.Party):
+        with w.element(cac.PartyName):
+            w.leaf(cbc.Name, p.name)
+        with w.element(cac.PostalAddress):
+            w.leaf(cbc.StreetName, p.anschrift.strasse)
+            w.leaf(cbc.CityName, p.anschrift.ort)
+            w.leaf(cbc.PostalZone, p.anschrift.plz)
+            with w.element(cac.Country):
+                w.leaf(cbc.IdentificationCode, p.anschrift.land)
+        # VAT id (BT-31/48) and national tax number (BT-32, scheme FC)
+        for company_id, scheme in ((p.umsatzsteuer_id, "VAT"), (p.steuernummer, "FC")):
+            if company_id:
+                with w.element(cac.PartyTaxScheme):
+                    w.leaf(cbc.CompanyID, company_id)
+                    with w.element(cac.TaxScheme):
+                        w.leaf(cbc.ID, scheme)
+        with w.element(cac.PartyLegalEntity):
+            w.leaf(cbc.RegistrationName, p.name)
+
+
+def write_invoice(w: XmlStream, r: Rechnung) -> None:
+    """Write a UBL 2.1 Invoice (XRechnung) for ``r`` in schema order."""
+    cur = {"currencyID": r.dokument.waehrung or "EUR"}
+    s = r.summen
+
+    with w.element(ubl.Invoice, NSMAP):
+        w.leaf(cbc.CustomizationID, CUSTOMIZATION_ID)
+        w.leaf(cbc.ProfileID, PROFILE_ID)
+        w.leaf(cbc.ID, r.dokument.rechnungsnummer)
+        w.leaf(cbc.IssueDate, r.dokument.rechnungsdatum.isoformat())
+        if r.dokument.faelligkeitsdatum:
+            w.leaf(cbc.DueDate, r.dokument.faelligkeitsdatum.isoformat())
+        w.leaf(cbc.InvoiceTypeCode, RECHNUNGSARTEN.get(r.dokument.rechnungsart, "380"))
+        for b in r.bemerkungen or []:
+            w.leaf(cbc.Note, b.text)
+        w.leaf(cbc.DocumentCurrencyCode, cur["currencyID"])
+        if r.dokument.vorherige_rechnungsnummer:
+            with w.element(cac.BillingReference), w.element(cac.InvoiceDocumentReference):
+                w.leaf(cbc.ID, r.dokument.vorherige_rechnungsnummer)
+
+        _party(w, cac.AccountingSupplierParty, r.verkaeufer)
+        _party(w, cac.AccountingCustomerParty, r.kaeufer)
+
+        if r.zahlung.zahlungsart:
+            with w.element(cac.PaymentMeans):
+                w.leaf(cbc.PaymentMeansCode, ZAHLUNGSARTEN.get(r.zahlung.zahlungsart.upper(), "1"))
+                if r.zahlung.iban:
+                    with w.element(cac.PayeeFinancialAccount):
+                        w.leaf(cbc.ID, r.zahlung.iban)
+                        if r.zahlung.bic:
+                            with w.element(cac.FinancialInstitutionBranch):
+                                w.leaf(cbc.ID, r.zahlung.bic)
+
+        for nz in r.nachlaesse_zuschlaege or []:
+            with w.element(cac.AllowanceCharge):
+                w.leaf(cbc.ChargeIndicator, "true" if nz.zuschlag else "false")
+                if nz.grund:
+                    w.leaf(cbc.AllowanceChargeReason, nz.grund)
+                w.leaf(cbc.Amount, betrag(nz.betrag), cur)
+                _tax_category(w, cac.TaxCategory, nz.umsatzsteuer.kategorie, nz.umsatzsteuer.satz)
+
+        with w.element(cac.TaxTotal):
+            w.leaf(cbc.TaxAmount, betrag(s.gesamt_umsatzsteuer), cur)
+            for b in r.umsatzsteuer_aufschluesselung or []:
+                with w.element(cac.TaxSubtotal):
+                    w.leaf(cbc.TaxableAmount, betrag(b.steuerbasisbetrag), cur)
+                    w.leaf(cbc.TaxAmount, betrag(b.steuerbetrag), cur)
+                    _tax_category(w, cac.TaxCategory, b.kategorie, b.satz)
+
+        with w.element(cac.LegalMonetaryTotal):
+            w.leaf(cbc.LineExtensionAmount, betrag(s.gesamt_netto), cur)
+            steuerbasis = s.steuerbasis if s.steuerbasis is not None else s.gesamt_netto
+            w.leaf(cbc.TaxExclusiveAmount, betrag(steuerbasis), cur)
+            w.leaf(cbc.TaxInclusiveAmount, betrag(s.gesamt_brutto), cur)
+            if s.summe_nachlaesse is not None:
+                w.leaf(cbc.AllowanceTotalAmount, betrag(s.summe_nachlaesse), cur)
+            if s.summe_zuschlaege is not None:
+                w.leaf(cbc.ChargeTotalAmount, betrag(s.summe_zuschlaege), cur)
+            zahlbetrag = s.zahlbetrag if s.zahlbetrag is not None else s.gesamt_brutto
+            w.leaf(cbc.PayableAmount, betrag(zahlbetrag), cur)
+
+        for pos in r.positionen:
+            with w.element(cac.InvoiceLine):
+                w.leaf(cbc.ID, pos.positionsnummer)
+                w.leaf(cbc.InvoicedQuantity, zahl(pos.menge), {"unitCode": pos.einheit})
+                w.leaf(cbc.LineExtensionAmount, betrag(pos.positionsbetrag_netto), cur)
+                with w.element(cac.Item):
+                    w.leaf(cbc.Name, pos.beschreibung)
+                    ust = pos.umsatzsteuer
+                    w.cached(("ust", ust.kategorie, ust.satz), _tax_category, cac.ClassifiedTaxCategory, ust.kategorie, ust.satz)
+                with w.element(cac.Price):
+                    w.leaf(cbc.PriceAmount, zahl(pos.einzelpreis_netto), cur)
+
+
+def serialize_xrechnung(rechnung: Rechnung, pretty: bool = False) -> bytes:
+    return render(write_invoice, rechnung, pretty=pretty)
+
+
+def write_xrechnung_xml(rechnung: Rechnung, out_path: Path, pretty: bool = False) -> None:
+    out_path.write_bytes(serialize_xrechnung(rechnung, pretty=pretty))
@@ -1,112 +1,189 @@
+from datetime import date
 from pathlib import Path
-from typing import Dict, Any
-from lxml import etree
+from typing import Optional
 
-NSMAP = {
-    "rsm": "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100",
-    "ram": "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100",
-    "udt": "urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100",
-}
+from app.domain.rechnung_model import RECHNUNGSARTEN, ZAHLUNGSARTEN, Partei, Rechnung
+from app.services.export.xml_stream import Namespace, XmlStream, betrag, nsmap, render, zahl
+
+RSM_NS = "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100"
+RAM_NS = "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100"
+UDT_NS = "urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100"
 
+GUIDELINE_ID = "urn:cen.eu:en16931:2017"
 
-def _ram(tag: str, text: Any = None):
-    el = etree.Element(etree.QName(NSMAP["ram"], tag))
-    if text is not None:
-        el.text = str(text)
-    return el
-
-
-def write_zugferd_xml(cii: Dict[str, Any], out_path: Path) -> None:
-    root = etree.Element(etree.QName(NSMAP["rsm"], "CrossIndustryInvoice"), nsmap=NSMAP)
-
-    # Context
-    ctx = etree.Element(etree.QName(NSMAP["rsm"], "ExchangedDocumentContext"))
-    param = etree.Element(etree.QName(NSMAP["ram"], "GuidelineSpecifiedDocumentContextParameter"))
-    param.append(_ram("ID", cii["Context"]["GuidelineID"]))
-    ctx.append(param)
-    root.append(ctx)
-
-    # Document
-    doc = etree.Element(etree.QName(NSMAP["rsm"], "ExchangedDocument"))
-    doc.append(_ram("ID", cii["Document"]["ID"]))
-    doc.append(_ram("TypeCode", cii["Document"]["TypeCode"]))
-    doc.append(_ram("IssueDateTime", cii["Document"]["IssueDate"]))
-    root.append(doc)
-
-    # Parties
-    header_agreement = etree.Element(etree.QName(NSMAP["ram"], "ApplicableHeaderTradeAgreement"))
-    seller = etree.Element(etree.QName(NSMAP["ram"], "SellerTradeParty"))
-    seller.append(_ram("Name", cii["Parties"]["Seller"]["Name"]))
-    seller_addr = etree.Element(etree.QName(NSMAP["ram"], "PostalTradeAddress"))
-    seller_addr.append(_ram("PostcodeCode", cii["Parties"]["Seller"]["ZIP"]))
-    seller_addr.append(_ram("LineOne", cii["Parties"]["Seller"]["Street"]))
-    seller_addr.append(_ram("CityName", cii["Parties"]["Seller"]["City"]))
-    seller_addr.append(_ram("CountryID", cii["Parties"]["Seller"]["Country"]))
-    seller.append(seller_addr)
-    header_agreement.append(seller)
-
-    buyer = etree.Element(etree.QName(NSMAP["ram"], "BuyerTradeParty"))
-    buyer.append(_ram("Name", cii["Parties"]["Buyer"]["Name"]))
-    buyer_addr = etree.Element(etree.QName(NSMAP["ram"], "PostalTradeAddress"))
-    buyer_addr.append(_ram("PostcodeCode", cii["Parties"]["Buyer"]["ZIP"]))
-    buyer_addr.append(_ram("LineOne", cii["Parties"]["Buyer"]["Street"]))
-    buyer_addr.append(_ram("CityName", cii["Parties"]["Buyer"]["City"]))
-    buyer_addr.append(_ram("CountryID", cii["Parties"]["Buyer"]["Country"]))
-    buyer.append(buyer_addr)
-    header_agreement.append(buyer)
-
-    root.append(header_agreement)
-
-    # Settlement (totals)
-    settlement = etree.Element(etree.QName(NSMAP["ram"], "ApplicableHeaderTradeSettlement"))
-    currency = etree.Element(etree.QName(NSMAP["ram"], "InvoiceCurrencyCode"))
-    currency.text = cii["Document"]["Currency"]
-    settlement.append(currency)
-
-    # MonetarySummation
-    summ = etree.Element(etree.QName(NSMAP["ram"], "SpecifiedTradeSettlementHeaderMonetarySummation"))
-    summ.append(_ram("LineTotalAmount", cii["Totals"]["LineNetTotal"]))
-    summ.append(_ram("TaxTotalAmount", cii["Totals"]["TaxTotal"]))
-    summ.append(_ram("GrandTotalAmount", cii["Totals"]["GrandTotal"]))
-    summ.append(_ram("DuePayableAmount", cii["Totals"]["PayableAmount"]))
-    settlement.append(summ)
-
-    root.append(settlement)
-
-    # Lines
-    trx = etree.Element(etree.QName(NSMAP["ram"], "SupplyChainTradeTransaction"))
-    for ln in cii["Lines"]:
-        line = etree.Element(etree.QName(NSMAP["ram"], "IncludedSupplyChainTradeLineItem"))
-        docline = etree.Element(etree.QName(NSMAP["ram"], "AssociatedDocumentLineDocument"))
-        docline.append(_ram("LineID", ln["LineID"]))
-        line.append(docline)
-        prod = etree.Element(etree.QName(NSMAP["ram"], "SpecifiedTradeProduct"))
-        prod.append(_ram("Name", ln["ProductName"]))
-        line.append(prod)
-        price = etree.Element(etree.QName(NSMAP["ram"], "GrossPriceProductTradePrice"))
-        price.append(_ram("ChargeAmount", ln["NetPrice"]))
-        line.append(price)
-        qty = etree.Element(etree.QName(NSMAP["ram"], "SpecifiedLineTradeDelivery"))
-        q = etree.Element(etree.QName(NSMAP["ram"], "BilledQuantity"), unitCode=str(ln["UnitCode"]))
-        q.text = str(ln["Quantity"]) 
-        qty.append(q)
-        line.append(qty)
-
-        # Line settlement / tax
-        lsett = etree.Element(etree.QName(NSMAP["ram"], "SpecifiedLineTradeSettlement"))
-        tax = etree.Element(etree.QName(NSMAP["ram"], "ApplicableTradeTax"))
-        tax.append(_ram("TypeCode", "VAT"))
-        tax.append(_ram("CategoryCode", ln["TaxCategory"]))
-        tax.append(_ram("RateApplicablePercent", ln["TaxPercent"]))
-        lsett.append(tax)
-        mon = etree.Element(etree.QName(NSMAP["ram"], "SpecifiedTradeSettlementLineMonetarySummation"))
-        mon.append(_ram("LineTotalAmount", ln["NetAmount"]))
-        lsett.append(mon)
-        line.append(lsett)
-
-        trx.append(line)
-
-    root.append(trx)
-
-    tree = etree.ElementTree(root)
-    tree.write(str(out_path), encoding="UTF-8", xml_declaration=True, pretty_print=True)
\ No newline at end of file
+# Profile → (BT-24 guideline id, Factur-X XMP ConformanceLevel)
+PROFILES = {
+    "MINIMUM": ("urn:factur-x.eu:1p0:minimum", "MINIMUM"),
+    "BASIC WL": ("urn:factur-x.eu:1p0:basicwl", "BASIC WL"),
+    "BASIC": ("urn:cen.eu:en16931:2017#compliant#urn:factur-x.eu:1p0:basic", "BASIC"),
+    "EN16931": (GUIDELINE_ID, "EN 16931"),
+    "EXTENDED": ("urn:cen.eu:en16931:2017#conformant#urn:factur-x.eu:1p0:extended", "EXTENDED"),
+    "XRECHNUNG": ("urn:cen.eu:en16931:2017#compliant#urn:xeinkauf.de:kosit:xrechnung_3.0", "XRECHNUNG"),
+}
+DEFAULT_PROFILE = "EN16931"
+# Profiles without invoice lines; MINIMUM also leaves out the settlement details
+_OHNE_POSITIONEN = {"MINIMUM", "BASIC WL"}
+
+
+def resolve_profile(profil: Optional[str] = None) -> str:
+    """Normalize a profile name (``"basic-wl"``, ``"EN 16931"`` …) to a key of PROFILES."""
+    if not profil:
+        return DEFAULT_PROFILE
+    key = profil.upper().replace("_", " ").replace("-", " ")
+    key = {"EN 16931": "EN16931", "BASICWL": "BASIC WL"}.get(key, key)
+    if key not in PROFILES:
+        raise ValueError(f"Unbekanntes ZUGFeRD-Profil: {profil} (erlaubt: {', '.join(PROFILES)})")
+    return key
+
+rsm = Namespace(RSM_NS, "rsm")
+ram = Namespace(RAM_NS, "ram")
+udt = Namespace(UDT_NS, "udt")
+NSMAP = nsmap(rsm, ram, udt)
+
+_FORMAT_102 = {"format": "102"}
+
+
+def _datum(w: XmlStream, tag: str, d: date) -> None:
+    with w.element(tag):
+        w.leaf(udt.DateTimeString, d.strftime("%Y%m%d"), _FORMAT_102)
+
+
+def _trade_tax(w: XmlStream, tag: str, kategorie: str, satz: float) -> None:
+    with w.element(tag):
+        w.leaf(ram.TypeCode, "VAT")
+        w.leaf(ram.CategoryCode, kategorie)
+        w.leaf(ram.RateApplicablePercent, zahl(satz))
+
+
+def _party(w: XmlStream, role: str, p: Partei, minimum: bool = False) -> None:
+    with w.element(role):
+        w.leaf(ram.Name, p.name)
+        if minimum:
+            # MINIMUM: seller country and VAT id only, buyer name only
+            if role == ram.SellerTradeParty:
+                with w.element(ram.PostalTradeAddress):
+                    w.leaf(ram.CountryID, p.anschrift.land)
+                if p.umsatzsteuer_id:
+                    with w.element(ram.SpecifiedTaxRegistration):
+                        w.leaf(ram.ID, p.umsatzsteuer_id, {"schemeID": "VA"})
+            return
+        with w.element(ram.PostalTradeAddress):
+            w.leaf(ram.PostcodeCode, p.anschrift.plz)
+            w.leaf(ram.LineOne, p.anschrift.strasse)
+            w.leaf(ram.CityName, p.anschrift.ort)
+            w.leaf(ram.CountryID, p.anschrift.land)
+        # Tax number (BT-32, scheme FC) and VAT id (BT-31/48, scheme VA)
+        for tax_id, scheme in ((p.steuernummer, "FC"), (p.umsatzsteuer_id, "VA")):
+            if tax_id:
+                with w.element(ram.SpecifiedTaxRegistration):
+                    w.leaf(ram.ID, tax_id, {"schemeID": scheme})
+
+
+def write_invoice(w: XmlStream, r: Rechnung, profil: str = DEFAULT_PROFILE) -> None:
+    """Write a CII D16B CrossIndustryInvoice (ZUGFeRD / Factur-X) for ``r`` in schema order.
+
+    ``profil`` selects the guideline id and how much of the invoice is written
+    (see PROFILES).
+    """
+    s = r.summen
+    waehrung = r.dokument.waehrung or "EUR"
+    profil = resolve_profile(profil)
+    minimum = profil == "MINIMUM"
+    positionen = [] if profil in _OHNE_POSITIONEN else r.positionen
+    bemerkungen = [] if minimum else r.bemerkungen or []
+    aufschluesselung = [] if minimum else r.umsatzsteuer_aufschluesselung or []
+    nachlaesse_zuschlaege = [] if minimum else r.nachlaesse_zuschlaege or []
+
+    with w.element(rsm.CrossIndustryInvoice, NSMAP):
+        with w.element(rsm.ExchangedDocumentContext), w.element(ram.GuidelineSpecifiedDocumentContextParameter):
+            w.leaf(ram.ID, PROFILES[profil][0])
+
+        with w.element(rsm.ExchangedDocument):
+            w.leaf(ram.ID, r.dokument.rechnungsnummer)
+            w.leaf(ram.TypeCode, RECHNUNGSARTEN.get(r.dokument.rechnungsart, "380"))
+            _datum(w, ram.IssueDateTime, r.dokument.rechnungsdatum)
+            for b in bemerkungen:
+                with w.element(ram.IncludedNote):
+                    w.leaf(ram.Content, b.text)
+
+        with w.element(rsm.SupplyChainTradeTransaction):
+            for pos in positionen:
+                with w.element(ram.IncludedSupplyChainTradeLineItem):
+                    with w.element(ram.AssociatedDocumentLineDocument):
+                        w.leaf(ram.LineID, pos.positionsnummer)
+                    with w.element(ram.SpecifiedTradeProduct):
+                        w.leaf(ram.Name, pos.beschreibung)
+                    with w.element(ram.SpecifiedLineTradeAgreement), w.element(ram.NetPriceProductTradePrice):
+                        w.leaf(ram.ChargeAmount, zahl(pos.einzelpreis_netto))
+                    with w.element(ram.SpecifiedLineTradeDelivery):
+                        w.leaf(ram.BilledQuantity, zahl(pos.menge), {"unitCode": pos.einheit})
+                    with w.element(ram.SpecifiedLineTradeSettlement):
+                        ust = pos.umsatzsteuer
+                        w.cached(("ust", ust.kategorie, ust.satz), _trade_tax, ram.ApplicableTradeTax, ust.kategorie, ust.satz)
+                        with w.element(ram.SpecifiedTradeSettlementLineMonetarySummation):
+                            w.leaf(ram.LineTotalAmount, betrag(pos.positionsbetrag_netto))
+
+            with w.element(ram.ApplicableHeaderTradeAgreement):
+                _party(w, ram.SellerTradeParty, r.verkaeufer, minimum)
+                _party(w, ram.BuyerTradeParty, r.kaeufer, minimum)
+
+            w.leaf(ram.ApplicableHeaderTradeDelivery, "")
+
+            with w.element(ram.ApplicableHeaderTradeSettlement):
+                w.leaf(ram.InvoiceCurrencyCode, waehrung)
+                if r.zahlung.zahlungsart and not minimum:
+                    with w.element(ram.SpecifiedTradeSettlementPaymentMeans):
+                        w.leaf(ram.TypeCode, ZAHLUNGSARTEN.get(r.zahlung.zahlungsart.upper(), "1"))
+                        if r.zahlung.iban:
+                            with w.element(ram.PayeePartyCreditorFinancialAccount):
+                                w.leaf(ram.IBANID, r.zahlung.iban)
+                        if r.zahlung.bic:
+                            with w.element(ram.PayeeSpecifiedCreditorFinancialInstitution):
+                                w.leaf(ram.BICID, r.zahlung.bic)
+
+                for b in aufschluesselung:
+                    with w.element(ram.ApplicableTradeTax):
+                        w.leaf(ram.CalculatedAmount, betrag(b.steuerbetrag))
+                        w.leaf(ram.TypeCode, "VAT")
+                        w.leaf(ram.BasisAmount, betrag(b.steuerbasisbetrag))
+                        w.leaf(ram.CategoryCode, b.kategorie)
+                        w.leaf(ram.RateApplicablePercent, zahl(b.satz))
+
+                for nz in nachlaesse_zuschlaege:
+                    with w.element(ram.SpecifiedTradeAllowanceCharge):
+                        with w.element(ram.ChargeIndicator):
+                            w.leaf(udt.Indicator, "true" if nz.zuschlag else "false")
+                        w.leaf(ram.ActualAmount, betrag(nz.betrag))
+                        if nz.grund:
+                            w.leaf(ram.Reason, nz.grund)
+                        _trade_tax(w, ram.CategoryTradeTax, nz.umsatzsteuer.kategorie, nz.umsatzsteuer.satz)
+
+                if r.dokument.faelligkeitsdatum and not minimum:
+                    with w.element(ram.SpecifiedTradePaymentTerms):
+                        _datum(w, ram.DueDateDateTime, r.dokument.faelligkeitsdatum)
+
+                with w.element(ram.SpecifiedTradeSettlementHeaderMonetarySummation):
+                    if not minimum:
+                        w.leaf(ram.LineTotalAmount, betrag(s.gesamt_netto))
+                        if s.summe_zuschlaege is not None:
+                            w.leaf(ram.ChargeTotalAmount, betrag(s.summe_zuschlaege))
+                        if s.summe_nachlaesse is not None:
+                            w.leaf(ram.AllowanceTotalAmount, betrag(s.summe_nachlaesse))
+                    steuerbasis = s.steuerbasis if s.steuerbasis is not None else s.gesamt_netto
+                    w.leaf(ram.TaxBasisTotalAmount, betrag(steuerbasis))
+                    w.leaf(ram.TaxTotalAmount, betrag(s.gesamt_umsatzsteuer), {"currencyID": waehrung})
+                    w.leaf(ram.GrandTotalAmount, betrag(s.gesamt_brutto))
+                    zahlbetrag = s.zahlbetrag if s.zahlbetrag is not None else s.gesamt_brutto
+                    w.leaf(ram.DuePayableAmount, betrag(zahlbetrag))
+
+                if r.dokument.vorherige_rechnungsnummer and not minimum:
+                    with w.element(ram.InvoiceReferencedDocument):
+                        w.leaf(ram.IssuerAssignedID, r.dokument.vorherige_rechnungsnummer)
+
+
+def serialize_zugferd(rechnung: Rechnung, pretty: bool = False, profil: str = DEFAULT_PROFILE) -> bytes:
+    return render(write_invoice, rechnung, profil, pretty=pretty)
+
+
+def write_zugferd_xml(rechnung: Rechnung, out_path: Path, pretty: bool = False, profil: str = DEFAULT_PROFILE) -> None:
+    out_path.write_bytes(serialize_zugferd(rechnung, pretty=pretty, profil=profil))
@@ -4,12 +4,23 @@ from PIL import Image
 import pytesseract
 from loguru import logger
 import os
+
+from app.infrastructure.ressourcen import pruefen, restzeit, stufe
+
 pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_PATH")
 
 def extract_image_text(input_path: Path) -> str:
     logger.info(f"OCR für Bild: {input_path}")
     with Image.open(str(input_path)) as img:
         img = img.convert("L")  # grayscale
-        text = pytesseract.image_to_string(img, lang="deu")
+        with stufe("ocr"):
+            pruefen()
+            rest = restzeit()
+            try:
+                # pytesseract kills Tesseract once the stage or job deadline is reached; None: no deadline
+                text = pytesseract.image_to_string(img, lang="deu", timeout=max(1.0, rest) if rest is not None else None)
+            except RuntimeError:
+                pruefen()
+                raise
         #print(text)
     return text
\ No newline at end of file
@@ -5,6 +5,8 @@ from loguru import logger
 import subprocess
 import shutil
 
+from app.infrastructure.ressourcen import Abgebrochen, prozess, stufe
+
 
 def _pdf_text(input_pdf: Path) -> str:
     text_parts = []
@@ -30,7 +32,10 @@ def _run_ocrmypdf(src: Path, dst: Path) -> None:
         str(dst),
     ]
     try:
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with stufe("ocr"):
+            res = prozess(cmd)
+        if res.returncode != 0:
+            raise subprocess.CalledProcessError(res.returncode, cmd, res.stdout, res.stderr)
     except Exception as e:
         logger.warning(f"OCRmyPDF fehlgeschlagen: {e}")
         raise
@@ -46,6 +51,9 @@ def extract_pdf_text(input_path: Path) -> str:
             try:
                 _run_ocrmypdf(input_path, ocr_pdf)
                 text = _pdf_text(ocr_pdf)
+            except Abgebrochen:
+                raise
             except Exception:
+                # Also after an OCR timeout: the embedded text is the partial result
                 logger.warning("OCR fehlgeschlagen, verwende ursprünglichen Text")
     return text
\ No newline at end of file
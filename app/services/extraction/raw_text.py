@@ -2,11 +2,6 @@ from pathlib import Path
 from typing import Union
 from loguru import logger
 
-from app.services.extraction.pdf_extractor import extract_pdf_text
-from app.services.extraction.image_ocr import extract_image_text
-from app.services.extraction.docx_extractor import extract_docx_text
-from app.services.extraction.xlsx_extractor import extract_xlsx_text
-
 
 SUPPORTED_IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".tiff", ".tif", ".heic"}
 
@@ -19,13 +14,22 @@ def extract_raw_text_to_file(input_path: Union[str, Path], dest_dir: Union[str,
     suffix = input_path.suffix.lower()
     logger.info(f"Extrahiere Rohtext aus {input_path} ({suffix})")
 
+    # Backends are imported per format so startup does not pay for all of them
     if suffix == ".pdf":
+        from app.services.extraction.pdf_extractor import extract_pdf_text
+
         text = extract_pdf_text(input_path)
     elif suffix in SUPPORTED_IMAGE_EXTS:
+        from app.services.extraction.image_ocr import extract_image_text
+
         text = extract_image_text(input_path)
     elif suffix == ".docx":
+        from app.services.extraction.docx_extractor import extract_docx_text
+
         text = extract_docx_text(input_path)
     elif suffix == ".xlsx":
+        from app.services.extraction.xlsx_extractor import extract_xlsx_text
+
         text = extract_xlsx_text(input_path)
     elif suffix in {".txt", ".csv"}:
         text = input_path.read_text(encoding="utf-8", errors="ignore")
@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Union
+
+from app.domain.rechnung.regeln import pruefe
+from app.services.ingest.einvoice import detect_einvoice, parse_einvoice
+from app.services.export.outputs import export_fingerprints, output_dir_for, render_outputs, write_outputs
+from app.services.export.zugferd.zugferd_writer import resolve_profile
+
+EINVOICE_SUFFIXES = {".xml", ".pdf"}
+# Re-exports skip the PDF unless it is asked for explicitly
+BULK_TARGETS = ("canonical_json", "xrechnung_xml", "zugferd_xml")
+
+
+def iter_einvoice_files(paths: Iterable[Union[str, Path]]) -> Iterator[Path]:
+    """Expand files and directories (recursively) into candidate e-invoice files."""
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from sorted(f for f in p.rglob("*") if f.is_file() and f.suffix.lower() in EINVOICE_SUFFIXES)
+        elif p.is_file():
+            yield p
+
+
+def validate_file(
+    path: Path,
+    export_root: Optional[Path] = None,
+    regelsaetze: Sequence[str] = (),
+    targets: Sequence[str] = BULK_TARGETS,
+    profil: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Parse, rule-check and optionally re-export one e-invoice. Never raises."""
+    result: Dict[str, Any] = {"datei": str(path), "format": None, "rechnungsnummer": None, "verstoesse": [], "fehler": None}
+    try:
+        found = detect_einvoice(path)
+        if found is None:
+            result["fehler"] = "Keine strukturierte E-Rechnung (UBL/CII) gefunden"
+            return result
+        fmt, source = found
+        rechnung = parse_einvoice(fmt, source)
+        result["format"] = fmt
+        result["rechnungsnummer"] = rechnung.dokument.rechnungsnummer
+        result["verstoesse"] = [asdict(v) for v in pruefe(rechnung, regelsaetze)]
+
+        if export_root is not None:
+            out_dir = output_dir_for(export_root, rechnung)
+            settings = {"zugferd_profil": resolve_profile(profil)}
+            outputs = render_outputs(rechnung, settings, targets)
+            write_outputs(
+                outputs,
+                out_dir,
+                fingerprints=export_fingerprints(rechnung, settings, outputs),
+                profil=settings["zugferd_profil"],
+            )
+            result["output_directory"] = str(out_dir.resolve())
+    except Exception as e:
+        result["fehler"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def bulk_validate(
+    paths: Iterable[Union[str, Path]],
+    export_root: Optional[Path] = None,
+    regelsaetze: Sequence[str] = (),
+    workers: Optional[int] = None,
+    chunksize: int = 32,
+    targets: Optional[Sequence[str]] = None,
+    profil: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Validate many e-invoices in a process pool, yielding one report per file in input order."""
+    files = list(iter_einvoice_files(paths))
+    task = partial(
+        validate_file,
+        export_root=export_root,
+        regelsaetze=tuple(regelsaetze),
+        targets=tuple(targets or BULK_TARGETS),
+        profil=profil,
+    )
+    if workers == 1 or len(files) <= 1:
+        yield from map(task, files)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(task, files, chunksize=chunksize)
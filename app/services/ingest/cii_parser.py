@@ -0,0 +1,152 @@
+from typing import Any, Dict, Optional
+from app.domain.rechnung_model import Rechnung
+from app.services.ingest.xml_reader import (
+    PAYMENT_MEANS, TYPE_CODES, XmlSource, assign_tax_id, empty_draft, iter_ends, set_path, text, to_date, to_float,
+)
+
+CII_NS = "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100"
+
+_LINE = "IncludedSupplyChainTradeLineItem"
+_TRANSACTION = "SupplyChainTradeTransaction/"
+
+_DOKUMENT = {
+    "ExchangedDocument/ID": ("dokument.rechnungsnummer", str),
+    "ExchangedDocument/IssueDateTime/DateTimeString": ("dokument.rechnungsdatum", to_date),
+    "ExchangedDocument/IssueDateTime": ("dokument.rechnungsdatum", to_date),
+    "ApplicableHeaderTradeSettlement/InvoiceCurrencyCode": ("dokument.waehrung", str),
+    "ApplicableHeaderTradeSettlement/SpecifiedTradePaymentTerms/DueDateDateTime/DateTimeString": ("dokument.faelligkeitsdatum", to_date),
+    "ApplicableHeaderTradeSettlement/InvoiceReferencedDocument/IssuerAssignedID": ("dokument.vorherige_rechnungsnummer", str),
+    "ApplicableHeaderTradeSettlement/SpecifiedTradeSettlementPaymentMeans/PayeePartyCreditorFinancialAccount/IBANID": ("zahlung.iban", str),
+    "ApplicableHeaderTradeSettlement/SpecifiedTradeSettlementPaymentMeans/PayeeSpecifiedCreditorFinancialInstitution/BICID": ("zahlung.bic", str),
+}
+
+_SUMMEN = {
+    "LineTotalAmount": "gesamt_netto",
+    "ChargeTotalAmount": "summe_zuschlaege",
+    "AllowanceTotalAmount": "summe_nachlaesse",
+    "TaxBasisTotalAmount": "steuerbasis",
+    "TaxTotalAmount": "gesamt_umsatzsteuer",
+    "GrandTotalAmount": "gesamt_brutto",
+    "DuePayableAmount": "zahlbetrag",
+}
+
+_PARTEI = {
+    "Name": "name",
+    "PostalTradeAddress/LineOne": "anschrift.strasse",
+    "PostalTradeAddress/PostcodeCode": "anschrift.plz",
+    "PostalTradeAddress/CityName": "anschrift.ort",
+    "PostalTradeAddress/CountryID": "anschrift.land",
+}
+_ROLLEN = {"SellerTradeParty": "verkaeufer", "BuyerTradeParty": "kaeufer"}
+
+_POSITION = {
+    "AssociatedDocumentLineDocument/LineID": ("positionsnummer", str),
+    "SpecifiedTradeProduct/Name": ("beschreibung", str),
+    "SpecifiedLineTradeAgreement/NetPriceProductTradePrice/ChargeAmount": ("einzelpreis_netto", to_float),
+    "SpecifiedLineTradeDelivery/BilledQuantity": ("menge", to_float),
+    "SpecifiedLineTradeSettlement/ApplicableTradeTax/CategoryCode": ("umsatzsteuer.kategorie", str),
+    "SpecifiedLineTradeSettlement/ApplicableTradeTax/RateApplicablePercent": ("umsatzsteuer.satz", to_float),
+    "SpecifiedLineTradeSettlement/SpecifiedTradeSettlementLineMonetarySummation/LineTotalAmount": ("positionsbetrag_netto", to_float),
+}
+# Gross price is only used when no net price is given
+_GROSS_PRICES = (
+    "SpecifiedLineTradeAgreement/GrossPriceProductTradePrice/ChargeAmount",
+    "GrossPriceProductTradePrice/ChargeAmount",
+)
+
+_STEUER = {
+    "CalculatedAmount": ("steuerbetrag", to_float),
+    "BasisAmount": ("steuerbasisbetrag", to_float),
+    "CategoryCode": ("kategorie", str),
+    "RateApplicablePercent": ("satz", to_float),
+}
+
+_NACHLASS_ZUSCHLAG = {
+    "ChargeIndicator/Indicator": ("zuschlag", lambda v: v.lower() == "true"),
+    "ActualAmount": ("betrag", to_float),
+    "Reason": ("grund", str),
+    "CategoryTradeTax/CategoryCode": ("umsatzsteuer.kategorie", str),
+    "CategoryTradeTax/RateApplicablePercent": ("umsatzsteuer.satz", to_float),
+}
+
+
+def parse_cii_draft(source: XmlSource) -> Dict[str, Any]:
+    """Stream a UN/CEFACT CII D16B CrossIndustryInvoice (ZUGFeRD / Factur-X) into a draft dict."""
+    draft = empty_draft()
+    position: Optional[Dict[str, Any]] = None
+    steuer: Optional[Dict[str, Any]] = None
+    nz: Optional[Dict[str, Any]] = None
+
+    for path, el in iter_ends(source, clear_at=(_LINE,)):
+        # Header trade blocks belong inside the transaction; older exports put them next to it
+        if path.startswith(_TRANSACTION):
+            path = path[len(_TRANSACTION):]
+        head, _, rest = path.partition("/")
+
+        if head == _LINE:
+            position = position if position is not None else {"umsatzsteuer": {}, "beschreibung": "", "einheit": ""}
+            if not rest:
+                nummer = position.get("positionsnummer")
+                position["positionsnummer"] = int(nummer) if isinstance(nummer, str) and nummer.isdigit() else len(draft["positionen"]) + 1
+                position.setdefault("einzelpreis_netto", position.pop("_brutto", 0.0))
+                draft["positionen"].append(position)
+                position = None
+            elif rest in _POSITION:
+                ziel, conv = _POSITION[rest]
+                set_path(position, ziel, conv(text(el)))
+                if rest == "SpecifiedLineTradeDelivery/BilledQuantity":
+                    position["einheit"] = el.get("unitCode", "")
+            elif rest in _GROSS_PRICES:
+                position["_brutto"] = to_float(text(el))
+            continue
+
+        if head == "ApplicableHeaderTradeAgreement":
+            rolle, _, feld = rest.partition("/")
+            if rolle in _ROLLEN:
+                partei = draft[_ROLLEN[rolle]]
+                if feld in _PARTEI:
+                    set_path(partei, _PARTEI[feld], text(el))
+                elif feld == "SpecifiedTaxRegistration/ID":
+                    assign_tax_id(partei, text(el), el.get("schemeID", ""))
+            continue
+
+        if head == "ApplicableHeaderTradeSettlement":
+            block, _, feld = rest.partition("/")
+            if block == "ApplicableTradeTax":
+                steuer = steuer if steuer is not None else {}
+                if not feld:
+                    draft.setdefault("umsatzsteuer_aufschluesselung", []).append(steuer)
+                    steuer = None
+                elif feld in _STEUER:
+                    ziel, conv = _STEUER[feld]
+                    steuer[ziel] = conv(text(el))
+                continue
+            if block == "SpecifiedTradeAllowanceCharge":
+                nz = nz if nz is not None else {"umsatzsteuer": {}}
+                if not feld:
+                    draft.setdefault("nachlaesse_zuschlaege", []).append(nz)
+                    nz = None
+                elif feld in _NACHLASS_ZUSCHLAG:
+                    ziel, conv = _NACHLASS_ZUSCHLAG[feld]
+                    set_path(nz, ziel, conv(text(el)))
+                continue
+            if block == "SpecifiedTradeSettlementHeaderMonetarySummation" and feld in _SUMMEN:
+                draft["summen"][_SUMMEN[feld]] = to_float(text(el))
+                continue
+            if rest == "SpecifiedTradeSettlementPaymentMeans/TypeCode":
+                draft["zahlung"]["zahlungsart"] = PAYMENT_MEANS.get(text(el), text(el))
+                continue
+
+        if path == "ExchangedDocument/TypeCode":
+            draft["dokument"]["rechnungsart"] = TYPE_CODES.get(text(el), "RECHNUNG")
+        elif path == "ExchangedDocument/IncludedNote/Content":
+            draft.setdefault("bemerkungen", []).append({"text": text(el)})
+        elif path in _DOKUMENT and text(el):
+            ziel, conv = _DOKUMENT[path]
+            set_path(draft, ziel, conv(text(el)))
+
+    return draft
+
+
+def parse_cii(source: XmlSource) -> Rechnung:
+    return Rechnung.model_validate(parse_cii_draft(source))
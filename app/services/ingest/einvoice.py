@@ -0,0 +1,76 @@
+from pathlib import Path
+from typing import Optional, Tuple, Union
+from loguru import logger
+from lxml import etree
+
+from app.domain.rechnung_model import Rechnung
+from app.services.ingest.xml_reader import XmlSource, root_tag
+from app.services.ingest.ubl_parser import UBL_CREDIT_NOTE_NS, UBL_INVOICE_NS, parse_ubl
+from app.infrastructure.engines import optional_import
+from app.services.ingest.cii_parser import CII_NS, parse_cii
+
+# Attachment names used by ZUGFeRD 1/2, Factur-X and XRechnung-in-PDF, checked first
+EMBEDDED_XML_NAMES = ("factur-x.xml", "zugferd-invoice.xml", "xrechnung.xml", "zugferd.xml")
+
+_ROOTS = {
+    f"{{{UBL_INVOICE_NS}}}Invoice": "ubl",
+    f"{{{UBL_CREDIT_NOTE_NS}}}CreditNote": "ubl",
+    f"{{{CII_NS}}}CrossIndustryInvoice": "cii",
+}
+
+
+def _xml_format(source: XmlSource) -> Optional[str]:
+    try:
+        return _ROOTS.get(root_tag(source))
+    except etree.XMLSyntaxError:
+        return None
+
+
+def _embedded_xml(pdf_path: Path) -> Optional[Tuple[str, bytes]]:
+    fitz = optional_import("fitz")  # PyMuPDF
+    if fitz is None:
+        logger.warning("PyMuPDF (pymupdf) not installed; cannot read PDF attachments.")
+        return None
+    with fitz.open(str(pdf_path)) as doc:
+        names = [n for n in doc.embfile_names() if n.lower().endswith(".xml")]
+        names.sort(key=lambda n: (n.lower() not in EMBEDDED_XML_NAMES, n))
+        for name in names:
+            data = doc.embfile_get(name)
+            fmt = _xml_format(data)
+            if fmt:
+                return fmt, data
+    return None
+
+
+def detect_einvoice(path: Union[str, Path]) -> Optional[Tuple[str, XmlSource]]:
+    """Return ``(format, source)`` if the file is or carries a structured e-invoice.
+
+    ``format`` is ``"ubl"`` (XRechnung UBL) or ``"cii"`` (ZUGFeRD / Factur-X /
+    XRechnung CII). Plain PDFs and other documents return None.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".xml":
+        fmt = _xml_format(path)
+        return (fmt, path) if fmt else None
+    if suffix == ".pdf":
+        return _embedded_xml(path)
+    return None
+
+
+def parse_einvoice(fmt: str, source: XmlSource) -> Rechnung:
+    if fmt == "ubl":
+        return parse_ubl(source)
+    if fmt == "cii":
+        return parse_cii(source)
+    raise ValueError(f"Unbekanntes E-Rechnungsformat: {fmt}")
+
+
+def read_einvoice(path: Union[str, Path]) -> Optional[Rechnung]:
+    """Parse a structured e-invoice directly into the model, without OCR or LLM."""
+    found = detect_einvoice(path)
+    if found is None:
+        return None
+    fmt, source = found
+    logger.info(f"Strukturierte E-Rechnung erkannt ({fmt.upper()}): {path}")
+    return parse_einvoice(fmt, source)
@@ -0,0 +1,151 @@
+from typing import Any, Dict, Optional
+from app.domain.rechnung_model import Rechnung
+from app.services.ingest.xml_reader import (
+    PAYMENT_MEANS, TYPE_CODES, XmlSource, assign_tax_id, empty_draft, iter_ends, set_path, text, to_date, to_float,
+)
+
+UBL_INVOICE_NS = "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+UBL_CREDIT_NOTE_NS = "urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2"
+
+_LINE_GROUPS = ("InvoiceLine", "CreditNoteLine")
+
+_DOKUMENT = {
+    "ID": ("dokument.rechnungsnummer", str),
+    "IssueDate": ("dokument.rechnungsdatum", to_date),
+    "DueDate": ("dokument.faelligkeitsdatum", to_date),
+    "PaymentMeans/PaymentDueDate": ("dokument.faelligkeitsdatum", to_date),
+    "DocumentCurrencyCode": ("dokument.waehrung", str),
+    "BillingReference/InvoiceDocumentReference/ID": ("dokument.vorherige_rechnungsnummer", str),
+    "PaymentMeans/PayeeFinancialAccount/ID": ("zahlung.iban", str),
+    "PaymentMeans/PayeeFinancialAccount/FinancialInstitutionBranch/ID": ("zahlung.bic", str),
+    "TaxTotal/TaxAmount": ("summen.gesamt_umsatzsteuer", to_float),
+    "LegalMonetaryTotal/LineExtensionAmount": ("summen.gesamt_netto", to_float),
+    "LegalMonetaryTotal/TaxExclusiveAmount": ("summen.steuerbasis", to_float),
+    "LegalMonetaryTotal/TaxInclusiveAmount": ("summen.gesamt_brutto", to_float),
+    "LegalMonetaryTotal/AllowanceTotalAmount": ("summen.summe_nachlaesse", to_float),
+    "LegalMonetaryTotal/ChargeTotalAmount": ("summen.summe_zuschlaege", to_float),
+    "LegalMonetaryTotal/PayableAmount": ("summen.zahlbetrag", to_float),
+}
+
+_PARTEI = {
+    "Party/PartyName/Name": "name",
+    "Party/PartyLegalEntity/RegistrationName": "name",
+    "Party/PostalAddress/StreetName": "anschrift.strasse",
+    "Party/PostalAddress/CityName": "anschrift.ort",
+    "Party/PostalAddress/PostalZone": "anschrift.plz",
+    "Party/PostalAddress/Country/IdentificationCode": "anschrift.land",
+}
+_ROLLEN = {"AccountingSupplierParty": "verkaeufer", "AccountingCustomerParty": "kaeufer"}
+
+_POSITION = {
+    "ID": ("positionsnummer", str),
+    "InvoicedQuantity": ("menge", to_float),
+    "CreditedQuantity": ("menge", to_float),
+    "LineExtensionAmount": ("positionsbetrag_netto", to_float),
+    "Item/Name": ("beschreibung", str),
+    "Item/ClassifiedTaxCategory/ID": ("umsatzsteuer.kategorie", str),
+    "Item/ClassifiedTaxCategory/Percent": ("umsatzsteuer.satz", to_float),
+    "Price/PriceAmount": ("einzelpreis_netto", to_float),
+}
+
+_STEUER = {
+    "TaxableAmount": ("steuerbasisbetrag", to_float),
+    "TaxAmount": ("steuerbetrag", to_float),
+    "TaxCategory/ID": ("kategorie", str),
+    "TaxCategory/Percent": ("satz", to_float),
+}
+
+_NACHLASS_ZUSCHLAG = {
+    "ChargeIndicator": ("zuschlag", lambda v: v.lower() == "true"),
+    "AllowanceChargeReason": ("grund", str),
+    "Amount": ("betrag", to_float),
+    "TaxCategory/ID": ("umsatzsteuer.kategorie", str),
+    "TaxCategory/Percent": ("umsatzsteuer.satz", to_float),
+}
+
+
+def _position_number(value: Any, index: int) -> int:
+    return int(value) if isinstance(value, str) and value.isdigit() else index
+
+
+def parse_ubl_draft(source: XmlSource) -> Dict[str, Any]:
+    """Stream a UBL 2.1 Invoice or CreditNote into a draft dict."""
+    draft = empty_draft()
+    position: Optional[Dict[str, Any]] = None
+    steuer: Optional[Dict[str, Any]] = None
+    nz: Optional[Dict[str, Any]] = None
+    steuer_id: Dict[str, str] = {}
+    tax_totals = 0
+
+    for path, el in iter_ends(source, clear_at=_LINE_GROUPS):
+        head, _, rest = path.partition("/")
+
+        if head in _LINE_GROUPS:
+            position = position if position is not None else {"umsatzsteuer": {}, "beschreibung": ""}
+            if not rest:
+                position["positionsnummer"] = _position_number(position.get("positionsnummer"), len(draft["positionen"]) + 1)
+                draft["positionen"].append(position)
+                position = None
+            elif rest in _POSITION:
+                ziel, conv = _POSITION[rest]
+                set_path(position, ziel, conv(text(el)))
+                if rest in ("InvoicedQuantity", "CreditedQuantity"):
+                    position["einheit"] = el.get("unitCode", "")
+            elif rest == "Item/Description" and not position["beschreibung"]:
+                position["beschreibung"] = text(el)
+            continue
+
+        if head in _ROLLEN:
+            partei = draft[_ROLLEN[head]]
+            if rest in _PARTEI:
+                if not (_PARTEI[rest] == "name" and partei["name"]):
+                    set_path(partei, _PARTEI[rest], text(el))
+            elif rest == "Party/PartyTaxScheme/CompanyID":
+                steuer_id["wert"] = text(el)
+            elif rest == "Party/PartyTaxScheme/TaxScheme/ID":
+                steuer_id["schema"] = text(el)
+            elif rest == "Party/PartyTaxScheme":
+                if steuer_id.get("wert"):
+                    assign_tax_id(partei, steuer_id["wert"], steuer_id.get("schema", ""))
+                steuer_id = {}
+            continue
+
+        if head == "TaxTotal":
+            if rest == "":
+                tax_totals += 1
+            elif tax_totals == 0 and rest.startswith("TaxSubtotal"):
+                sub = rest[len("TaxSubtotal/"):]
+                steuer = steuer if steuer is not None else {}
+                if rest == "TaxSubtotal":
+                    draft.setdefault("umsatzsteuer_aufschluesselung", []).append(steuer)
+                    steuer = None
+                elif sub in _STEUER:
+                    ziel, conv = _STEUER[sub]
+                    steuer[ziel] = conv(text(el))
+                continue
+
+        if head == "AllowanceCharge":
+            nz = nz if nz is not None else {"umsatzsteuer": {}}
+            if not rest:
+                draft.setdefault("nachlaesse_zuschlaege", []).append(nz)
+                nz = None
+            elif rest in _NACHLASS_ZUSCHLAG:
+                ziel, conv = _NACHLASS_ZUSCHLAG[rest]
+                set_path(nz, ziel, conv(text(el)))
+            continue
+
+        if path in ("InvoiceTypeCode", "CreditNoteTypeCode"):
+            draft["dokument"]["rechnungsart"] = TYPE_CODES.get(text(el), "GUTSCHRIFT" if path == "CreditNoteTypeCode" else "RECHNUNG")
+        elif path == "PaymentMeans/PaymentMeansCode":
+            draft["zahlung"]["zahlungsart"] = PAYMENT_MEANS.get(text(el), text(el))
+        elif path == "Note":
+            draft.setdefault("bemerkungen", []).append({"text": text(el)})
+        elif path in _DOKUMENT and (tax_totals == 0 or not path.startswith("TaxTotal")):
+            ziel, conv = _DOKUMENT[path]
+            set_path(draft, ziel, conv(text(el)))
+
+    return draft
+
+
+def parse_ubl(source: XmlSource) -> Rechnung:
+    return Rechnung.model_validate(parse_ubl_draft(source))
@@ -0,0 +1,108 @@
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Tuple, Union
+from datetime import date, datetime
+from lxml import etree
+
+XmlSource = Union[str, Path, bytes]
+
+
+def iter_ends(source: XmlSource, clear_at: Iterable[str] = ()) -> Iterator[Tuple[str, etree._Element]]:
+    """Stream ``(path, element)`` for every closed element of an XML document.
+
+    ``path`` is made of local names relative to the root (``""`` for the root
+    itself). Direct children of the root and elements named in ``clear_at`` are
+    cleared once handled, so memory stays flat even for very large invoices.
+    """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    elif isinstance(source, Path):
+        source = str(source)
+    clear_at = set(clear_at)
+    stack = []
+    for event, elem in etree.iterparse(
+        source, events=("start", "end"), resolve_entities=False, no_network=True, huge_tree=True
+    ):
+        if event == "start":
+            stack.append(etree.QName(elem).localname)
+            continue
+        yield "/".join(stack[1:]), elem
+        name = stack.pop()
+        if len(stack) == 1 or name in clear_at:
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+def root_tag(source: XmlSource) -> str:
+    """Return the qualified root tag without reading the whole document."""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    elif isinstance(source, Path):
+        source = str(source)
+    for _, elem in etree.iterparse(source, events=("start",), resolve_entities=False, no_network=True):
+        return elem.tag
+    return ""
+
+
+def set_path(target: Dict[str, Any], dotted: str, value: Any) -> None:
+    node = target
+    parts = dotted.split(".")
+    for part in parts[:-1]:
+        node = node.setdefault(part, {})
+    node[parts[-1]] = value
+
+
+def text(elem: etree._Element) -> str:
+    return (elem.text or "").strip()
+
+
+def to_float(value: str) -> float:
+    return float(value) if value else 0.0
+
+
+def to_date(value: str) -> date:
+    # CII format 102 (YYYYMMDD) or ISO 8601 as used by UBL
+    if len(value) == 8 and value.isdigit():
+        return datetime.strptime(value, "%Y%m%d").date()
+    return date.fromisoformat(value[:10])
+
+
+def empty_draft() -> Dict[str, Any]:
+    """Skeleton with every required Rechnung field, so sparse documents still load
+    and the business rules, not the model, report what is missing."""
+    partei = lambda: {"name": "", "anschrift": {"strasse": "", "plz": "", "ort": "", "land": "DE"}}
+    return {
+        "dokument": {"rechnungsnummer": "", "rechnungsart": "RECHNUNG", "waehrung": "EUR"},
+        "verkaeufer": partei(),
+        "kaeufer": partei(),
+        "positionen": [],
+        "summen": {"gesamt_netto": 0.0, "gesamt_umsatzsteuer": 0.0, "gesamt_brutto": 0.0},
+        "zahlung": {"zahlungsart": ""},
+    }
+
+
+def assign_tax_id(partei: Dict[str, Any], value: str, scheme: str) -> None:
+    # VAT ids (scheme VAT / VA, or a country prefix) vs. national tax numbers (FC)
+    if scheme in ("VAT", "VA") or (not scheme and value[:2].isalpha()):
+        partei["umsatzsteuer_id"] = value
+    else:
+        partei["steuernummer"] = value
+
+
+# UNTDID 4461 payment means codes → zahlungsart
+PAYMENT_MEANS = {
+    "10": "BAR",
+    "30": "UEBERWEISUNG",
+    "48": "KARTE",
+    "49": "LASTSCHRIFT",
+    "58": "SEPA",
+    "59": "LASTSCHRIFT",
+}
+
+# UNTDID 1001 document type codes → rechnungsart
+TYPE_CODES = {
+    "380": "RECHNUNG",
+    "381": "GUTSCHRIFT",
+    "326": "TEILRECHNUNG",
+}
@@ -0,0 +1,134 @@
+"""Model cascade: a small model first, the large model only when needed.
+
+The small model's draft is scored (schema completeness, printed vs. recomputed
+totals, mean token probability). Above the threshold it is accepted as is;
+on failure or low confidence the large model runs with the usual field repair.
+A draft without token probabilities scores 0 and is always escalated.
+"""
+import copy
+import json
+import math
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from app.domain.rechnung.berechnung import to_cents
+from app.domain.rechnung.regeln import Regelverletzung
+from app.domain.rechnung_model import Rechnung
+from app.infrastructure.ressourcen import Abgebrochen
+from app.services.llm.extractor import llm_extract_draft_json, llm_sitzung
+from app.services.llm.normalizer import validate_and_normalize
+from app.services.llm.repair import collect_errors, validate_with_repair
+
+DEFAULT_SCHWELLE = 0.85
+# Factors for the totals check; a printed total the lines do not add up to is a strong hint
+_SUMMEN_FAKTOR = {True: 1.0, None: 0.9, False: 0.3}
+
+
+@dataclass
+class Konfidenz:
+    wert: float
+    vollstaendig: bool
+    summen_stimmen: Optional[bool] = None
+    token_wahrscheinlichkeit: Optional[float] = None
+    fehler: List[str] = field(default_factory=list)
+
+
+def score_draft(
+    draft: Dict[str, Any],
+    logprobs: Sequence[float] = (),
+    regelsaetze: Sequence[str] = (),
+) -> Tuple[Optional[Rechnung], Konfidenz]:
+    """Score a draft without modifying it; returns the canonical invoice if it validates."""
+    try:
+        errors = collect_errors(draft, regelsaetze)
+    except Regelverletzung as e:
+        errors = [{"pfad": v.pfad, "meldung": v.meldung} for v in e.verstoesse]
+    if errors:
+        return None, Konfidenz(0.0, False, fehler=[f"{e['pfad']}: {e['meldung']}" for e in errors])
+
+    printed = (draft.get("summen") or {}).get("gesamt_brutto")
+    canonical = validate_and_normalize(copy.deepcopy(draft), regelsaetze)
+    summen_stimmen: Optional[bool] = None
+    try:
+        if printed not in (None, "", 0):
+            summen_stimmen = abs(to_cents(printed) - to_cents(canonical.summen.gesamt_brutto)) <= 1
+    except (TypeError, ValueError, ArithmeticError):
+        summen_stimmen = False
+
+    if not logprobs:
+        # The server sent no logprobs: nothing vouches for the draft, so the large model decides
+        return canonical, Konfidenz(0.0, True, summen_stimmen, fehler=["Keine Token-Wahrscheinlichkeiten"])
+    # Geometric mean of the token probabilities
+    token_p = math.exp(sum(logprobs) / len(logprobs))
+    wert = _SUMMEN_FAKTOR[summen_stimmen] * token_p
+    return canonical, Konfidenz(round(wert, 4), True, summen_stimmen, round(token_p, 4))
+
+
+def extract_with_cascade(
+    raw_text_path: Path,
+    settings: Dict[str, Any],
+    regelsaetze: Sequence[str] = (),
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    draft_path: Optional[Path] = None,
+    on_draft: Optional[Callable[[Dict[str, Any]], None]] = None,
+    resume_draft: Optional[Dict[str, Any]] = None,
+) -> Tuple[Rechnung, Dict[str, Any]]:
+    """Extract the invoice, returning ``(canonical, info)``.
+
+    ``settings["llm_small_model_path"]`` enables the cascade (empty: large
+    model only); ``settings["llm_kaskade_schwelle"]`` is the minimum
+    confidence for accepting the small model's result. Every draft is written
+    to ``draft_path`` as soon as it is extracted, before validation.
+
+    ``on_draft`` receives the large model's draft before field repair;
+    passing that draft back as ``resume_draft`` skips the extraction calls.
+    """
+    def keep(draft: Dict[str, Any]) -> None:
+        if draft_path is not None:
+            draft_path.write_text(json.dumps(draft, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    large = Path(settings.get("llm_model_path", "./models/model.gguf"))
+    clip = Path(settings.get("clip_model_path", "models/mmproj-F32.gguf"))
+    small_setting = settings.get("llm_small_model_path") or ""
+    small = Path(small_setting) if small_setting else None
+    schwelle = settings.get("llm_kaskade_schwelle")
+    schwelle = DEFAULT_SCHWELLE if schwelle is None else float(schwelle)
+
+    info: Dict[str, Any] = {"modell": large.name, "eskaliert": False, "konfidenz": None}
+    if resume_draft is not None:
+        logger.info("Setze mit gespeichertem Entwurf fort, überspringe Extraktion")
+        with llm_sitzung(large):
+            canonical = validate_with_repair(
+                resume_draft, raw_text_path=raw_text_path, model_path=large, regelsaetze=regelsaetze
+            )
+        return canonical, {**info, "fortgesetzt": True}
+    if small is not None and small.exists():
+        logprobs: List[float] = []
+        try:
+            draft = llm_extract_draft_json(raw_text_path, small, clip, on_field=on_field, logprobs=logprobs)
+            keep(draft)
+            canonical, konfidenz = score_draft(draft, logprobs, regelsaetze)
+        except Abgebrochen:
+            raise
+        except Exception as e:
+            # Includes a timeout of the small model: the large one gets its own deadline
+            canonical, konfidenz = None, Konfidenz(0.0, False, fehler=[f"{type(e).__name__}: {e}"])
+        if canonical is not None and konfidenz.wert >= schwelle:
+            logger.info(f"Kleines Modell übernommen ({small.name}, Konfidenz {konfidenz.wert:.2f})")
+            return canonical, {"modell": small.name, "eskaliert": False, "konfidenz": asdict(konfidenz)}
+        logger.info(f"Eskaliere zu {large.name}: Konfidenz {konfidenz.wert:.2f} < {schwelle:.2f} {konfidenz.fehler or ''}")
+        info.update(eskaliert=True, konfidenz_klein=asdict(konfidenz))
+    elif small is not None:
+        logger.warning(f"Kleines Modell nicht gefunden, verwende nur {large.name}: {small}")
+
+    # One server for extraction and all repair rounds
+    with llm_sitzung(large):
+        draft = llm_extract_draft_json(raw_text_path, large, clip, on_field=on_field)
+        keep(draft)
+        if on_draft is not None:
+            on_draft(draft)
+        canonical = validate_with_repair(draft, raw_text_path=raw_text_path, model_path=large, regelsaetze=regelsaetze)
+    return canonical, info
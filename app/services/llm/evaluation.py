@@ -0,0 +1,307 @@
+"""Accuracy vs. latency of the LLM extraction over a labelled corpus.
+
+A corpus is a directory of invoices, each with its gold ``canonical.json`` (the
+file the pipeline writes for an invoice): ``<name>.canonical.json`` next to the
+input, or ``canonical.json`` in the input's own folder. Every configuration
+(model or endpoint, prompt, threads) runs ``llm_extract_draft_json`` and
+``validate_and_normalize`` over the whole corpus, one invoice at a time so the
+timings are not disturbed. The raw text is extracted once and cached; only the
+LLM differs between configurations.
+
+Reported per configuration: field-level precision and recall, the share of
+invoices with correct totals, the JSON failure rate, latency and tokens/s.
+"""
+import copy
+import hashlib
+import json
+import math
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from app.domain.rechnung.berechnung import to_cents
+from app.domain.rechnung_model import Rechnung
+from app.services.extraction.raw_text import SUPPORTED_IMAGE_EXTS, extract_raw_text_to_file
+from app.services.llm.extractor import free_port, llm_extract_draft_json, start_llama_server, stop_llama_server
+from app.services.llm.normalizer import validate_and_normalize
+
+EINGABE_SUFFIXE = {".pdf", ".docx", ".xlsx", ".txt", ".csv"} | SUPPORTED_IMAGE_EXTS
+GOLD_SUFFIX = ".canonical.json"
+SUMMEN_FELDER = ("gesamt_netto", "gesamt_umsatzsteuer", "gesamt_brutto", "zahlbetrag")
+# Numbers closer than this count as equal (amounts are compared in cents)
+TOLERANZ = 0.005
+# Fields listed as weakest in the summary
+SCHWAECHSTE = 10
+
+
+@dataclass
+class Konfiguration:
+    """One setup under test: a GGUF started for the run or an already running endpoint."""
+
+    name: str
+    modell: Optional[str] = None
+    endpoint: Optional[str] = None
+    # Sent as "model"; llama.cpp ignores it, Ollama and vLLM need the served name
+    modellname: str = "local"
+    threads: int = 6
+    kontext: int = 4096
+    # File with a prompt template using the placeholders of PROMPT_TEMPLATE
+    prompt: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        if bool(self.modell) == bool(self.endpoint):
+            raise ValueError(f"Konfiguration {self.name}: genau eines von 'modell' und 'endpoint' angeben")
+
+
+def konfigurationen_laden(pfad: Path) -> List[Konfiguration]:
+    """Configurations from a JSON list of objects with the fields of :class:`Konfiguration`."""
+    daten = json.loads(Path(pfad).read_text(encoding="utf-8"))
+    if not isinstance(daten, list):
+        raise ValueError(f"{pfad}: JSON-Liste von Konfigurationen erwartet")
+    return [Konfiguration(**eintrag) for eintrag in daten]
+
+
+def korpus(root: Path) -> List[Tuple[Path, Path]]:
+    """``(input, gold)`` pairs below ``root``; inputs without a gold file are skipped."""
+    paare = []
+    for datei in sorted(Path(root).rglob("*")):
+        if not datei.is_file() or datei.suffix.lower() not in EINGABE_SUFFIXE:
+            continue
+        if any(teil.startswith(".") for teil in datei.relative_to(root).parts):
+            continue
+        gold = datei.with_name(datei.stem + GOLD_SUFFIX)
+        if not gold.exists():
+            gold = datei.parent / "canonical.json"
+        if gold.exists():
+            paare.append((datei, gold))
+        else:
+            logger.warning(f"Keine Soll-Daten für {datei}, übersprungen")
+    return paare
+
+
+def _rohtext(datei: Path, arbeit: Path) -> Path:
+    # Cached by content, so OCR runs once for all configurations and runs
+    ziel = arbeit / hashlib.sha256(datei.read_bytes()).hexdigest()
+    pfad = ziel / "raw_text.txt"
+    if not pfad.exists():
+        extract_raw_text_to_file(datei, ziel)
+    return pfad
+
+
+def felder(daten: Any, pfad: str = "") -> Dict[str, Any]:
+    """Non-empty leaves by path, e.g. ``positionen[0].menge``."""
+    if isinstance(daten, dict):
+        out: Dict[str, Any] = {}
+        for key, wert in daten.items():
+            out.update(felder(wert, f"{pfad}.{key}" if pfad else key))
+        return out
+    if isinstance(daten, list):
+        out = {}
+        for i, wert in enumerate(daten):
+            out.update(felder(wert, f"{pfad}[{i}]"))
+        return out
+    if daten is None or (isinstance(daten, str) and not daten.strip()):
+        return {}
+    return {pfad: daten}
+
+
+def _zahl(wert: Any) -> Optional[float]:
+    if isinstance(wert, bool):
+        return None
+    if isinstance(wert, (int, float)):
+        return float(wert)
+    try:
+        return float(str(wert).strip().replace(",", "."))
+    except ValueError:
+        return None
+
+
+def gleich(soll: Any, ist: Any) -> bool:
+    """Numbers within ``TOLERANZ``, text ignoring case and whitespace."""
+    a, b = _zahl(soll), _zahl(ist)
+    if a is not None and b is not None:
+        return abs(a - b) < TOLERANZ
+    return " ".join(str(soll).split()).casefold() == " ".join(str(ist).split()).casefold()
+
+
+def summen_korrekt(soll: Dict[str, Any], ist: Optional[Dict[str, Any]]) -> Optional[bool]:
+    """Whether every gold total matches to the cent; ``None`` without gold totals."""
+    soll_summen = soll.get("summen") or {}
+    namen = [n for n in SUMMEN_FELDER if soll_summen.get(n) is not None]
+    if not namen:
+        return None
+    ist_summen = (ist or {}).get("summen") or {}
+    try:
+        return all(ist_summen.get(n) is not None and to_cents(soll_summen[n]) == to_cents(ist_summen[n]) for n in namen)
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        return False
+
+
+def _generisch(pfad: str) -> str:
+    # positionen[3].menge -> positionen[].menge, for the per-field breakdown
+    teile = []
+    for teil in pfad.split("["):
+        teile.append(teil[teil.index("]"):] if "]" in teil else teil)
+    return "[".join(teile)
+
+
+def bewerte_rechnung(
+    rohtext: Path,
+    soll: Dict[str, Any],
+    konfig: Konfiguration,
+    endpoint: str,
+    prompt_template: Optional[str] = None,
+    regelsaetze: Sequence[str] = (),
+) -> Dict[str, Any]:
+    """Extract one invoice with ``konfig`` and compare it with the gold data."""
+    statistik: Dict[str, Any] = {}
+    ergebnis: Dict[str, Any] = {"json": False, "gueltig": False, "fehler": None}
+    start = time.perf_counter()
+    try:
+        draft = llm_extract_draft_json(
+            rohtext,
+            Path(konfig.modell or ""),
+            Path(""),
+            endpoint=endpoint,
+            model_name=konfig.modellname,
+            prompt_template=prompt_template,
+            statistik=statistik,
+        )
+    except Exception as e:
+        draft = None
+        ergebnis["fehler"] = f"{type(e).__name__}: {e}"
+    ergebnis["dauer_s"] = round(time.perf_counter() - start, 3)
+
+    ist: Optional[Dict[str, Any]] = None
+    if draft is not None:
+        # Scored after normalization, like the pipeline would store it; the
+        # recalculated draft when validation or the business rules fail
+        ergebnis["json"] = True
+        ist = copy.deepcopy(draft)
+        try:
+            ist = validate_and_normalize(ist, regelsaetze).model_dump(mode="json", exclude_none=True)
+            ergebnis["gueltig"] = True
+        except Exception as e:
+            ergebnis["fehler"] = f"{type(e).__name__}: {e}"
+
+    soll_felder, ist_felder = felder(soll), felder(ist or {})
+    richtig = sorted(p for p, wert in soll_felder.items() if p in ist_felder and gleich(wert, ist_felder[p]))
+    generierung = (statistik.get("dauer_s") or 0) - (statistik.get("erster_token_s") or 0)
+    ergebnis.update(
+        versuche=statistik.get("versuche", 0),
+        ungueltig=statistik.get("ungueltig", 0),
+        tokens=statistik.get("tokens", 0),
+        erster_token_s=statistik.get("erster_token_s"),
+        generierung_s=round(generierung, 3) if generierung > 0 else None,
+        soll_felder=sorted(soll_felder),
+        ist_felder=sorted(ist_felder),
+        richtig=richtig,
+        summen_korrekt=summen_korrekt(soll, ist),
+    )
+    return ergebnis
+
+
+def _perzentil(werte: List[float], p: float) -> Optional[float]:
+    werte = sorted(werte)
+    return round(werte[max(0, math.ceil(p * len(werte)) - 1)], 3) if werte else None
+
+
+def _quote(zaehler: int, nenner: int) -> Optional[float]:
+    return round(zaehler / nenner, 4) if nenner else None
+
+
+def zusammenfassen(ergebnisse: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aggregate metrics over the per-invoice results of one configuration."""
+    je_feld: Dict[str, List[int]] = {}
+    for r in ergebnisse:
+        for liste, index in ((r["soll_felder"], 0), (r["ist_felder"], 1), (r["richtig"], 2)):
+            for pfad in liste:
+                je_feld.setdefault(_generisch(pfad), [0, 0, 0])[index] += 1
+    soll = sum(len(r["soll_felder"]) for r in ergebnisse)
+    ist = sum(len(r["ist_felder"]) for r in ergebnisse)
+    richtig = sum(len(r["richtig"]) for r in ergebnisse)
+    praezision, recall = _quote(richtig, ist), _quote(richtig, soll)
+    summen = [r["summen_korrekt"] for r in ergebnisse if r["summen_korrekt"] is not None]
+    dauer = [r["dauer_s"] for r in ergebnisse if r["versuche"]]
+    erster = [r["erster_token_s"] for r in ergebnisse if r["erster_token_s"] is not None]
+    generierung = sum(r["generierung_s"] or 0 for r in ergebnisse)
+    schwaechste = sorted(
+        (
+            {"feld": feld, "soll": n_soll, "recall": _quote(n_richtig, n_soll), "praezision": _quote(n_richtig, n_ist)}
+            for feld, (n_soll, n_ist, n_richtig) in je_feld.items()
+            if n_soll
+        ),
+        key=lambda f: (f["recall"], -f["soll"]),
+    )[:SCHWAECHSTE]
+    return {
+        "rechnungen": len(ergebnisse),
+        "praezision": praezision,
+        "recall": recall,
+        "f1": round(2 * praezision * recall / (praezision + recall), 4) if praezision and recall else 0.0,
+        "summen_korrekt": _quote(sum(summen), len(summen)),
+        "gueltig": _quote(sum(r["gueltig"] for r in ergebnisse), len(ergebnisse)),
+        "json_fehlerquote": _quote(sum(r["ungueltig"] for r in ergebnisse), sum(r["versuche"] for r in ergebnisse)),
+        "ohne_json": sum(1 for r in ergebnisse if not r["json"]),
+        "latenz_s": {
+            "mittel": round(sum(dauer) / len(dauer), 3) if dauer else None,
+            "p50": _perzentil(dauer, 0.5),
+            "p95": _perzentil(dauer, 0.95),
+            "max": _perzentil(dauer, 1.0),
+        },
+        "erster_token_p50_s": _perzentil(erster, 0.5),
+        "tokens_pro_s": round(sum(r["tokens"] for r in ergebnisse if r["generierung_s"]) / generierung, 2)
+        if generierung
+        else None,
+        "schwaechste_felder": schwaechste,
+    }
+
+
+@contextmanager
+def _server(konfig: Konfiguration) -> Iterator[Tuple[str, Optional[float]]]:
+    # (endpoint, load time): a GGUF gets its own server with the configured threads for the run
+    if konfig.endpoint:
+        yield konfig.endpoint, None
+        return
+    modell = Path(konfig.modell)
+    if not modell.exists():
+        raise FileNotFoundError(f"LLM Modell nicht gefunden: {modell}")
+    port = free_port()
+    start = time.perf_counter()
+    process = start_llama_server(modell, port=port, n_threads=konfig.threads, ctx_size=konfig.kontext)
+    try:
+        yield f"http://127.0.0.1:{port}", round(time.perf_counter() - start, 2)
+    finally:
+        stop_llama_server(process)
+
+
+def evaluiere(
+    konfig: Konfiguration,
+    paare: List[Tuple[Path, Path]],
+    arbeit: Path,
+    regelsaetze: Sequence[str] = (),
+) -> Dict[str, Any]:
+    """Run one configuration over the corpus; summary plus the result per invoice."""
+    prompt_template = Path(konfig.prompt).read_text(encoding="utf-8") if konfig.prompt else None
+    rohtexte = [(datei, _rohtext(datei, arbeit), gold) for datei, gold in paare]
+    ergebnisse = []
+    with _server(konfig) as (endpoint, ladezeit):
+        logger.info(f"Konfiguration {konfig.name}: {len(paare)} Rechnungen über {endpoint}")
+        for datei, rohtext, gold in rohtexte:
+            soll = Rechnung.model_validate_json(gold.read_text(encoding="utf-8")).model_dump(mode="json", exclude_none=True)
+            ergebnis = bewerte_rechnung(rohtext, soll, konfig, endpoint, prompt_template, regelsaetze)
+            logger.info(
+                f"{konfig.name} {datei.name}: {len(ergebnis['richtig'])}/{len(ergebnis['soll_felder'])} Felder, "
+                f"{ergebnis['dauer_s']:.1f}s{', ' + ergebnis['fehler'] if ergebnis['fehler'] else ''}"
+            )
+            ergebnisse.append({"datei": str(datei), **ergebnis})
+    return {
+        "name": konfig.name,
+        "konfiguration": asdict(konfig),
+        "ladezeit_s": ladezeit,
+        **zusammenfassen(ergebnisse),
+        "ergebnisse": ergebnisse,
+    }
@@ -1,11 +1,8 @@
 from pathlib import Path
 import json
-from typing import Any, Dict, Union, List
+from typing import Any, Callable, Dict, Union, List, Optional
 from loguru import logger
-from llama_cpp import Llama
 import re
-from llama_cpp.llama_chat_format import Qwen25VLChatHandler
-from openai import OpenAI
 import os
 import subprocess
 import time
@@ -14,6 +11,11 @@ import signal
 import sys
 import socket
 import threading
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from app.infrastructure.ressourcen import Unterbrochen, bei_abbruch, pruefen, restzeit, stufe
+from app.services.llm.json_stream import JsonObjectStream, JsonStreamError
 
 SCHEMA_PATH = Path(__file__).resolve().parents[2] / "domain" / "rechnung" / "schema.json"
 """
@@ -234,8 +236,8 @@ def extract_json_from_text(text: str) -> Union[Dict, List, None]:
         # If JSON is malformed, return empty dict
         return {}
 
-def build_prompt(raw_text: str, schema_text: str) -> str:
-    return PROMPT_TEMPLATE.replace("<<< INSERT schema.json HERE >>>", schema_text).replace(
+def build_prompt(raw_text: str, schema_text: str, template: Optional[str] = None) -> str:
+    return (template or PROMPT_TEMPLATE).replace("<<< INSERT schema.json HERE >>>", schema_text).replace(
         "<<< INSERT RAW TEXT HERE >>>", raw_text
     )
 
@@ -245,6 +247,8 @@ def call_llm_via_openai(prompt: str, system_prompt: str, schema_text: Dict, mode
     api_key = os.getenv("AI_API_KEY")
     if not api_key:
         raise ValueError("AI_API_KEY environment variable not set")
+    from openai import OpenAI
+
     client = OpenAI(
         base_url=base_url,
         api_key=api_key,
@@ -330,9 +334,11 @@ def start_llama_server(model_path, port=7001, n_threads=6, ctx_size=4096):
     print(process)
     return process
 
-def call_llama(prompt, port=7001):
+def _chat_payload(
+    prompt: str, stream: bool = False, max_tokens: int = 4096, logprobs: bool = False, model: str = "local"
+) -> Dict[str, Any]:
     payload = {
-        "model": "local",
+        "model": model,
         "messages": [
             {
                 "role": "system",
@@ -345,18 +351,99 @@ def call_llama(prompt, port=7001):
             {"role": "user", "content": prompt},
         ],
         "temperature": 0.7,
-        "max_tokens": 4096,
+        "max_tokens": max_tokens,
+        "stream": stream,
     }
+    if logprobs:
+        payload["logprobs"] = True
+    return payload
+
+
+def _read_timeout() -> float:
+    # Bounded by the llm stage and job deadlines; 3600 s outside of any job
+    pruefen()
+    rest = restzeit()
+    return max(1.0, rest) if rest is not None else 3600
+
+
+def call_llama_stream(
+    prompt: str,
+    port: int = 7001,
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    max_tokens: int = 4096,
+    logprobs: Optional[List[float]] = None,
+    endpoint: Optional[str] = None,
+    model_name: str = "local",
+    statistik: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Stream a chat completion and parse it incrementally.
+
+    The connection is closed as soon as the top-level JSON object is complete,
+    which makes the llama server abort the generation instead of decoding up to
+    ``max_tokens``. Structurally invalid output raises ``JsonStreamError`` at the
+    first offending token. If a ``logprobs`` list is given, the log-probability
+    of every generated token is appended to it (when the server reports them).
+
+    Cancelling the job or reaching the llm deadline closes the connection as
+    well; the raised ``Unterbrochen`` carries the fields streamed so far.
+
+    ``endpoint`` (base URL of any OpenAI-compatible server) replaces the local
+    server on ``port``. A ``statistik`` dict receives the generated tokens, the
+    time to the first token and the duration of the call.
+    """
+    parser = JsonObjectStream(on_field=on_field)
+    start = time.perf_counter()
+    erster_token: Optional[float] = None
+    tokens = 0
+    try:
+        with requests.post(
+            f"{(endpoint or f'http://127.0.0.1:{port}').rstrip('/')}/v1/chat/completions",
+            json=_chat_payload(
+                prompt, stream=True, max_tokens=max_tokens, logprobs=logprobs is not None, model=model_name
+            ),
+            stream=True,
+            timeout=(10, _read_timeout()),
+        ) as r, bei_abbruch(r.close):
+            r.raise_for_status()
+            for line in r.iter_lines(decode_unicode=True):
+                pruefen()
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                if logprobs is not None:
+                    lp_tokens = (choices[0].get("logprobs") or {}).get("content") or []
+                    logprobs.extend(t["logprob"] for t in lp_tokens if t.get("logprob") is not None)
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    # llama.cpp streams one token per chunk
+                    tokens += 1
+                    if erster_token is None:
+                        erster_token = time.perf_counter() - start
+                if delta and parser.feed(delta):
+                    logger.info("JSON-Objekt vollständig, Generierung wird abgebrochen")
+                    break
+    except Exception as e:
+        unterbrochen = e if isinstance(e, Unterbrochen) else None
+        if unterbrochen is None:
+            # A connection closed by a cancellation or a read timeout at the deadline
+            try:
+                pruefen()
+            except Unterbrochen as u:
+                unterbrochen = u
+        if unterbrochen is None:
+            raise
+        unterbrochen.teilergebnis.setdefault("felder", dict(parser.fields))
+        raise unterbrochen from (None if unterbrochen is e else e)
+    finally:
+        if statistik is not None:
+            statistik.update(tokens=tokens, erster_token_s=erster_token, dauer_s=time.perf_counter() - start)
+    if not parser.done:
+        raise JsonStreamError(f"Antwort endete vor Abschluss des JSON-Objekts:\n{parser.text}")
+    return parser.result
 
-    r = requests.post(
-        f"http://127.0.0.1:{port}/v1/chat/completions",
-        json=payload,
-        timeout=3600,
-    )
-    r.raise_for_status()
-    response = r.json()
-    print(response)
-    return response["choices"][0]["message"]["content"]
 
 def stop_llama_server(process):
     process.terminate()
@@ -366,59 +453,179 @@ def stop_llama_server(process):
         process.kill()
 
 
-def llm_extract_draft_json(raw_text_path: Path, model_path: Path, clip_model_path: Path) -> Dict[str, Any]:
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Servers kept alive between requests: resolved model path -> (process, port)
+_warm_servers: Dict[Path, Any] = {}
+_warm_lock = threading.Lock()
+
+
+def warm_llama_server(model_path: Path) -> int:
+    """Start a persistent server for ``model_path`` (once) and return its port."""
+    key = Path(model_path).resolve()
+    if not key.exists():
+        raise FileNotFoundError(f"LLM Modell nicht gefunden: {model_path}")
+    with _warm_lock:
+        entry = _warm_servers.get(key)
+        if entry is not None and entry[0].poll() is None:
+            return entry[1]
+        port = free_port()
+        _warm_servers[key] = (start_llama_server(key, port=port), port)
+        return port
+
+
+def stop_warm_servers() -> None:
+    """Stop all servers started by :func:`warm_llama_server`."""
+    with _warm_lock:
+        for process, _port in _warm_servers.values():
+            stop_llama_server(process)
+        _warm_servers.clear()
+
+
+@contextmanager
+def llama_server(model_path: Path):
+    """Yield the port of a server for ``model_path``.
+
+    A warm server is reused as is; otherwise a server is started on a free
+    port for the duration of the block and stopped afterwards. Either way the
+    block holds an "llm" slot, so concurrent jobs cannot start unbounded servers.
+    """
+    with stufe("llm"):
+        with _warm_lock:
+            entry = _warm_servers.get(Path(model_path).resolve())
+        if entry is not None and entry[0].poll() is None:
+            yield entry[1]
+            return
+        port = free_port()
+        process = start_llama_server(model_path, port=port)
+        try:
+            yield port
+        finally:
+            stop_llama_server(process)
+
+
+class _Sitzung:
+    def __init__(self, model_path: Path) -> None:
+        self.modell = Path(model_path).resolve()
+        self.url: Optional[str] = None
+        self.stack = ExitStack()
+
+
+_sitzung: ContextVar[Optional[_Sitzung]] = ContextVar("llm_sitzung", default=None)
+
+
+@contextmanager
+def llm_sitzung(model_path: Path):
+    """Share one server (and llm slot) for ``model_path`` between the calls in the block.
+
+    Extraction and field repair then load the model once, and the server can
+    reuse the prompt prefix it has already processed. The server is started on
+    the first call only, so a block that needs no LLM costs nothing.
+    """
+    aktiv = _sitzung.get()
+    if aktiv is not None and aktiv.modell == Path(model_path).resolve():
+        yield
+        return
+    sitzung = _Sitzung(model_path)
+    token = _sitzung.set(sitzung)
+    try:
+        with sitzung.stack:
+            yield
+    finally:
+        _sitzung.reset(token)
+
+
+@contextmanager
+def _llm_endpoint(model_path: Path, endpoint: Optional[str] = None):
+    # An external server only needs the llm slot; otherwise the session's or a (warm) local server
+    if endpoint is not None:
+        with stufe("llm"):
+            yield endpoint
+        return
+    sitzung = _sitzung.get()
+    if sitzung is not None and sitzung.modell == Path(model_path).resolve():
+        if sitzung.url is None:
+            sitzung.url = f"http://127.0.0.1:{sitzung.stack.enter_context(llama_server(model_path))}"
+        yield sitzung.url
+        return
+    with llama_server(model_path) as port:
+        yield f"http://127.0.0.1:{port}"
+
+
+def llm_extract_draft_json(
+    raw_text_path: Path,
+    model_path: Path,
+    clip_model_path: Path,
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    max_attempts: int = 3,
+    logprobs: Optional[List[float]] = None,
+    endpoint: Optional[str] = None,
+    model_name: str = "local",
+    prompt_template: Optional[str] = None,
+    statistik: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Run the LLM over the raw text and return the draft invoice JSON.
+
+    ``on_field`` is called with every top-level field as soon as it has been
+    streamed completely, e.g. to show partial results in the UI. Malformed
+    output is detected while streaming and retried up to ``max_attempts`` times.
+    ``logprobs`` collects the token log-probabilities of the accepted attempt.
+
+    With ``endpoint`` an already running OpenAI-compatible server is used
+    instead of starting one for ``model_path``; ``prompt_template`` replaces
+    ``PROMPT_TEMPLATE``. ``statistik`` receives the number of attempts, the
+    invalid ones and the timing of the last (see :func:`call_llama_stream`).
+    """
     logger.info("Starte LLM für strukturierte JSON-Extraktion")
     schema_text = SCHEMA_PATH.read_text(encoding="utf-8")
     raw_text = Path(raw_text_path).read_text(encoding="utf-8", errors="ignore")
-    prompt = build_prompt(raw_text, schema_text)
+    prompt = build_prompt(raw_text, schema_text, prompt_template)
     
-    if not model_path.exists():
+    if endpoint is None and not model_path.exists():
         raise FileNotFoundError(f"LLM Modell nicht gefunden: {model_path}")
+    if statistik is not None:
+        statistik.update(versuche=0, ungueltig=0)
 
-    #chat_handler = Qwen25VLChatHandler(clip_model_path=str(clip_model_path))
-    #llm = Llama(model_path=str(model_path), chat_handler=chat_handler, n_ctx=4096)
-    
-    #llm = Llama(model_path=str(model_path), n_ctx=4096)
-    process = start_llama_server(model_path)
-    print("start of prompt")
-    #output = llm.create_completion(prompt=prompt, temperature=0.7, max_tokens=4096)
-    """
-    output = llm.create_chat_completion(
-        messages=[
-            {"role": "system", "content": "Du bist ein Parser für deutsche Rechnungen, der das Ergebnis in strukturiertem JSON liefert.."},
-            {"role": "user", "content": prompt},
-        ],
-        response_format={
-            "type": "json_object",
-            "schema": schema_text,
-        },
-        temperature=0.7,
-        max_tokens=4096,
-    )
+    with _llm_endpoint(model_path, endpoint) as url:
+        try:
+            last_error: Optional[Exception] = None
+            for attempt in range(1, max_attempts + 1):
+                if logprobs is not None:
+                    logprobs.clear()
+                if statistik is not None:
+                    statistik["versuche"] = attempt
+                try:
+                    return call_llama_stream(
+                        prompt, endpoint=url, on_field=on_field, logprobs=logprobs, model_name=model_name, statistik=statistik
+                    )
+                except JsonStreamError as e:
+                    last_error = e
+                    if statistik is not None:
+                        statistik["ungueltig"] += 1
+                    logger.warning(f"Ungültiges JSON im Stream (Versuch {attempt}/{max_attempts}): {e}")
+            raise ValueError(f"LLM lieferte kein valides JSON:\n {last_error}")
+        except requests.RequestException as e:
+            raise ValueError(f"LLM lieferte kein valides JSON:\n {e}")
+
+
+def llm_complete_json(prompt: str, model_path: Path, max_tokens: int = 512, max_attempts: int = 2) -> Dict[str, Any]:
+    """Run a single short JSON completion, e.g. for the field repair prompt.
+
+    Inside :func:`llm_sitzung` the session's server is reused.
     """
-    #text = output["choices"][0]["text"].strip()
-    #text = clean_json_string(text)
-    #text = extract_json_from_text(text)
-    #text = call_llm_via_openai(prompt, "Du bist ein Parser für deutsche Rechnungen, der das Ergebnis in strukturiertem JSON liefert..", json.dumps(schema_text),)
-    try:
-        text = call_llama(prompt)
-    except Exception as e:
-        raise ValueError(f"LLM lieferte kein valides JSON:\n {e}")
-    finally:
-        stop_llama_server(process)
-    print(text)
-    # Ensure it's valid JSON only
-    try:
-        data = extract_json_from_text(text)
-        data = json.loads(text)
-        #print(data)
-    except Exception as e:
-        # Attempt to locate JSON substring
-        start = text.find("{")
-        end = text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            possible = text[start : end + 1]
-            data = json.loads(possible)
-        else:
-            raise ValueError(f"LLM lieferte kein valides JSON:\n {e}\n{text}")
-    return data
\ No newline at end of file
+    if not model_path.exists():
+        raise FileNotFoundError(f"LLM Modell nicht gefunden: {model_path}")
+
+    with _llm_endpoint(model_path) as url:
+        last_error: Optional[Exception] = None
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return call_llama_stream(prompt, endpoint=url, max_tokens=max_tokens)
+            except JsonStreamError as e:
+                last_error = e
+                logger.warning(f"Ungültiges JSON im Stream (Versuch {attempt}/{max_attempts}): {e}")
+        raise ValueError(f"LLM lieferte kein valides JSON:\n {last_error}")
@@ -0,0 +1,171 @@
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+
+_WS = " \t\r\n"
+_LITERAL_START = "-0123456789tfn"
+_LITERAL_CHARS = set("0123456789+-.eEtrualsn")
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?\Z")
+
+
+class JsonStreamError(ValueError):
+    """Raised as soon as the streamed text can no longer become a valid JSON object."""
+
+
+class _Frame:
+    __slots__ = ("kind", "expect", "empty_ok", "key", "value_start")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.expect = "key" if kind == "{" else "value"
+        self.empty_ok = True
+        self.key: Optional[str] = None
+        self.value_start = -1
+
+
+class JsonObjectStream:
+    """Incremental parser for the first top-level JSON object in a token stream.
+
+    Chunks are fed as they arrive from the model. The parser tracks the
+    structure character by character, so it knows the exact moment the
+    top-level object is closed (generation can be cancelled right there) and
+    raises ``JsonStreamError`` on the first character that makes the output
+    invalid. Every completed top-level field is reported to ``on_field``.
+    """
+
+    def __init__(self, on_field: Optional[Callable[[str, Any], None]] = None, max_preamble: int = 512):
+        self.on_field = on_field
+        self.max_preamble = max_preamble
+        self.done = False
+        self.result: Optional[Dict[str, Any]] = None
+        self.fields: Dict[str, Any] = {}
+        self._text = ""
+        self._stack: List[_Frame] = []
+        self._root_start = -1
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._literal_start = -1
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk; returns True once the top-level object is complete."""
+        if self.done or not chunk:
+            return self.done
+        start = len(self._text)
+        self._text += chunk
+        for i in range(start, len(self._text)):
+            self._step(self._text[i], i)
+            if self.done:
+                self._text = self._text[: i + 1]
+                break
+        return self.done
+
+    def _fail(self, i: int, reason: str) -> None:
+        context = self._text[max(0, i - 40): i + 1]
+        raise JsonStreamError(f"{reason} an Position {i}: ...{context!r}")
+
+    def _step(self, ch: str, i: int) -> None:
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                self._end_string(i)
+            return
+
+        if self._literal_start >= 0:
+            if ch in _LITERAL_CHARS:
+                return
+            self._end_literal(i)
+
+        if not self._stack:
+            if ch == "{":
+                self._root_start = i
+                self._stack.append(_Frame("{"))
+            elif i >= self.max_preamble:
+                self._fail(i, "Kein JSON-Objekt am Anfang der Antwort")
+            return
+
+        if ch in _WS:
+            return
+
+        frame = self._stack[-1]
+        close = "}" if frame.kind == "{" else "]"
+        if frame.expect == "key":
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == "}" and frame.empty_ok:
+                self._close(i)
+            else:
+                self._fail(i, "Schlüssel erwartet")
+        elif frame.expect == "colon":
+            if ch != ":":
+                self._fail(i, "':' erwartet")
+            frame.expect = "value"
+        elif frame.expect == "value":
+            if ch == "]" and frame.kind == "[" and frame.empty_ok:
+                self._close(i)
+            else:
+                self._begin_value(ch, i)
+        else:  # comma
+            if ch == ",":
+                frame.expect = "key" if frame.kind == "{" else "value"
+                frame.empty_ok = False
+            elif ch == close:
+                self._close(i)
+            else:
+                self._fail(i, f"',' oder '{close}' erwartet")
+
+    def _begin_value(self, ch: str, i: int) -> None:
+        frame = self._stack[-1]
+        frame.value_start = i
+        if ch in "{[":
+            self._stack.append(_Frame(ch))
+        elif ch == '"':
+            self._in_string = True
+            self._string_start = i
+        elif ch in _LITERAL_START:
+            self._literal_start = i
+        else:
+            self._fail(i, "Wert erwartet")
+
+    def _end_string(self, i: int) -> None:
+        frame = self._stack[-1]
+        if frame.expect == "key":
+            if len(self._stack) == 1:
+                frame.key = json.loads(self._text[self._string_start: i + 1], strict=False)
+            frame.expect = "colon"
+        else:
+            self._value_done(i + 1)
+
+    def _end_literal(self, i: int) -> None:
+        literal = self._text[self._literal_start: i]
+        self._literal_start = -1
+        if literal not in ("true", "false", "null") and not _NUMBER_RE.match(literal):
+            self._fail(i, f"Ungültiges Literal {literal!r}")
+        self._value_done(i)
+
+    def _close(self, i: int) -> None:
+        self._stack.pop()
+        if not self._stack:
+            self.result = json.loads(self._text[self._root_start: i + 1], strict=False)
+            self.done = True
+            return
+        self._value_done(i + 1)
+
+    def _value_done(self, end: int) -> None:
+        frame = self._stack[-1]
+        frame.expect = "comma"
+        if len(self._stack) == 1 and frame.key is not None:
+            value = json.loads(self._text[frame.value_start: end], strict=False)
+            self.fields[frame.key] = value
+            if self.on_field is not None:
+                self.on_field(frame.key, value)
@@ -0,0 +1,166 @@
+from pathlib import Path
+import copy
+import json
+from typing import Any, Dict, List, Sequence, Union
+from loguru import logger
+from pydantic import ValidationError
+
+from app.domain.rechnung.berechnung import to_decimal
+from app.domain.rechnung_model import Rechnung
+from app.domain.rechnung.regeln import Regelverletzung
+from app.services.llm.extractor import SCHEMA_PATH, llm_complete_json
+from app.services.llm.normalizer import validate_and_normalize
+
+
+# The text comes first and the fields last: a later round shares the whole prefix
+# with the previous one, which the server of the session does not process again
+REPAIR_PROMPT_TEMPLATE = (
+    "Du korrigierst einzelne Felder einer bereits extrahierten deutschen Rechnung.\n\n"
+    "RECHNUNGSTEXT:\n"
+    "<<< INSERT RAW TEXT HERE >>>\n\n"
+    "REGELN:\n"
+    "- Gib ausschließlich ein JSON-Objekt zurück, dessen Schlüssel GENAU die unten genannten Pfade sind.\n"
+    "- Der Wert ist der korrigierte Feldinhalt gemäß Schema (bei Objekten das vollständige Objekt).\n"
+    "- Datumsangaben im Format TT.MM.JJJJ.\n"
+    "- Erfinde keine Daten.\n\n"
+    "Die folgenden Felder sind fehlerhaft oder fehlen:\n"
+    "<<< INSERT FIELDS HERE >>>\n"
+)
+
+# Fields the normalizer does arithmetic with before pydantic ever sees them, per list
+_NUMERIC_FIELDS = {
+    "positionen": ("menge", "einzelpreis_netto", "umsatzsteuer.satz"),
+    "nachlaesse_zuschlaege": ("betrag", "umsatzsteuer.satz"),
+}
+
+_COMPUTED_PREFIXES = ("summen", "umsatzsteuer_aufschluesselung")
+
+FieldPath = List[Union[str, int]]
+
+
+def _path_str(loc: FieldPath) -> str:
+    return ".".join(str(p) for p in loc)
+
+
+def _parse_path(path: str) -> FieldPath:
+    return [int(p) if p.isdigit() else p for p in path.split(".")]
+
+
+def _get_path(draft: Dict[str, Any], path: str) -> Any:
+    node: Any = draft
+    for part in _parse_path(path):
+        try:
+            node = node[part]
+        except (IndexError, KeyError, TypeError):
+            return None
+    return node
+
+
+def _keine_zahl(wert: Any) -> bool:
+    # Same conversion as the cent arithmetic; a missing value counts as 0 there
+    try:
+        return not to_decimal(wert).is_finite()
+    except (TypeError, ValueError):
+        return True
+
+
+def collect_errors(draft: Dict[str, Any], regelsaetze: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """Return all field-level errors of a draft without modifying it.
+
+    Each error is ``{"pfad": "dokument.rechnungsdatum", "meldung": ..., "wert": ...}``.
+    """
+    errors: List[Dict[str, Any]] = []
+    for liste, felder in _NUMERIC_FIELDS.items():
+        eintraege = draft.get(liste) or []
+        for i, eintrag in enumerate(eintraege if isinstance(eintraege, list) else []):
+            for feld in felder:
+                pfad = f"{liste}.{i}.{feld}"
+                wert = _get_path(draft, pfad)
+                if _keine_zahl(wert):
+                    errors.append({"pfad": pfad, "meldung": "Keine Zahl", "wert": wert})
+    if errors:
+        return errors
+
+    try:
+        validate_and_normalize(copy.deepcopy(draft), regelsaetze)
+    except ValidationError as e:
+        for err in e.errors():
+            wert = None if err["type"] == "missing" else err.get("input")
+            errors.append({"pfad": _path_str(list(err["loc"])), "meldung": err["msg"], "wert": wert})
+    except Regelverletzung as e:
+        # Totals are recomputed, so only rules on extracted fields can be repaired
+        for v in e.verstoesse:
+            if v.pfad and not v.pfad.startswith(_COMPUTED_PREFIXES):
+                errors.append({"pfad": v.pfad, "meldung": f"{v.regel}: {v.meldung}", "wert": _get_path(draft, v.pfad)})
+        if not errors:
+            raise
+    return errors
+
+
+def _sub_schema(schema: Dict[str, Any], path: FieldPath) -> Dict[str, Any]:
+    node = schema
+    for part in path:
+        if isinstance(part, int):
+            node = node.get("items", {})
+        else:
+            node = node.get("properties", {}).get(part, {})
+    return node
+
+
+def build_repair_prompt(raw_text: str, errors: List[Dict[str, Any]], schema: Dict[str, Any]) -> str:
+    lines = []
+    for err in errors:
+        sub = json.dumps(_sub_schema(schema, _parse_path(err["pfad"])), ensure_ascii=False)
+        wert = json.dumps(err.get("wert"), ensure_ascii=False, default=str)
+        lines.append(f"- {err['pfad']}: {err['meldung']} (bisher: {wert}; Schema: {sub})")
+    return REPAIR_PROMPT_TEMPLATE.replace("<<< INSERT FIELDS HERE >>>", "\n".join(lines)).replace(
+        "<<< INSERT RAW TEXT HERE >>>", raw_text
+    )
+
+
+def merge_fields(draft: Dict[str, Any], answers: Dict[str, Any]) -> None:
+    """Write the repaired values back into the draft at their dotted paths."""
+    for path, value in answers.items():
+        parts = _parse_path(path)
+        node: Any = draft
+        try:
+            for part, nxt in zip(parts, parts[1:]):
+                if isinstance(node, dict) and not isinstance(node.get(part), (dict, list)):
+                    node[part] = [] if isinstance(nxt, int) else {}
+                node = node[part]
+            node[parts[-1]] = value
+        except (IndexError, KeyError, TypeError):
+            logger.warning(f"Korrektur für unbekannten Pfad verworfen: {path}")
+
+
+def validate_with_repair(
+    draft: Dict[str, Any],
+    raw_text_path: Path,
+    model_path: Path,
+    max_rounds: int = 2,
+    regelsaetze: Sequence[str] = (),
+) -> Rechnung:
+    """Validate the draft; on field errors ask the LLM only for the failing paths.
+
+    The raw text and the draft from the full extraction are reused, so a repair
+    round costs one short completion instead of a complete re-extraction. Run
+    inside ``llm_sitzung`` (as the cascade does) the rounds reuse the
+    extraction's server instead of loading the model again.
+    """
+    schema = json.loads(SCHEMA_PATH.read_text(encoding="utf-8"))
+    raw_text = ""
+    for round_ in range(max_rounds + 1):
+        errors = collect_errors(draft, regelsaetze)
+        if not errors:
+            return validate_and_normalize(draft, regelsaetze)
+        if round_ == max_rounds:
+            break
+        logger.info(f"Korrigiere {len(errors)} Feld(er) per LLM (Runde {round_ + 1}/{max_rounds}): "
+                    f"{', '.join(e['pfad'] for e in errors)}")
+        raw_text = raw_text or Path(raw_text_path).read_text(encoding="utf-8", errors="ignore")
+        answers = llm_complete_json(build_repair_prompt(raw_text, errors, schema), model_path)
+        requested = {e["pfad"] for e in errors}
+        merge_fields(draft, {p: v for p, v in answers.items() if p in requested})
+
+    details = "; ".join(f"{e['pfad']}: {e['meldung']}" for e in errors)
+    raise ValueError(f"Validierung fehlgeschlagen nach {max_rounds} Korrekturrunde(n): {details}")
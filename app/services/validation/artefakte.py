@@ -0,0 +1,104 @@
+"""Download the official validation artefacts into ``resources/validation``.
+
+The schemas and rules are not shipped with the repository (size and
+licences). Every source is a release archive; the needed files are found by
+name inside it, so the layout of the archive does not matter. The XSDs are
+copied with all files of their folder, because they import each other by
+relative path.
+"""
+import io
+import shutil
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, NamedTuple, Optional
+
+import requests
+from loguru import logger
+
+from app.services.validation.xml_validator import ARTEFAKT_DIR
+
+
+class Quelle(NamedTuple):
+    url: str
+    # File name in the archive -> target below ARTEFAKT_DIR; a target ending in "/" takes the file's whole folder
+    dateien: Dict[str, str]
+    xsd: bool = False
+
+
+UBL_URL = "https://docs.oasis-open.org/ubl/os-UBL-2.1/UBL-2.1.zip"
+EN16931_URL = "https://github.com/ConnectingEurope/eInvoicing-EN16931/archive/refs/tags/validation-1.3.13.zip"
+XRECHNUNG_URL = (
+    "https://github.com/itplr-kosit/xrechnung-schematron/releases/download/v2.0.1/xrechnung-3.0.1-schematron-2.0.1.zip"
+)
+
+QUELLEN: Dict[str, Quelle] = {
+    "ubl": Quelle(UBL_URL, {"UBL-Invoice-2.1.xsd": "ubl/"}, xsd=True),
+    "cii": Quelle(EN16931_URL, {"CrossIndustryInvoice_100pD16B.xsd": "cii/"}, xsd=True),
+    "en16931": Quelle(
+        EN16931_URL,
+        {
+            "EN16931-UBL-validation.xslt": "en16931/EN16931-UBL-validation.xslt",
+            "EN16931-CII-validation.xslt": "en16931/EN16931-CII-validation.xslt",
+        },
+    ),
+    "xrechnung": Quelle(
+        XRECHNUNG_URL,
+        {
+            "XRechnung-UBL-validation.xsl": "xrechnung/XRechnung-UBL-validation.xsl",
+            "XRechnung-CII-validation.xsl": "xrechnung/XRechnung-CII-validation.xsl",
+        },
+    ),
+}
+
+
+def _laden(url: str) -> zipfile.ZipFile:
+    logger.info(f"Lade {url}")
+    r = requests.get(url, timeout=(10, 300))
+    r.raise_for_status()
+    try:
+        return zipfile.ZipFile(io.BytesIO(r.content))
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Kein ZIP-Archiv: {url}") from e
+
+
+def _finden(archiv: zipfile.ZipFile, name: str) -> PurePosixPath:
+    treffer = [PurePosixPath(n) for n in archiv.namelist() if PurePosixPath(n).name == name]
+    if not treffer:
+        raise FileNotFoundError(f"{name} nicht im Archiv gefunden")
+    # Examples and test folders carry copies further down
+    return min(treffer, key=lambda p: len(p.parts))
+
+
+def _entpacken(archiv: zipfile.ZipFile, mitglied: str, ziel: Path) -> None:
+    ziel.parent.mkdir(parents=True, exist_ok=True)
+    with archiv.open(mitglied) as src, ziel.open("wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+
+def artefakte_laden(ziel: Optional[Path] = None, nur_xsd: bool = False) -> List[Path]:
+    """Download the artefacts of every source in :data:`QUELLEN`; returns the files written."""
+    ziel = Path(ziel or ARTEFAKT_DIR)
+    archive: Dict[str, zipfile.ZipFile] = {}
+    geschrieben: List[Path] = []
+    for name, quelle in QUELLEN.items():
+        if nur_xsd and not quelle.xsd:
+            continue
+        if quelle.url not in archive:
+            archive[quelle.url] = _laden(quelle.url)
+        archiv = archive[quelle.url]
+        for datei, rel in quelle.dateien.items():
+            pfad = _finden(archiv, datei)
+            if not rel.endswith("/"):
+                _entpacken(archiv, str(pfad), ziel / rel)
+                geschrieben.append(ziel / rel)
+                continue
+            # UBL: the xsd/ folder holding maindoc/ and common/; CII: the schema's own folder
+            basis = pfad.parent.parent if pfad.parent.name == "maindoc" else pfad.parent
+            for mitglied in archiv.namelist():
+                p = PurePosixPath(mitglied)
+                if mitglied.endswith("/") or basis not in p.parents:
+                    continue
+                _entpacken(archiv, mitglied, ziel / rel / p.relative_to(basis))
+                geschrieben.append(ziel / rel / p.relative_to(basis))
+        logger.info(f"{name}: Artefakte unter {ziel}")
+    return geschrieben
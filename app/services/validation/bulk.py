@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Union
+
+from app.services.validation.xml_validator import validate_xml, warm_up
+
+
+def iter_xml_files(paths: Iterable[Union[str, Path]]) -> Iterator[Path]:
+    """Expand files and directories (recursively) into XML files, skipping ``_working``."""
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from sorted(f for f in p.rglob("*.xml") if f.is_file() and "_working" not in f.parts)
+        elif p.is_file():
+            yield p
+
+
+def validate_xml_file(path: Path, schematron: bool = True) -> Dict[str, Any]:
+    """Validate one XML file and return a JSON-ready report. Never raises."""
+    start = time.perf_counter()
+    try:
+        result = validate_xml(path, schematron=schematron).as_dict()
+        result["fehler"] = None
+    except Exception as e:
+        result = {"format": None, "gueltig": False, "verstoesse": [], "geprueft": [], "fehlend": [],
+                  "fehler": f"{type(e).__name__}: {e}"}
+    result["datei"] = str(path)
+    result["dauer_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def bulk_validate_xml(
+    paths: Iterable[Union[str, Path]],
+    schematron: bool = True,
+    workers: Optional[int] = None,
+    chunksize: int = 16,
+) -> Iterator[Dict[str, Any]]:
+    """Validate many XML files in a process pool, yielding reports in input order.
+
+    Every worker compiles the artefacts once at start-up, so the per-file cost
+    is only the validation itself.
+    """
+    files = list(iter_xml_files(paths))
+    task = partial(validate_xml_file, schematron=schematron)
+    if workers == 1 or len(files) <= 1:
+        yield from map(task, files)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up) as pool:
+        yield from pool.map(task, files, chunksize=chunksize)
@@ -0,0 +1,240 @@
+"""XSD and Schematron validation of XRechnung (UBL) and ZUGFeRD (CII) XML.
+
+Artefacts are loaded from ``resources/validation`` (see the README there) once
+per process. Every document is checked against its XSD and the EN 16931
+rules; the XRechnung (CIUS) rules only apply when the document declares the
+XRechnung specification (BT-24), e.g. ZUGFeRD with profile XRECHNUNG. Schematron sources are compiled to XSLT with lxml and the result
+is cached on disk; precompiled XSLT 2.0 stylesheets, as shipped with the
+official EN 16931 and XRechnung releases, run in-process via the optional
+``saxonche`` package.
+"""
+import hashlib
+import os
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+from lxml import etree, isoschematron
+
+from app.domain.rechnung.regeln.regelwerk import Verstoss
+from app.services.ingest.xml_reader import XmlSource
+
+try:
+    from saxonche import PySaxonProcessor
+except Exception:  # pragma: no cover - optional dependency
+    PySaxonProcessor = None
+
+BASE_DIR = Path(__file__).resolve().parents[3]
+ARTEFAKT_DIR = Path(os.getenv("VALIDATION_ARTEFACTS_PATH") or BASE_DIR / "resources" / "validation")
+CACHE_DIR = BASE_DIR / "data" / "cache" / "schematron"
+
+SVRL_NS = "http://purl.oclc.org/dsdl/svrl"
+UBL_INVOICE = "{urn:oasis:names:specification:ubl:schema:xsd:Invoice-2}Invoice"
+UBL_CREDIT_NOTE = "{urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2}CreditNote"
+CII_INVOICE = "{urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100}CrossIndustryInvoice"
+CBC_NS = "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+RSM_NS = "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100"
+RAM_NS = "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100"
+
+_UBL_SCHEMATRON = ("en16931/EN16931-UBL-validation",)
+_CII_SCHEMATRON = ("en16931/EN16931-CII-validation",)
+
+# Root tag → (format, XSD, Schematron stems); paths are relative to ARTEFAKT_DIR
+PROFILE: Dict[str, Tuple[str, str, Tuple[str, ...]]] = {
+    UBL_INVOICE: ("ubl", "ubl/maindoc/UBL-Invoice-2.1.xsd", _UBL_SCHEMATRON),
+    UBL_CREDIT_NOTE: ("ubl", "ubl/maindoc/UBL-CreditNote-2.1.xsd", _UBL_SCHEMATRON),
+    CII_INVOICE: ("cii", "cii/CrossIndustryInvoice_100pD16B.xsd", _CII_SCHEMATRON),
+}
+# Format → XRechnung Schematron stem, for documents declaring XRechnung
+XRECHNUNG_SCHEMATRON: Dict[str, str] = {
+    "ubl": "xrechnung/XRechnung-UBL-validation",
+    "cii": "xrechnung/XRechnung-CII-validation",
+}
+# Specification identifier (BT-24) and, in UBL, the profile (BT-23)
+_SPEZIFIKATION = (
+    f"{{{CBC_NS}}}CustomizationID",
+    f"{{{CBC_NS}}}ProfileID",
+    f"{{{RSM_NS}}}ExchangedDocumentContext/{{{RAM_NS}}}GuidelineSpecifiedDocumentContextParameter/{{{RAM_NS}}}ID",
+)
+
+_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+
+Transform = Callable[[etree._ElementTree], etree._ElementTree]
+
+
+@dataclass
+class Pruefbericht:
+    format: str
+    verstoesse: List[Verstoss] = field(default_factory=list)
+    geprueft: List[str] = field(default_factory=list)
+    fehlend: List[str] = field(default_factory=list)
+
+    @property
+    def gueltig(self) -> Optional[bool]:
+        """``False`` on errors; ``None`` when artefacts were missing, so nothing or not everything was checked."""
+        if any(v.schwere == "fehler" for v in self.verstoesse):
+            return False
+        if not self.geprueft or self.fehlend:
+            return None
+        return True
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["gueltig"] = self.gueltig
+        return data
+
+
+@lru_cache(maxsize=None)
+def _xsd(rel: str) -> Optional[etree.XMLSchema]:
+    path = ARTEFAKT_DIR / rel
+    if not path.exists():
+        logger.warning(f"XSD nicht gefunden, Schemaprüfung entfällt: {path}")
+        return None
+    return etree.XMLSchema(etree.parse(str(path), _PARSER))
+
+
+@lru_cache(maxsize=1)
+def _saxon() -> Any:
+    return PySaxonProcessor(license=False)
+
+
+def _saxon_transform(path: Path) -> Transform:
+    proc = _saxon()
+    executable = proc.new_xslt30_processor().compile_stylesheet(stylesheet_file=str(path))
+
+    def run(doc: etree._ElementTree) -> etree._ElementTree:
+        node = proc.parse_xml(xml_text=etree.tostring(doc, encoding="unicode"))
+        return etree.fromstring(executable.transform_to_string(xdm_node=node).encode("utf-8"), _PARSER).getroottree()
+
+    return run
+
+
+def _xslt_transform(path: Path) -> Optional[Transform]:
+    doc = etree.parse(str(path), _PARSER)
+    if doc.getroot().get("version", "1.0").startswith("1"):
+        return etree.XSLT(doc)
+    if PySaxonProcessor is None:
+        logger.warning(f"XSLT {doc.getroot().get('version')} erfordert das Paket 'saxonche', Prüfung entfällt: {path}")
+        return None
+    return _saxon_transform(path)
+
+
+def _compile_schematron(sch: Path) -> Optional[Transform]:
+    """Compile a Schematron file with lxml, reusing the XSLT cached on disk."""
+    source = sch.read_bytes()
+    key = hashlib.sha256(source + etree.__version__.encode()).hexdigest()[:16]
+    cached = CACHE_DIR / f"{sch.stem}-{key}.xsl"
+    if cached.exists():
+        return etree.XSLT(etree.parse(str(cached), _PARSER))
+
+    doc = etree.fromstring(source, _PARSER).getroottree()
+    binding = doc.getroot().get("queryBinding", "xslt").lower()
+    if binding not in ("xslt", "xslt1"):
+        logger.warning(f"Schematron mit queryBinding '{binding}' benötigt ein vorkompiliertes XSLT (.xsl/.xslt): {sch}")
+        return None
+    xslt_doc = isoschematron.Schematron(doc, store_xslt=True).validator_xslt
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = cached.with_suffix(f".{os.getpid()}.tmp")
+    xslt_doc.write(str(tmp), xml_declaration=True, encoding="utf-8")
+    os.replace(tmp, cached)
+    return etree.XSLT(xslt_doc)
+
+
+@lru_cache(maxsize=None)
+def _schematron(stem: str) -> Optional[Transform]:
+    base = ARTEFAKT_DIR / stem
+    for suffix in (".xslt", ".xsl"):
+        path = base.parent / (base.name + suffix)
+        if path.exists():
+            return _xslt_transform(path)
+    sch = base.parent / (base.name + ".sch")
+    if sch.exists():
+        return _compile_schematron(sch)
+    logger.warning(f"Schematron nicht gefunden, Prüfung entfällt: {base}.(xslt|xsl|sch)")
+    return None
+
+
+def _svrl_verstoesse(report: etree._ElementTree, quelle: str) -> List[Verstoss]:
+    verstoesse = []
+    for el in report.iter(f"{{{SVRL_NS}}}failed-assert", f"{{{SVRL_NS}}}successful-report"):
+        flag = (el.get("flag") or "fatal").lower()
+        meldung = " ".join((el.findtext(f"{{{SVRL_NS}}}text") or "").split())
+        verstoesse.append(Verstoss(
+            el.get("id") or quelle,
+            meldung,
+            el.get("location") or "",
+            "warnung" if flag in ("warning", "information") else "fehler",
+        ))
+    return verstoesse
+
+
+def _parse(source: Union[XmlSource, etree._ElementTree]) -> etree._ElementTree:
+    if isinstance(source, etree._ElementTree):
+        return source
+    if isinstance(source, bytes):
+        return etree.fromstring(source, _PARSER).getroottree()
+    return etree.parse(str(source), _PARSER)
+
+
+def _ist_xrechnung(doc: etree._ElementTree) -> bool:
+    root = doc.getroot()
+    return any("xrechnung" in (root.findtext(pfad) or "").lower() for pfad in _SPEZIFIKATION)
+
+
+def fehlende_artefakte() -> List[str]:
+    """Artefacts not installed below ``ARTEFAKT_DIR``; only checks the files, nothing is compiled."""
+    fehlend = [xsd for xsd in dict.fromkeys(xsd for _, xsd, _ in PROFILE.values()) if not (ARTEFAKT_DIR / xsd).exists()]
+    for stem in sorted({s for _, _, stems in PROFILE.values() for s in stems} | set(XRECHNUNG_SCHEMATRON.values())):
+        base = ARTEFAKT_DIR / stem
+        if not any((base.parent / (base.name + suffix)).exists() for suffix in (".xslt", ".xsl", ".sch")):
+            fehlend.append(stem)
+    return fehlend
+
+
+def warm_up() -> List[str]:
+    """Load and compile every artefact, e.g. at startup or per pool worker; returns the missing ones."""
+    fehlend = []
+    for _, xsd, stems in PROFILE.values():
+        if _xsd(xsd) is None and xsd not in fehlend:
+            fehlend.append(xsd)
+    for stem in sorted({s for _, _, stems in PROFILE.values() for s in stems} | set(XRECHNUNG_SCHEMATRON.values())):
+        if _schematron(stem) is None:
+            fehlend.append(stem)
+    return fehlend
+
+
+def validate_xml(source: Union[XmlSource, etree._ElementTree], schematron: bool = True) -> Pruefbericht:
+    """Validate an invoice document against its XSD and Schematron rules.
+
+    The XRechnung rules run only for documents declaring XRechnung. Artefacts that are not installed are listed in ``fehlend`` instead of
+    failing the check; the report is then not ``gueltig`` but unchecked (``None``).
+    """
+    doc = _parse(source)
+    tag = doc.getroot().tag
+    if tag not in PROFILE:
+        raise ValueError(f"Unbekanntes Rechnungsformat: {tag}")
+    fmt, xsd_rel, stems = PROFILE[tag]
+    bericht = Pruefbericht(fmt)
+
+    schema = _xsd(xsd_rel)
+    if schema is None:
+        bericht.fehlend.append(xsd_rel)
+    else:
+        bericht.geprueft.append(xsd_rel)
+        if not schema.validate(doc):
+            bericht.verstoesse.extend(
+                Verstoss("XSD", e.message, f"Zeile {e.line}") for e in schema.error_log
+            )
+
+    if _ist_xrechnung(doc):
+        stems += (XRECHNUNG_SCHEMATRON[fmt],)
+    for stem in stems if schematron else ():
+        transform = _schematron(stem)
+        if transform is None:
+            bericht.fehlend.append(stem)
+            continue
+        bericht.geprueft.append(stem)
+        bericht.verstoesse.extend(_svrl_verstoesse(transform(doc), Path(stem).name))
+    return bericht
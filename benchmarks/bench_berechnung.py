@@ -0,0 +1,104 @@
+"""Benchmark: exact cents engine vs. the former float-based normalizer totals.
+
+    python -m benchmarks.bench_berechnung [--positionen 10000] [--runs 5]
+
+The legacy functions below are the ``_recalc_positions`` / ``_vat_breakdown`` /
+``_recalc_summen`` implementation the normalizer used before
+``app.domain.rechnung.berechnung`` replaced it.
+"""
+import argparse
+import copy
+import random
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, List, Tuple
+
+from app.domain.rechnung.berechnung import berechne
+
+TWOPLACES = Decimal("0.01")
+
+
+def _round(v: float) -> float:
+    return float(Decimal(str(v)).quantize(TWOPLACES, rounding=ROUND_HALF_UP))
+
+
+def legacy_recalc_positions(draft: Dict[str, Any]) -> None:
+    for pos in draft.get("positionen", []):
+        menge = float(pos.get("menge", 0))
+        einzel = float(pos.get("einzelpreis_netto", 0))
+        pos["positionsbetrag_netto"] = _round(menge * einzel)
+
+
+def legacy_vat_breakdown(draft: Dict[str, Any]) -> List[Dict[str, Any]]:
+    buckets: Dict[Tuple[str, float], Dict[str, Any]] = {}
+    for pos in draft.get("positionen", []):
+        ust = pos.get("umsatzsteuer", {})
+        kat = ust.get("kategorie", "S")
+        satz = float(ust.get("satz", 0))
+        bucket = buckets.setdefault((kat, satz), {"kategorie": kat, "satz": satz, "steuerbasisbetrag": 0.0, "steuerbetrag": 0.0})
+        basis = float(pos.get("positionsbetrag_netto", 0))
+        bucket["steuerbasisbetrag"] = _round(bucket["steuerbasisbetrag"] + basis)
+        bucket["steuerbetrag"] = _round(bucket["steuerbetrag"] + basis * (satz / 100.0))
+    return list(buckets.values())
+
+
+def legacy_recalc_summen(draft: Dict[str, Any]) -> Dict[str, Any]:
+    gesamt_netto = _round(sum(float(p.get("positionsbetrag_netto", 0)) for p in draft.get("positionen", [])))
+    breakdown = legacy_vat_breakdown(draft)
+    gesamt_ust = _round(sum(float(b.get("steuerbetrag", 0)) for b in breakdown))
+    gesamt_brutto = _round(gesamt_netto + gesamt_ust)
+    return {"gesamt_netto": gesamt_netto, "gesamt_umsatzsteuer": gesamt_ust, "gesamt_brutto": gesamt_brutto}
+
+
+def make_positionen(n: int, seed: int = 42) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    return [
+        {
+            "positionsnummer": i + 1,
+            "menge": rnd.choice([1, 2, 3, 0.5, 1.25, 12, 7.5]),
+            "einzelpreis_netto": round(rnd.uniform(0.1, 500), rnd.choice([2, 3, 4])),
+            "umsatzsteuer": {"kategorie": "S", "satz": rnd.choice([19, 7])},
+        }
+        for i in range(n)
+    ]
+
+
+def _time(fn, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--positionen", type=int, default=10_000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    positionen = make_positionen(args.positionen)
+
+    def legacy():
+        draft = {"positionen": copy.deepcopy(positionen)}
+        legacy_recalc_positions(draft)
+        return legacy_recalc_summen(draft)
+
+    t_legacy = _time(legacy, args.runs)
+    t_decimal = _time(lambda: berechne(positionen, vectorize=False), args.runs)
+    t_numpy = _time(lambda: berechne(positionen, vectorize=True), args.runs)
+
+    old = legacy()
+    new = berechne(positionen)["summen"]
+    print(f"Positionen:            {args.positionen}")
+    print(f"legacy float:          {t_legacy * 1000:8.1f} ms")
+    print(f"cents (Decimal):       {t_decimal * 1000:8.1f} ms")
+    print(f"cents (NumPy):         {t_numpy * 1000:8.1f} ms")
+    for key in ("gesamt_netto", "gesamt_umsatzsteuer", "gesamt_brutto"):
+        drift = Decimal(str(old[key])) - new[key]
+        print(f"{key:22} legacy={old[key]:>14.2f} exakt={new[key]:>14} Abweichung={drift}")
+
+
+if __name__ == "__main__":
+    main()
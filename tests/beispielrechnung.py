@@ -0,0 +1,50 @@
+"""Draft of a small, rule-conforming invoice for tests; pass it through ``validate_and_normalize``."""
+from typing import Any, Dict
+
+
+def entwurf(**dokument: Any) -> Dict[str, Any]:
+    return {
+        "dokument": {
+            "rechnungsnummer": "R-2024-001",
+            "rechnungsart": "RECHNUNG",
+            "rechnungsdatum": "2024-03-05",
+            "faelligkeitsdatum": "2024-04-04",
+            "waehrung": "EUR",
+            **dokument,
+        },
+        "verkaeufer": {
+            "name": "Müller Straßenbau GmbH",
+            "umsatzsteuer_id": "DE123456789",
+            "steuernummer": "201/113/40209",
+            "anschrift": {"strasse": "Hauptstr. 1", "plz": "80333", "ort": "München", "land": "DE"},
+        },
+        "kaeufer": {
+            "name": "Kunde AG",
+            "umsatzsteuer_id": "DE987654321",
+            "anschrift": {"strasse": "Weg 2", "plz": "60311", "ort": "Frankfurt", "land": "DE"},
+        },
+        "positionen": [
+            {
+                "positionsnummer": 1,
+                "beschreibung": "Asphaltarbeiten",
+                "menge": 3,
+                "einheit": "HUR",
+                "einzelpreis_netto": 85.5,
+                "umsatzsteuer": {"kategorie": "S", "satz": 19},
+            },
+            {
+                "positionsnummer": 2,
+                "beschreibung": "Fachbuch Straßenbau",
+                "menge": 2,
+                "einheit": "H87",
+                "einzelpreis_netto": 24.99,
+                "umsatzsteuer": {"kategorie": "S", "satz": 7},
+            },
+        ],
+        "nachlaesse_zuschlaege": [
+            {"zuschlag": False, "betrag": 10, "grund": "Rabatt", "umsatzsteuer": {"kategorie": "S", "satz": 19}},
+        ],
+        "summen": {"gesamt_netto": 0, "gesamt_umsatzsteuer": 0, "gesamt_brutto": 0},
+        "zahlung": {"zahlungsart": "SEPA", "iban": "DE02120300000000202051", "bic": "BYLADEM1001"},
+        "bemerkungen": [{"text": "Leistungszeitraum März 2024"}],
+    }
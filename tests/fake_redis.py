@@ -0,0 +1,199 @@
+"""In-memory stand-in for a redis-py client, with the commands :class:`RedisJobQueue` uses.
+
+Values come back as ``bytes`` like from ``redis.Redis`` without
+``decode_responses``. Pipelines buffer commands until ``execute``; after
+``watch`` they run commands immediately until ``multi``, and ``execute``
+raises :class:`WatchError` if a watched key changed in between.
+"""
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+
+class WatchError(Exception):
+    """Same name as ``redis.exceptions.WatchError``."""
+
+
+def _b(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return (repr(value) if isinstance(value, float) else str(value)).encode("utf-8")
+
+
+def _score(value: Any) -> float:
+    return float(value.decode() if isinstance(value, bytes) else value)
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.daten: Dict[str, Any] = {}
+        self.versionen: Dict[str, int] = defaultdict(int)
+        self.lock = threading.RLock()
+
+    def pipeline(self) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def _geaendert(self, key: str) -> None:
+        self.versionen[key] += 1
+
+    # --- hashes
+
+    def hset(self, key: str, mapping: Dict[str, Any]) -> int:
+        with self.lock:
+            h = self.daten.setdefault(key, {})
+            neu = sum(1 for f in mapping if _b(f) not in h)
+            h.update({_b(f): _b(v) for f, v in mapping.items()})
+            self._geaendert(key)
+            return neu
+
+    def hget(self, key: str, feld: str) -> Optional[bytes]:
+        with self.lock:
+            return self.daten.get(key, {}).get(_b(feld))
+
+    def hmget(self, key: str, felder: List[str]) -> List[Optional[bytes]]:
+        with self.lock:
+            h = self.daten.get(key, {})
+            return [h.get(_b(f)) for f in felder]
+
+    def hincrby(self, key: str, feld: str, n: int = 1) -> int:
+        with self.lock:
+            h = self.daten.setdefault(key, {})
+            wert = int(h.get(_b(feld), b"0")) + n
+            h[_b(feld)] = _b(wert)
+            self._geaendert(key)
+            return wert
+
+    def hdel(self, key: str, *felder: str) -> int:
+        with self.lock:
+            h = self.daten.get(key, {})
+            n = sum(1 for f in felder if h.pop(_b(f), None) is not None)
+            self._geaendert(key)
+            return n
+
+    # --- lists
+
+    def lpush(self, key: str, *werte: Any) -> int:
+        with self.lock:
+            liste = self.daten.setdefault(key, [])
+            for wert in werte:
+                liste.insert(0, _b(wert))
+            self._geaendert(key)
+            return len(liste)
+
+    def rpush(self, key: str, *werte: Any) -> int:
+        with self.lock:
+            liste = self.daten.setdefault(key, [])
+            liste.extend(_b(w) for w in werte)
+            self._geaendert(key)
+            return len(liste)
+
+    def rpop(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            liste = self.daten.get(key) or []
+            if not liste:
+                return None
+            self._geaendert(key)
+            return liste.pop()
+
+    # --- sorted sets
+
+    def zadd(self, key: str, mapping: Dict[str, float]) -> int:
+        with self.lock:
+            z = self.daten.setdefault(key, {})
+            neu = sum(1 for m in mapping if _b(m) not in z)
+            z.update({_b(m): float(s) for m, s in mapping.items()})
+            self._geaendert(key)
+            return neu
+
+    def zrem(self, key: str, *mitglieder: Any) -> int:
+        with self.lock:
+            z = self.daten.get(key, {})
+            n = sum(1 for m in mitglieder if z.pop(_b(m), None) is not None)
+            if n:
+                self._geaendert(key)
+            return n
+
+    def zscore(self, key: str, mitglied: Any) -> Optional[float]:
+        with self.lock:
+            return self.daten.get(key, {}).get(_b(mitglied))
+
+    def zrangebyscore(self, key: str, von: Any, bis: Any) -> List[bytes]:
+        with self.lock:
+            z = self.daten.get(key, {})
+            return [m for m, s in sorted(z.items(), key=lambda e: e[1]) if _score(von) <= s <= _score(bis)]
+
+    # --- sets
+
+    def sadd(self, key: str, *werte: Any) -> int:
+        with self.lock:
+            s = self.daten.setdefault(key, set())
+            neu = sum(1 for w in werte if _b(w) not in s)
+            s.update(_b(w) for w in werte)
+            self._geaendert(key)
+            return neu
+
+    def srem(self, key: str, *werte: Any) -> int:
+        with self.lock:
+            s = self.daten.get(key, set())
+            n = sum(1 for w in werte if _b(w) in s)
+            s.difference_update(_b(w) for w in werte)
+            self._geaendert(key)
+            return n
+
+    def smembers(self, key: str) -> set:
+        with self.lock:
+            return set(self.daten.get(key, set()))
+
+    def scard(self, key: str) -> int:
+        with self.lock:
+            return len(self.daten.get(key, set()))
+
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis) -> None:
+        self.client = client
+        self.befehle: List[Any] = []
+        self.beobachtet: Dict[str, int] = {}
+        self.sofort = False
+
+    def __enter__(self) -> "FakePipeline":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.reset()
+
+    def __getattr__(self, name: str) -> Any:
+        befehl = getattr(self.client, name)
+        if self.sofort:
+            return befehl
+
+        def puffern(*args: Any, **kwargs: Any) -> "FakePipeline":
+            self.befehle.append((befehl, args, kwargs))
+            return self
+
+        return puffern
+
+    def watch(self, *keys: str) -> None:
+        with self.client.lock:
+            self.beobachtet.update({k: self.client.versionen[k] for k in keys})
+        self.sofort = True
+
+    def unwatch(self) -> None:
+        self.beobachtet = {}
+        self.sofort = False
+
+    def multi(self) -> None:
+        self.sofort = False
+
+    def reset(self) -> None:
+        self.befehle = []
+        self.unwatch()
+
+    def execute(self) -> List[Any]:
+        with self.client.lock:
+            try:
+                if any(self.client.versionen[k] != v for k, v in self.beobachtet.items()):
+                    raise WatchError("Watched variable changed.")
+                return [befehl(*args, **kwargs) for befehl, args, kwargs in self.befehle]
+            finally:
+                self.reset()
@@ -0,0 +1,78 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+from app.domain.rechnung.berechnung import berechne, line_cents, to_cents
+
+np = pytest.importorskip("numpy")
+
+
+def _positionen(n, seed=7):
+    rnd = random.Random(seed)
+    return [
+        {
+            "menge": rnd.choice([1, 2, 3, 0.5, 1.25, 12.5, 0.333, 7]),
+            "einzelpreis_netto": round(rnd.uniform(0.01, 999.99), rnd.choice([2, 3, 4])),
+            "umsatzsteuer": {"kategorie": "S", "satz": rnd.choice([7, 19])},
+        }
+        for _ in range(n)
+    ]
+
+
+def test_half_up_rounding_away_from_zero():
+    assert [to_cents(v) for v in ("0.005", "-0.005", 1.005, "2.675", "0.0049")] == [1, -1, 101, 268, 0]
+
+
+def test_totals_follow_the_br_co_rules():
+    positionen = [
+        {"menge": 3, "einzelpreis_netto": 0.335, "umsatzsteuer": {"kategorie": "S", "satz": 19}},
+        {"menge": 1, "einzelpreis_netto": 10, "umsatzsteuer": {"kategorie": "S", "satz": 7}},
+        {"menge": 2, "einzelpreis_netto": 5, "umsatzsteuer": {"kategorie": "E", "satz": 0}},
+    ]
+    nz = [
+        {"zuschlag": False, "betrag": "0.50", "umsatzsteuer": {"kategorie": "S", "satz": 19}},
+        {"zuschlag": True, "betrag": 2, "umsatzsteuer": {"kategorie": "S", "satz": 7}},
+    ]
+
+    ergebnis = berechne(positionen, nz)
+
+    assert ergebnis["positionsbetraege"] == [Decimal("1.01"), Decimal("10.00"), Decimal("10.00")]
+    steuer = {(b["kategorie"], b["satz"]): (b["steuerbasisbetrag"], b["steuerbetrag"])
+              for b in ergebnis["umsatzsteuer_aufschluesselung"]}
+    assert steuer == {
+        ("S", Decimal(19)): (Decimal("0.51"), Decimal("0.10")),
+        ("S", Decimal(7)): (Decimal("12.00"), Decimal("0.84")),
+        ("E", Decimal(0)): (Decimal("10.00"), Decimal("0.00")),
+    }
+    assert ergebnis["summen"] == {
+        "gesamt_netto": Decimal("21.01"),
+        "gesamt_umsatzsteuer": Decimal("0.94"),
+        "gesamt_brutto": Decimal("23.45"),
+        "zahlbetrag": Decimal("23.45"),
+        "summe_nachlaesse": Decimal("0.50"),
+        "summe_zuschlaege": Decimal("2.00"),
+        "steuerbasis": Decimal("22.51"),
+    }
+
+
+@pytest.mark.parametrize("n", [1, 50, 2000])
+def test_numpy_path_matches_decimal_path(n):
+    positionen = _positionen(n)
+
+    assert berechne(positionen, vectorize=True) == berechne(positionen, vectorize=False)
+
+
+def test_numpy_path_falls_back_for_values_beyond_its_scale():
+    positionen = [
+        {"menge": 1, "einzelpreis_netto": 0.123456},
+        {"menge": 3e9, "einzelpreis_netto": 4e9},
+    ]
+
+    assert line_cents(positionen, vectorize=True) == [12, 12 * 10**20]
+    assert line_cents(positionen, vectorize=True) == line_cents(positionen, vectorize=False)
+
+
+def test_invalid_amount_is_rejected():
+    with pytest.raises(ValueError, match="Ungültiger Betrag"):
+        berechne([{"menge": "drei", "einzelpreis_netto": 1}])
@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+from app.infrastructure.jobqueue import RedisJobQueue, SqliteJobQueue
+from fake_redis import FakeRedis
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def queue(request, tmp_path):
+    if request.param == "sqlite":
+        return SqliteJobQueue(tmp_path / "queue.sqlite", max_versuche=2)
+    return RedisJobQueue(FakeRedis(), max_versuche=2)
+
+
+def _enqueue(queue, name, klasse="interaktiv"):
+    return queue.enqueue({"name": name, "klasse": klasse}, b"%PDF-1.7 " + name.encode())
+
+
+def test_claim_by_class_then_age(queue):
+    reexport = _enqueue(queue, "r.pdf", "reexport")
+    batch = _enqueue(queue, "b.pdf", "batch")
+    erster = _enqueue(queue, "a.pdf")
+    zweiter = _enqueue(queue, "c.pdf")
+
+    reihenfolge = [queue.claim("w1", 60).id for _ in range(4)]
+
+    assert reihenfolge == [erster, zweiter, batch, reexport]
+    assert queue.claim("w1", 60) is None
+    job = queue.get(erster)
+    assert (job.status, job.worker, job.versuche) == ("laeuft", "w1", 1)
+    assert queue.input(erster) == b"%PDF-1.7 a.pdf"
+
+
+def test_expired_lease_is_requeued_then_fails(queue):
+    job_id = _enqueue(queue, "a.pdf")
+    assert queue.claim("w1", -1).id == job_id
+
+    # The next claim reaps the expired lease and hands the job out again
+    job = queue.claim("w2", -1)
+    assert (job.id, job.worker, job.versuche) == (job_id, "w2", 2)
+    assert not queue.heartbeat(job_id, "w1", 60)
+    assert not queue.complete_extraction(job_id, "w1", {"canonical": {}})
+
+    # Out of attempts: the reaper gives up
+    assert queue.claim("w3", 60) is None
+    job = queue.get(job_id)
+    assert job.status == "fehler"
+    assert "Lease abgelaufen (Worker w2)" in job.fehler
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    job_id = _enqueue(queue, "a.pdf")
+    queue.claim("w1", 0.05)
+    time.sleep(0.02)
+    assert queue.heartbeat(job_id, "w1", 60)
+    time.sleep(0.05)
+
+    assert queue.claim("w2", 60) is None
+    assert queue.complete_extraction(job_id, "w1", {"canonical": {"x": 1}})
+    job = queue.get(job_id)
+    assert (job.status, job.ergebnis) == ("extrahiert", {"canonical": {"x": 1}})
+
+
+def test_retry_until_max_versuche(queue):
+    job_id = _enqueue(queue, "a.pdf")
+    queue.claim("w1", 60)
+    assert queue.fail(job_id, "w1", "OCR kaputt") == "wartend"
+    # Only the holder may fail a job
+    queue.claim("w2", 60)
+    assert queue.fail(job_id, "w1", "zu spät") == "laeuft"
+    assert queue.fail(job_id, "w2", "OCR kaputt") == "fehler"
+
+    job = queue.get(job_id)
+    assert (job.status, job.fehler, job.versuche) == ("fehler", "OCR kaputt", 2)
+    assert queue.claim("w3", 60) is None
+
+
+def test_fail_without_retry(queue):
+    job_id = _enqueue(queue, "a.pdf")
+    queue.claim("w1", 60)
+    assert queue.fail(job_id, "w1", "Zeitlimit", retry=False) == "fehler"
+    assert queue.counts()["fehler"] == 1
+
+
+def test_cancel(queue):
+    wartend = _enqueue(queue, "a.pdf")
+    laufend = _enqueue(queue, "b.pdf")
+    assert queue.cancel(wartend)
+    assert queue.claim("w1", 60).id == laufend
+
+    assert queue.cancel(laufend)
+    assert not queue.heartbeat(laufend, "w1", 60)
+    assert not queue.complete_extraction(laufend, "w1", {"canonical": {}})
+    assert queue.fail(laufend, "w1", "OCR kaputt") == "fehler"
+    assert queue.claim("w2", 60) is None
+    assert [j.fehler for j in queue.list_jobs("fehler")] == ["Abgebrochen", "Abgebrochen"]
+    assert not queue.cancel(laufend)
+
+
+def test_finished_job_is_not_failed_later(queue):
+    job_id = _enqueue(queue, "a.pdf")
+    queue.claim("w1", 60)
+    queue.complete_extraction(job_id, "w1", {"canonical": {}})
+    queue.claim_export(job_id)
+    queue.finish(job_id, {"status": "ok"})
+
+    assert queue.fail(job_id, None, "Export: spät") == "fertig"
+    assert queue.get(job_id).ergebnis == {"status": "ok"}
+
+
+def test_only_one_export_per_job(queue):
+    job_id = _enqueue(queue, "a.pdf")
+    queue.claim("w1", 60)
+    assert queue.claim_export(job_id) is None
+    queue.complete_extraction(job_id, "w1", {"canonical": {"x": 1}})
+
+    job = queue.claim_export(job_id)
+    assert (job.status, job.ergebnis) == ("exportiert", {"canonical": {"x": 1}})
+    assert queue.claim_export(job_id) is None
+    assert not queue.cancel(job_id)
+
+    queue.finish(job_id, {"status": "ok"})
+    queue.finish(job_id, {"status": "nochmal"})
+    assert queue.get(job_id).ergebnis == {"status": "ok"}
+    assert queue.counts()["fertig"] == 1
+
+
+def test_redis_reaper_skips_jobs_that_left_laeuft():
+    queue = RedisJobQueue(FakeRedis(), max_versuche=3)
+    job_id = _enqueue(queue, "a.pdf")
+    queue.claim("w1", 60)
+    assert queue.complete_extraction(job_id, "w1", {"canonical": {}})
+    # A lease entry left behind, e.g. by a heartbeat racing the upload
+    queue.r.zadd(queue._key("leases"), {job_id: time.time() - 1})
+
+    assert queue.claim("w2", 60) is None
+    assert queue.get(job_id).status == "extrahiert"
+    assert queue.r.zscore(queue._key("leases"), job_id) is None
+
+
+def test_redis_transition_retries_after_concurrent_change():
+    client = FakeRedis()
+    queue = RedisJobQueue(client, max_versuche=3)
+    job_id = _enqueue(queue, "a.pdf")
+    queue.claim("w1", 60)
+    laden = queue._laden
+    gestoert = []
+
+    def laden_mit_abbruch(quelle, jid):
+        job = laden(quelle, jid)
+        if not gestoert:
+            # Cancelled between the read and the write of fail()
+            gestoert.append(queue.cancel(jid))
+        return job
+
+    queue._laden = laden_mit_abbruch
+
+    assert queue.fail(job_id, "w1", "OCR kaputt") == "fehler"
+    assert gestoert == [True]
+    job = queue.get(job_id)
+    assert (job.status, job.fehler) == ("fehler", "Abgebrochen")
+    assert queue.claim("w2", 60) is None
@@ -0,0 +1,75 @@
+import pytest
+
+from app.services.llm.json_stream import JsonObjectStream, JsonStreamError
+
+
+def _feed(text, stream=None, size=3):
+    stream = stream or JsonObjectStream()
+    for i in range(0, len(text), size):
+        if stream.feed(text[i:i + size]):
+            break
+    return stream
+
+
+def test_fields_are_reported_as_they_close():
+    felder = []
+    stream = _feed('{"dokument": {"nr": "R-1", "pos": [1, 2.5e1]}, "ok": true, "leer": null}',
+                   JsonObjectStream(on_field=lambda k, v: felder.append((k, v))))
+
+    assert stream.done
+    assert felder == [("dokument", {"nr": "R-1", "pos": [1, 25.0]}), ("ok", True), ("leer", None)]
+    assert stream.result == dict(felder)
+
+
+def test_markdown_fence_and_trailing_text_are_skipped():
+    stream = _feed('Hier das Ergebnis:\n```json\n{"a": [], "b": {}}\n```\nFertig.')
+
+    assert stream.result == {"a": [], "b": {}}
+    assert stream.text.endswith('{"a": [], "b": {}}')
+
+
+def test_escapes_and_braces_inside_strings():
+    text = r'{"text": "Zeile \"1\"\n{kein} [Objekt] \\", "käufer": "Ä"}'
+    stream = _feed(text, size=1)
+
+    assert stream.result == {"text": 'Zeile "1"\n{kein} [Objekt] \\', "käufer": "Ä"}
+
+
+def test_stops_at_the_end_of_the_first_object():
+    stream = JsonObjectStream()
+    assert not stream.feed('{"a": 1')
+    assert stream.feed('}{"b": 2}')
+    # Later chunks are ignored once the object is complete
+    assert stream.feed('noch mehr')
+
+    assert stream.result == {"a": 1}
+    assert stream.text == '{"a": 1}'
+
+
+@pytest.mark.parametrize("text", [
+    '{"a": tru}',
+    '{"a": 01}',
+    '{"a": 1.}',
+    '{"a": nul, "b": 1}',
+    '{"a": -}',
+])
+def test_invalid_literals_fail(text):
+    with pytest.raises(JsonStreamError, match="Ungültiges Literal"):
+        _feed(text)
+
+
+@pytest.mark.parametrize("text, meldung", [
+    ('{"a" 1}', "':' erwartet"),
+    ('{"a": 1 "b": 2}', "',' oder '}' erwartet"),
+    ('{"a": [1, }', "Wert erwartet"),
+    ('{"a": 1,}', "Schlüssel erwartet"),
+])
+def test_structural_errors_fail_at_the_offending_character(text, meldung):
+    stream = JsonObjectStream()
+    with pytest.raises(JsonStreamError, match=meldung):
+        stream.feed(text)
+
+
+def test_too_long_preamble_fails():
+    with pytest.raises(JsonStreamError, match="Kein JSON-Objekt"):
+        _feed("x" * 20, JsonObjectStream(max_preamble=10))
@@ -0,0 +1,42 @@
+import json
+
+from app.services.llm import extractor
+
+
+class _Antwort:
+    def __init__(self, zeilen):
+        self.zeilen = zeilen
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.zeilen)
+
+
+def _chunk(text, logprob):
+    return "data: " + json.dumps(
+        {"choices": [{"delta": {"content": text}, "logprobs": {"content": [{"token": text, "logprob": logprob}]}}]}
+    )
+
+
+def test_stream_with_logprobs(monkeypatch):
+    zeilen = [_chunk('{"dokument": ', -0.1), _chunk('{"nr": 1}', -0.2), _chunk("}", -0.3), "data: [DONE]"]
+    monkeypatch.setattr(extractor.requests, "post", lambda *a, **k: _Antwort(zeilen))
+    logprobs = []
+    statistik = {}
+
+    result = extractor.call_llama_stream("prompt", logprobs=logprobs, statistik=statistik)
+
+    assert result == {"dokument": {"nr": 1}}
+    assert logprobs == [-0.1, -0.2, -0.3]
+    assert statistik["tokens"] == 3
@@ -0,0 +1,115 @@
+import shutil
+from datetime import date
+
+import pytest
+
+from app.infrastructure import rechnungsindex as index
+from app.infrastructure.checkpoints import Lauf
+from app.services.export.outputs import write_outputs
+from app.services.llm.normalizer import validate_and_normalize
+from beispielrechnung import entwurf
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "index.sqlite"
+
+
+def _rechnung(nummer, datum, verkaeufer="Müller Straßenbau GmbH", beschreibung="Asphaltarbeiten"):
+    draft = entwurf(rechnungsnummer=nummer, rechnungsdatum=datum)
+    draft["verkaeufer"]["name"] = verkaeufer
+    draft["positionen"][0]["beschreibung"] = beschreibung
+    return validate_and_normalize(draft)
+
+
+def _ausgeben(root, name, rechnung, quell_hash):
+    out_dir = root / name
+    canonical = rechnung.model_dump_json(indent=2, ensure_ascii=False).encode("utf-8")
+    write_outputs({"canonical_json": canonical}, out_dir, fingerprints={}, quell_hash=quell_hash)
+    return out_dir
+
+
+@pytest.fixture
+def eintraege(tmp_path, db_path):
+    rechnungen = [
+        ("a", _rechnung("R-1", "2024-01-10"), "Scan mit Kostenstelle 4711"),
+        ("b", _rechnung("R-2", "2024-02-10", verkaeufer="STRASSENBAU Nord", beschreibung="Pflasterarbeiten")),
+        ("c", _rechnung("R-3", "2024-03-10", verkaeufer="Ärzte-Bedarf KG", beschreibung="Verbandsmaterial")),
+    ]
+    for name, rechnung, *raw_text in rechnungen:
+        index.index_rechnung(rechnung, str(tmp_path / name), raw_text=raw_text[0] if raw_text else None,
+                             quell_hash=name * 64, db_path=db_path)
+    return {name: rechnung for name, rechnung, *_ in rechnungen}
+
+
+def _nummern(ergebnis):
+    return [e["rechnungsnummer"] for e in ergebnis["eintraege"]]
+
+
+def test_full_text_search(eintraege, db_path):
+    assert _nummern(index.list_rechnungen(q="pflaster", db_path=db_path)) == ["R-2"]
+    # Prefix match over raw text; syntax characters in the input are ignored
+    assert _nummern(index.list_rechnungen(q='kosten* "47', db_path=db_path)) == ["R-1"]
+    # Diacritics are folded by the tokenizer
+    assert _nummern(index.list_rechnungen(q="arzte", db_path=db_path)) == ["R-3"]
+    assert index.list_rechnungen(q="gibtsnicht", db_path=db_path)["gesamt"] == 0
+
+
+def test_supplier_filter_folds_case_fully(eintraege, db_path):
+    # ß folds to ss, so both spellings find both suppliers
+    assert _nummern(index.list_rechnungen(lieferant="straße", db_path=db_path)) == ["R-2", "R-1"]
+    assert _nummern(index.list_rechnungen(lieferant="STRASSE", db_path=db_path)) == ["R-2", "R-1"]
+    assert _nummern(index.list_rechnungen(lieferant="müller", db_path=db_path)) == ["R-1"]
+    assert _nummern(index.list_rechnungen(lieferant="ärzte", db_path=db_path)) == ["R-3"]
+
+
+def test_date_and_amount_filters_and_paging(eintraege, db_path):
+    ergebnis = index.list_rechnungen(von=date(2024, 2, 1), bis=date(2024, 3, 31), limit=1, offset=1, db_path=db_path)
+    assert (ergebnis["gesamt"], _nummern(ergebnis)) == (2, ["R-2"])
+
+    brutto = eintraege["a"].summen.gesamt_brutto
+    assert index.list_rechnungen(min_betrag=brutto, max_betrag=brutto, db_path=db_path)["gesamt"] == 3
+    assert index.list_rechnungen(min_betrag=brutto + 0.01, db_path=db_path)["gesamt"] == 0
+
+
+def test_reindexing_replaces_the_entry(tmp_path, eintraege, db_path):
+    out_dir = str(tmp_path / "a")
+    vorher = index.get_entry(out_dir, db_path=db_path)
+
+    rowid = index.index_rechnung(_rechnung("R-1", "2024-01-10", beschreibung="Fräsarbeiten"), out_dir, db_path=db_path)
+
+    assert rowid == vorher["id"]
+    assert index.list_rechnungen(db_path=db_path)["gesamt"] == 3
+    assert _nummern(index.list_rechnungen(q="fräs", db_path=db_path)) == ["R-1"]
+    assert index.list_rechnungen(q="asphalt", db_path=db_path)["gesamt"] == 0
+
+
+def test_duplicates_need_an_existing_output_directory(tmp_path, db_path):
+    rechnung = _rechnung("R-1", "2024-01-10")
+    out_dir = _ausgeben(tmp_path, "a", rechnung, "a" * 64)
+    index.index_rechnung(rechnung, str(out_dir), quell_hash="a" * 64, db_path=db_path)
+
+    assert index.find_by_hash("a" * 64, db_path=db_path) == str(out_dir)
+    assert index.find_by_key(index.semantic_key(rechnung), db_path=db_path) == str(out_dir)
+    # Same supplier, number and total, formatted differently
+    assert index.semantic_key(_rechnung("r 1", "2024-01-11")) == index.semantic_key(rechnung)
+
+    shutil.rmtree(out_dir)
+    assert index.find_by_hash("a" * 64, db_path=db_path) is None
+    assert index.find_by_key(index.semantic_key(rechnung), db_path=db_path) is None
+
+
+def test_reindex_rebuilds_from_the_output_tree(tmp_path, db_path):
+    root = tmp_path / "output"
+    a = _ausgeben(root, "a", _rechnung("R-1", "2024-01-10"), "a" * 64)
+    _ausgeben(root, "b", _rechnung("R-2", "2024-02-10"), "b" * 64)
+    lauf = Lauf(root / "_working", "a" * 64)
+    lauf.speichern("raw_text", "Kostenstelle 4711".encode("utf-8"), "raw_text.txt")
+    lauf.abschliessen()
+    index.index_rechnung(_rechnung("R-9", "2024-09-10"), str(tmp_path / "weg"), db_path=db_path)
+
+    assert index.reindex(root, db_path=db_path) == 2
+
+    assert _nummern(index.list_rechnungen(db_path=db_path)) == ["R-2", "R-1"]
+    assert _nummern(index.list_rechnungen(q="4711", db_path=db_path)) == ["R-1"]
+    assert index.find_by_hash("a" * 64, db_path=db_path) == str(a.resolve())
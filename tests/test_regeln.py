@@ -0,0 +1,78 @@
+import pytest
+
+from app.domain.rechnung.regeln import Regelverletzung, pruefe
+from app.domain.rechnung.regeln.regelwerk import aktive_regelsaetze
+from app.services.llm.normalizer import validate_and_normalize
+from beispielrechnung import entwurf
+
+
+def _ids(verstoesse):
+    return sorted(v.regel for v in verstoesse)
+
+
+def test_valid_invoice_passes_every_active_set():
+    rechnung = validate_and_normalize(entwurf())
+
+    assert aktive_regelsaetze(rechnung) == ("en_16931", "xrechnung")
+    assert pruefe(rechnung) == []
+
+
+def test_all_blocking_violations_are_reported_at_once():
+    draft = entwurf()
+    draft["verkaeufer"]["umsatzsteuer_id"] = "123456789"
+    draft["positionen"][0]["einheit"] = " "
+    draft["positionen"][1]["umsatzsteuer"] = {"kategorie": "Z", "satz": 7}
+
+    with pytest.raises(Regelverletzung) as e:
+        validate_and_normalize(draft)
+
+    assert [(v.regel, v.pfad) for v in e.value.verstoesse] == [
+        ("BR-CO-09", "verkaeufer.umsatzsteuer_id"),
+        ("BR-23", "positionen.0.einheit"),
+        ("BR-Z-05", "positionen.1.umsatzsteuer.satz"),
+    ]
+
+
+def test_tampered_totals_break_the_br_co_rules():
+    rechnung = validate_and_normalize(entwurf())
+    summen = rechnung.summen.model_copy(update={"gesamt_netto": rechnung.summen.gesamt_netto + 0.01})
+
+    verstoesse = pruefe(rechnung.model_copy(update={"summen": summen}))
+
+    assert _ids(verstoesse) == ["BR-CO-10", "BR-CO-13"]
+
+
+def test_xrechnung_rules_only_warn():
+    draft = entwurf()
+    draft["kaeufer"]["anschrift"]["plz"] = ""
+    rechnung = validate_and_normalize(draft)
+
+    assert [(v.regel, v.schwere) for v in pruefe(rechnung)] == [("BR-DE-9", "warnung")]
+
+
+def test_credit_note_without_reference_only_warns():
+    rechnung = validate_and_normalize(entwurf(rechnungsart="GUTSCHRIFT"))
+
+    assert "gutschrift" in aktive_regelsaetze(rechnung)
+    assert [(v.regel, v.schwere) for v in pruefe(rechnung)] == [("GS-01", "warnung")]
+    assert pruefe(validate_and_normalize(entwurf(rechnungsart="GUTSCHRIFT", vorherige_rechnungsnummer="R-1"))) == []
+
+
+def test_partial_invoice_needs_a_reference():
+    draft = entwurf(rechnungsart="TEILRECHNUNG")
+    draft["bemerkungen"] = []
+
+    with pytest.raises(Regelverletzung, match="TR-01"):
+        validate_and_normalize(draft)
+    assert validate_and_normalize(entwurf(rechnungsart="TEILRECHNUNG", vorherige_rechnungsnummer="A-7"))
+
+
+def test_rent_rules_run_only_when_requested():
+    draft = entwurf()
+    draft["dokument"]["faelligkeitsdatum"] = None
+    rechnung = validate_and_normalize(draft)
+
+    assert "miete" not in aktive_regelsaetze(rechnung)
+    assert _ids(pruefe(rechnung, ["miete"])) == ["MI-01"]
+    with pytest.raises(ValueError, match="Unbekannter Regelsatz"):
+        pruefe(rechnung, ["gibtsnicht"])
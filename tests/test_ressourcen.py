@@ -0,0 +1,93 @@
+from collections import Counter
+
+import pytest
+
+from app.infrastructure import ressourcen
+from app.infrastructure.ressourcen import DEFAULT_GEWICHTE, _Stufe
+
+
+@pytest.fixture(autouse=True)
+def gewichte(monkeypatch):
+    monkeypatch.setattr(ressourcen, "_gewichte", dict(DEFAULT_GEWICHTE))
+
+
+def _belegt(stufe, klasse="interaktiv", mandant=""):
+    assert stufe.anfordern(klasse, mandant) is None
+
+
+def _einreihen(stufe, anfragen):
+    return [(klasse, mandant, stufe.anfordern(klasse, mandant)) for klasse, mandant in anfragen]
+
+
+def _vergeben(stufe, wartend, n):
+    """Release the held slot ``n`` times; the waiters in the order they were granted."""
+    reihenfolge = []
+    for _ in range(n):
+        stufe.freigeben()
+        erteilt = [w for w in wartend if w[2].is_set() and w not in reihenfolge]
+        assert len(erteilt) == 1
+        reihenfolge.extend(erteilt)
+    return [(klasse, mandant) for klasse, mandant, _ in reihenfolge]
+
+
+def test_free_slots_are_taken_without_queuing():
+    stufe = _Stufe(2)
+    _belegt(stufe)
+    _belegt(stufe, "reexport")
+    event = stufe.anfordern("batch", "")
+
+    assert event is not None and not event.is_set()
+    assert (stufe.aktiv, stufe.wartend, stufe.wartend_je_klasse()) == (2, 1, {"batch": 1})
+
+
+def test_classes_share_slots_by_weight():
+    stufe = _Stufe(1)
+    _belegt(stufe)
+    wartend = _einreihen(stufe, [("reexport", "")] * 11 + [("batch", "")] * 11 + [("interaktiv", "")] * 11)
+
+    klassen = [k for k, _ in _vergeben(stufe, wartend, 11)]
+
+    assert Counter(klassen) == {"interaktiv": 8, "batch": 2, "reexport": 1}
+    # Interleaved rather than one class after the other
+    assert klassen == [
+        "interaktiv", "interaktiv", "interaktiv", "batch", "interaktiv", "interaktiv",
+        "interaktiv", "interaktiv", "batch", "reexport", "interaktiv",
+    ]
+
+
+def test_tenants_of_a_class_take_turns():
+    stufe = _Stufe(1)
+    _belegt(stufe)
+    wartend = _einreihen(stufe, [("batch", "gross")] * 4 + [("batch", "klein")] * 2)
+
+    assert _vergeben(stufe, wartend, 6) == [
+        ("batch", "gross"), ("batch", "klein"), ("batch", "gross"), ("batch", "klein"),
+        ("batch", "gross"), ("batch", "gross"),
+    ]
+
+
+def test_idle_class_rejoins_without_saved_up_credit():
+    stufe = _Stufe(1)
+    _belegt(stufe)
+    wartend = _einreihen(stufe, [("batch", "")] * 20)
+    _vergeben(stufe, wartend, 10)
+
+    # Reexport was idle all along; it must not now get ten slots in a row
+    spaet = _einreihen(stufe, [("reexport", "")] * 5)
+    klassen = [k for k, _ in _vergeben(stufe, wartend[10:] + spaet, 6)]
+
+    assert klassen == ["batch", "reexport", "batch", "batch", "reexport", "batch"]
+
+
+def test_withdrawn_waiter_is_skipped():
+    stufe = _Stufe(1)
+    _belegt(stufe)
+    (_, _, zurueck), *rest = _einreihen(stufe, [("interaktiv", "a"), ("interaktiv", "b")])
+
+    assert stufe.zurueckziehen("interaktiv", "a", zurueck)
+    assert stufe.wartend == 1
+    stufe.freigeben()
+
+    assert not zurueck.is_set() and rest[0][2].is_set()
+    assert not stufe.zurueckziehen("interaktiv", "b", rest[0][2])
+    assert (stufe.aktiv, stufe.wartend) == (1, 0)
@@ -0,0 +1,35 @@
+import pytest
+
+from app.domain.rechnung.regeln import pruefe
+from app.services.export.xrechnung.xrechnung_writer import serialize_xrechnung
+from app.services.export.zugferd.zugferd_writer import serialize_zugferd
+from app.services.ingest.einvoice import detect_einvoice, read_einvoice
+from app.services.llm.normalizer import validate_and_normalize
+from beispielrechnung import entwurf
+
+FORMATE = [("ubl", serialize_xrechnung, "xrechnung.xml"), ("cii", serialize_zugferd, "factur-x.xml")]
+
+
+@pytest.mark.parametrize("rechnungsart", ["RECHNUNG", "GUTSCHRIFT"])
+@pytest.mark.parametrize("fmt, serialize, name", FORMATE)
+def test_written_xml_reads_back_unchanged(tmp_path, fmt, serialize, name, rechnungsart):
+    rechnung = validate_and_normalize(entwurf(rechnungsart=rechnungsart, vorherige_rechnungsnummer="R-2023-099"))
+    path = tmp_path / name
+    path.write_bytes(serialize(rechnung))
+
+    assert detect_einvoice(path) == (fmt, path)
+    gelesen = read_einvoice(path)
+
+    assert gelesen.model_dump(mode="json") == rechnung.model_dump(mode="json")
+    assert pruefe(gelesen) == []
+
+
+def test_other_files_are_no_einvoice(tmp_path):
+    xml = tmp_path / "irgendwas.xml"
+    xml.write_text("<Invoice><ID>1</ID></Invoice>", encoding="utf-8")
+    kaputt = tmp_path / "kaputt.xml"
+    kaputt.write_text("<Invoice", encoding="utf-8")
+    text = tmp_path / "rechnung.txt"
+    text.write_text("Rechnung", encoding="utf-8")
+
+    assert [read_einvoice(p) for p in (xml, kaputt, text)] == [None, None, None]